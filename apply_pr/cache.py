@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from osconf import config_from_environment
+
+logger = logging.getLogger(__name__)
+
+
+def cache_config(**config):
+    """Configuration of the local caches (APPLY_PR_CACHE_* variables)"""
+    defaults = {
+        'dir': None,
+        'patches': True,
+        'patches_max_size': 500 * 1024 * 1024,
+    }
+    defaults.update(config)
+    return config_from_environment('APPLY_PR_CACHE', **defaults)
+
+
+def _makedirs(path, mode=0o755):
+    try:
+        os.makedirs(path, mode)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _base_dir(env_var, fallback):
+    base = os.environ.get(env_var)
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), fallback)
+    return os.path.join(base, 'sastre')
+
+
+def cache_dir(*parts):
+    """Return (and create) a directory inside the sastre cache.
+
+    Defaults to ``$XDG_CACHE_HOME/sastre`` (``~/.cache/sastre``) and can be
+    moved with ``APPLY_PR_CACHE_DIR``.
+    """
+    base = cache_config()['dir'] or _base_dir('XDG_CACHE_HOME', '.cache')
+    path = os.path.join(os.path.expanduser(base), *parts)
+    _makedirs(path)
+    return path
+
+
+def config_dir(*parts):
+    """Return (and create) a private directory for the sastre settings"""
+    path = os.path.join(_base_dir('XDG_CONFIG_HOME', '.config'), *parts)
+    _makedirs(path, 0o700)
+    return path
+
+
+def state_dir(*parts):
+    """Return (and create) a directory for the state that must survive the
+    cache (``$XDG_STATE_HOME/sastre``)"""
+    path = os.path.join(
+        _base_dir('XDG_STATE_HOME', os.path.join('.local', 'state')), *parts
+    )
+    _makedirs(path, 0o700)
+    return path
+
+
+def write_atomic(path, data, mode=None):
+    """Write ``data`` (bytes) to ``path`` so readers never see partial files"""
+    directory = os.path.dirname(path)
+    _makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        with io.open(fd, 'wb') as stream:
+            stream.write(data)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default=None):
+    try:
+        with io.open(path, 'r', encoding='utf-8') as stream:
+            return json.load(stream)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(path, data, mode=None):
+    text = json.dumps(data, sort_keys=True)
+    write_atomic(path, text.encode('utf-8'), mode=mode)
+
+
+def _fingerprint(*values):
+    digest = hashlib.sha256()
+    for value in values:
+        if value is None:
+            value = ''
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        digest.update(value)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class HTTPCache(object):
+    """On disk cache of GitHub GET responses revalidated with ETags.
+
+    Each entry is stored as ``<key>.json`` (status, headers and validators)
+    plus ``<key>.body``. Entries older than ``max_age`` seconds are dropped
+    and, when the cache grows over ``max_size`` bytes, the least recently
+    used entries are evicted first.
+    """
+
+    EVICT_EVERY = 50
+
+    def __init__(self, path, max_size=200 * 1024 * 1024,
+                 max_age=30 * 24 * 3600):
+        self.path = path
+        self.max_size = int(max_size)
+        self.max_age = int(max_age)
+        self._stores = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, headers=None):
+        headers = headers or {}
+        return _fingerprint(
+            url, headers.get('Accept'), headers.get('Authorization')
+        )
+
+    def _paths(self, key):
+        base = os.path.join(self.path, key)
+        return base + '.json', base + '.body'
+
+    def get(self, key):
+        """Return ``(metadata, body)`` for ``key`` or ``None``"""
+        meta_path, body_path = self._paths(key)
+        meta = read_json(meta_path)
+        if meta is None:
+            return None
+        if time.time() - meta.get('stored_at', 0) > self.max_age:
+            self._remove(key)
+            return None
+        try:
+            with io.open(body_path, 'rb') as stream:
+                body = stream.read()
+        except (IOError, OSError):
+            return None
+        return meta, body
+
+    def touch(self, key):
+        meta_path = self._paths(key)[0]
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+
+    def store(self, key, url, status, headers, body, encoding=None):
+        meta = {
+            'url': url,
+            'status': status,
+            'headers': dict(headers),
+            'encoding': encoding,
+            'stored_at': time.time(),
+        }
+        meta_path, body_path = self._paths(key)
+        try:
+            write_atomic(body_path, body)
+            write_json(meta_path, meta)
+        except (IOError, OSError) as e:
+            logger.debug('Unable to store %s in the HTTP cache: %s', url, e)
+            return
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            meta_path, body_path = self._paths(key)
+            try:
+                size = (os.path.getsize(meta_path)
+                        + os.path.getsize(body_path))
+                used_at = os.path.getmtime(meta_path)
+            except OSError:
+                size, used_at = 0, 0
+            entries.append((used_at, size, key))
+        return entries
+
+    def evict(self):
+        """Drop expired entries and the LRU ones until under ``max_size``"""
+        entries = sorted(self._entries())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for used_at, size, key in entries:
+            meta = read_json(self._paths(key)[0], default={})
+            expired = now - meta.get('stored_at', 0) > self.max_age
+            if not expired and total <= self.max_size:
+                continue
+            self._remove(key)
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'path': self.path,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+            'max_age': self.max_age,
+        }
+
+    def clear(self):
+        entries = self._entries()
+        for _, _, key in entries:
+            self._remove(key)
+        return len(entries)
+
+
+SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+class PatchStore(object):
+    """Content addressed store of commit patches.
+
+    The patch of a commit never changes, so it is stored once as
+    ``<sha>.patch`` next to a ``<sha>.sha256`` checksum. Reads verify the
+    checksum and the ``From <sha>`` header and drop corrupted entries; the
+    least recently used patches are evicted over ``max_size`` bytes, every
+    ``EVICT_EVERY`` stores (and by :meth:`evict`, once an export is done).
+    """
+
+    EVICT_EVERY = 50
+
+    def __init__(self, path, max_size=500 * 1024 * 1024):
+        self.path = path
+        self.max_size = int(max_size)
+        self._stores = 0
+        self._lock = threading.Lock()
+
+    def _paths(self, sha):
+        if not SHA_RE.match(sha or ''):
+            raise ValueError('Invalid commit sha: {}'.format(sha))
+        base = os.path.join(self.path, sha)
+        return base + '.patch', base + '.sha256'
+
+    @staticmethod
+    def is_valid(sha, data):
+        return data.startswith('From {} '.format(sha).encode('ascii'))
+
+    def get(self, sha):
+        """Return the patch of ``sha`` (bytes) or ``None`` if not stored"""
+        patch_path, checksum_path = self._paths(sha)
+        try:
+            with io.open(patch_path, 'rb') as stream:
+                data = stream.read()
+            with io.open(checksum_path, 'r', encoding='ascii') as stream:
+                checksum = stream.read().strip()
+        except (IOError, OSError):
+            return None
+        if (hashlib.sha256(data).hexdigest() != checksum
+                or not self.is_valid(sha, data)):
+            logger.warning('Removing corrupted cached patch %s', sha)
+            self.remove(sha)
+            return None
+        try:
+            os.utime(patch_path, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, sha, data):
+        if not self.is_valid(sha, data):
+            logger.warning('Not caching patch %s: unexpected content', sha)
+            return False
+        patch_path, checksum_path = self._paths(sha)
+        try:
+            write_atomic(patch_path, data)
+            write_atomic(
+                checksum_path,
+                hashlib.sha256(data).hexdigest().encode('ascii')
+            )
+        except (IOError, OSError) as e:
+            logger.debug('Unable to cache patch %s: %s', sha, e)
+            return False
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+        return True
+
+    def remove(self, sha):
+        for path in self._paths(sha):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for name in os.listdir(self.path):
+            if not name.endswith('.patch'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                entries.append(
+                    (os.path.getmtime(path), os.path.getsize(path),
+                     name[:-len('.patch')])
+                )
+            except OSError:
+                pass
+        return entries
+
+    def evict(self):
+        """Remove the least recently used patches until under max_size"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, sha in entries:
+            if total <= self.max_size:
+                break
+            self.remove(sha)
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'path': self.path,
+            'entries': len(entries),
+            'size': sum(size for _, size, _ in entries),
+            'max_size': self.max_size,
+        }
+
+    def clear(self):
+        entries = self._entries()
+        for _, _, sha in entries:
+            self.remove(sha)
+        return len(entries)
+
+
+def get_patch_store():
+    """Return the patch store or ``None`` when it can not be used"""
+    config = cache_config()
+    if not config['patches']:
+        return None
+    try:
+        path = cache_dir('patches')
+    except (IOError, OSError) as e:
+        logger.warning('Patch cache disabled: %s', e)
+        return None
+    return PatchStore(path, max_size=config['patches_max_size'])
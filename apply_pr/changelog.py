@@ -2,16 +2,22 @@
 from __future__ import (
     with_statement, absolute_import, unicode_literals, print_function
 )
-import requests
+import calendar
+import itertools
 import json
 import re
 import os
+import time
 from slugify import slugify
+from six.moves.urllib.parse import parse_qs, urlparse
 
 from .github_utils import github_config
-from requests.exceptions import ConnectionError
+from .github_client import get_client, map_concurrently
+from .cache import cache_dir, read_json, write_json
+from .exceptions import GitHubError
+from requests.exceptions import ConnectionError, RequestException
 import logging
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
@@ -23,6 +29,27 @@ OFICINA_VIRTUAL = 'oficinavirtual'
 TYPE_LABELS = [ELEC_LABEL, GAS_LABEL, OFICINA_VIRTUAL]
 TOP_FEATURE = u':fire: top feature'
 COMMON_KEY = u'COMÚN'
+CHANGELOG_BRANCH = 'developer'
+GIS_LABEL = 'gis'
+FACTURACIO_LABEL = 'facturacio'
+PULLS_GROUPS = ['no_gis_no_fact', 'gis_no_fact', 'no_gis_fact']
+LABEL_KEYS = [
+    'custom', 'internal', 'bug', 'core', 'atr', 'telegestio', 'gis',
+    'facturacio', 'medidas', 'others', 'traduccions'
+]
+# Printed with the bug fixes at the end
+OUTPUT_LABEL_KEYS = [key for key in LABEL_KEYS if key != 'bug'] + ['bug']
+STATE_VERSION = 1
+# Results GitHub returns at most for a search
+SEARCH_LIMIT = 1000
+# Seconds searched before the previous run, for the clock differences
+UPDATED_MARGIN = 300
+IMAGE_MARKER = 'sastre-image-{}'
+IMAGES_PER_REQUEST = 50
+IMAGES_CACHE_TTL = 24 * 3600
+URL_RE = re.compile(
+    'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+)
 
 
 def get_label(label_keys, labels, skip_custom=False):
@@ -41,42 +68,96 @@ def get_label(label_keys, labels, skip_custom=False):
     return 'others'
 
 
-def get_url_image(image, owner, repository):
+def image_url(image):
+    """URL of a ``![image](url)`` reference"""
+    return image[image.find('(') + 1:-1]
+
+
+def _image_cache_path():
+    return os.path.join(cache_dir('changelog'), 'images.json')
+
+
+def resolve_images(images, owner, repository):
+    """Return the ``image => url`` dict of the ``![image](url)`` references.
+
+    The URL of an image is the one GitHub renders for it. The images are
+    rendered with one ``/markdown`` request per ``IMAGES_PER_REQUEST``,
+    separated by marker paragraphs, and the results are cached for
+    ``IMAGES_CACHE_TTL`` seconds.
+    """
     headers = {
         'Accept': 'application/vnd.github+json',
         'Authorization': 'Bearer %s' % github_config()['token']
     }
     url = "https://api.github.com/markdown"
-    data = {
-        'text': '''{image}'''.format(image=image),
-        'mode': 'gfm',
-        'context': '{owner}/{repository}'.format(owner=owner,
-                                                 repository=repository)
-    }
-    r = requests.api.post(url, headers=headers, json=data)
-    if r.status_code >= 200 and r.status_code < 300:
-        import re
-        text = r.content
-        urls = re.findall(
-            'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
-            text)
-        if urls:
-            return urls[0]
+    try:
+        cache_path = _image_cache_path()
+    except (IOError, OSError) as e:
+        logger.warning('Images cache disabled: {}'.format(e))
+        cache_path = None
+    cache = cache_path and read_json(cache_path, {}) or {}
+    now = time.time()
+    urls = {}
+    missing = []
+    for image in images:
+        if image in urls or image in missing:
+            continue
+        cached = cache.get(image)
+        if cached and now - cached['time'] < IMAGES_CACHE_TTL:
+            urls[image] = cached['url']
         else:
-            return image
-    else:
-        return image
+            missing.append(image)
 
+    def render(batch):
+        text = ''.join(
+            '{}\n\n{}\n\n'.format(IMAGE_MARKER.format(index), image)
+            for index, image in enumerate(batch)
+        )
+        data = {
+            'text': text,
+            'mode': 'gfm',
+            'context': '{owner}/{repository}'.format(owner=owner,
+                                                     repository=repository)
+        }
+        try:
+            r = get_client().post(url, headers=headers, json=data)
+        except ConnectionError as e:
+            logger.warning('Unable to render images: {}'.format(e))
+            return {}
+        if r.status_code < 200 or r.status_code >= 300:
+            return {}
+        parts = re.split(IMAGE_MARKER.format(r'(\d+)'), r.text)
+        rendered = {}
+        for index, html in zip(parts[1::2], parts[2::2]):
+            found = URL_RE.findall(html)
+            if found:
+                rendered[batch[int(index)]] = found[0]
+        return rendered
 
-def print_item_detail(item, owner, repository, key=None):
-    def find_all(a_str, sub):
-        start = 0
-        while True:
-            start = a_str.find(sub, start)
-            if start == -1: return
-            yield start
-            start += len(sub)  # use start += 1 to find overlapping matches
+    batches = [
+        missing[index:index + IMAGES_PER_REQUEST]
+        for index in range(0, len(missing), IMAGES_PER_REQUEST)
+    ]
+    rendered = {}
+    for result in map_concurrently(render, batches):
+        rendered.update(result)
+    if rendered and cache_path:
+        for image, rendered_url in rendered.items():
+            cache[image] = {'url': rendered_url, 'time': now}
+        try:
+            write_json(cache_path, dict(
+                (image, cached) for image, cached in cache.items()
+                if now - cached['time'] < IMAGES_CACHE_TTL
+            ))
+        except (IOError, OSError) as e:
+            logger.warning('Unable to cache the images: {}'.format(e))
+    urls.update(rendered)
+    for image in missing:
+        urls.setdefault(image, image_url(image))
+    return urls
 
+
+def format_body(item, owner, repository):
     body = item['body'] or ''
     body = re.sub('^# ', '#### ', body).strip()
     body = re.sub('\n# ', '\n#### ', body).strip()
@@ -97,16 +178,37 @@ def print_item_detail(item, owner, repository, key=None):
     idx = body.find('#### Afectaciones')
     if idx > 0:
         body = body[:idx - 1] + ''
-    idx_images = list(find_all(body, '![image]'))
-    if idx_images:
+    return body
+
+
+def find_images(body):
+    """``![image](url)`` references of a formatted body"""
+    def find_all(a_str, sub):
+        start = 0
+        while True:
+            start = a_str.find(sub, start)
+            if start == -1: return
+            yield start
+            start += len(sub)  # use start += 1 to find overlapping matches
+
+    images = []
+    for idx_img in find_all(body, '![image]'):
+        id_end_image = body.find(')', idx_img)
+        if id_end_image > 0:
+            images.append(body[idx_img:id_end_image + 1])
+    return images
+
+
+def print_item_detail(item, owner, repository, key=None, image_urls=None):
+    body = format_body(item, owner, repository)
+    images = find_images(body)
+    if images:
+        if image_urls is None:
+            image_urls = resolve_images(images, owner, repository)
         images_to_replace = {}
-        for idx_img in idx_images:
-            id_end_image = body.find(')', idx_img)
-            if id_end_image > 0:
-                image = body[idx_img:id_end_image + 1]
-                new_url = get_url_image(image, owner, repository)
-                new_image = '![image]({})'.format(new_url)
-                images_to_replace[image] = new_image
+        for image in images:
+            new_image = '![image]({})'.format(image_urls[image])
+            images_to_replace[image] = new_image
         for image, new_image in images_to_replace.items():
             body = body.replace(image, new_image)
 
@@ -137,216 +239,360 @@ def print_item(item, milestone):
     return (message)
 
 
-def get_pulls(url):
+def _search_range(url, since, until):
+    """``url`` restricted to the PRs merged between two timestamps"""
+    return url.replace('?q=', '?q=merged:{}..{}+'.format(
+        time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(since)),
+        time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(until)),
+    ), 1)
+
+
+def _parse_date(value):
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def iter_search_pages(url, base=None):
+    """Yield the items of each page of a search as it is fetched. ``base``
+    is the base branch the search is restricted to, kept as ``base_ref`` of
+    the items. A page that can not be fetched (or is incomplete) raises
+    :class:`GitHubError`, so no result is silently left out.
+
+    The first page is requested alone to know the number of pages; the
+    other ones are requested concurrently. GitHub returns at most
+    ``SEARCH_LIMIT`` results of a search, so bigger searches of merged PRs
+    are split in ``merged:`` date ranges that are searched in parallel; the
+    pages are then sorted by range instead of by the search order.
+    """
     headers = {
         'Accept': 'application/vnd.github.cannonball-preview+json',
         'Authorization': 'token %s' % github_config()['token']
     }
-    # NO GIS NO FACT
-    r = requests.get(url, headers=headers)
-    pull = json.loads(r.text)
-    total_prs = pull['total_count']
-    pulls_items = []
-    total_fetch = 0
-    page = 1
-    while total_fetch < total_prs:
-        items = pull.get('items', None)
-        if items is None:
-            break
-        # pprint.pprint(items)
-        total_fetch += len(items)
-        pulls_items += items
-        if total_fetch >= total_prs:
-            break
-        page += 1
-        new_url = url + "&page={}".format(page)
-        r = requests.get(new_url, headers=headers)
-        pull = json.loads(r.text)
-    return pulls_items
+    client = get_client()
+    per_page = int(parse_qs(urlparse(url).query).get('per_page', [30])[0])
+
+    def fetch(page_url):
+        r = client.get(page_url, headers=headers)
+        try:
+            page = json.loads(r.text)
+        except ValueError:
+            page = {}
+        if r.status_code != 200 or page.get('items') is None:
+            raise GitHubError('Search failed {} ({}): {}'.format(
+                page_url, r.status_code, page.get('message', r.text)
+            ))
+        if page.get('incomplete_results'):
+            # GitHub timed out and left some of the results out
+            raise GitHubError('Search incomplete {}'.format(page_url))
+        return page
+
+    def split(since, until):
+        range_url = _search_range(url, since, until)
+        page = fetch(range_url)
+        if page['total_count'] <= SEARCH_LIMIT or until - since < 2:
+            if page['total_count'] > SEARCH_LIMIT:
+                logger.warning('Search truncated: {}'.format(range_url))
+            return [(range_url, page)]
+        middle = (since + until) // 2
+        ranges = map_concurrently(
+            lambda bounds: split(*bounds),
+            [(since, middle), (middle + 1, until)]
+        )
+        return [searched for result in ranges for searched in result]
+
+    first = fetch(url)
+    searches = [(url, first)]
+    if first['total_count'] > SEARCH_LIMIT and 'is:merged' in url:
+        # A PR is merged after being created and the search is sorted by
+        # creation, so no PR was merged before the first one was created
+        searches = split(
+            _parse_date(first['items'][0]['created_at']), int(time.time())
+        )
+
+    seen = set()
+    for search_url, page in searches:
+        total = min(page['total_count'], SEARCH_LIMIT)
+        pages = itertools.chain([page], map_concurrently(
+            lambda number, search_url=search_url: fetch(
+                '{}&page={}'.format(search_url, number)
+            ),
+            range(2, (total + per_page - 1) // per_page + 1)
+        ))
+        for page in pages:
+            items = [item for item in page['items'] if item['id'] not in seen]
+            seen.update(item['id'] for item in items)
+            if base:
+                for item in items:
+                    item['base_ref'] = base
+            yield items
+
+
+def pull_group(item):
+    """Group of a search item by its GIS and facturacio labels, ``None`` for
+    the items with both labels, that the changelog never included"""
+    names = set(label['name'].lower() for label in item['labels'])
+    gis, fact = GIS_LABEL in names, FACTURACIO_LABEL in names
+    if gis and fact:
+        return None
+    if gis:
+        return 'gis_no_fact'
+    if fact:
+        return 'no_gis_fact'
+    return 'no_gis_no_fact'
+
+
+def changelog_state_path(milestone, owner, repository):
+    return os.path.join(
+        cache_dir('changelog', owner, repository),
+        '{}.json'.format(slugify(milestone))
+    )
+
+
+def in_changelog(item, milestone=None):
+    """Whether a search item belongs to the changelog.
+
+    With ``milestone`` the item must be in that milestone, for the searches
+    that are not restricted to it.
+    """
+    names = set(label['name'].lower() for label in item['labels'])
+    if milestone is not None \
+            and (item.get('milestone') or {}).get('title') != milestone:
+        return False
+    if 'internal' in names or 'custom' in names:
+        return False
+    return item.get('base_ref', CHANGELOG_BRANCH) == CHANGELOG_BRANCH
+
+
+def changelog_record(item, group, milestone, owner, repository, image_urls):
+    """Classification and rendered fragments of a changelog item"""
+    url_item = item['html_url']
+    if 'issues' in url_item:
+        kind = 'issue'
+    elif 'pull' in url_item:
+        kind = 'pull'
+    else:
+        kind = 'other'
+    item_info = {
+        'title': item['title'],
+        'number': item['number'],
+        'url': url_item,
+        'body': item['body'],
+        'labels': item['labels'],
+    }
+    key = get_label(LABEL_KEYS, item['labels'])
+    top = get_label([TOP_FEATURE], item['labels'], skip_custom=True)
+    return {
+        'number': item['number'],
+        'created_at': item['created_at'],
+        'updated_at': item['updated_at'],
+        'group': group,
+        'kind': kind,
+        'type_key': get_label(TYPE_LABELS, item['labels'], skip_custom=True),
+        'key': key,
+        'top': TOP_FEATURE.lower() in top,
+        'item': print_item(item_info, milestone),
+        'detail': print_item_detail(
+            item_info, owner, repository, key=key, image_urls=image_urls
+        ),
+    }
+
 
+def render_records(items, milestone, owner, repository):
+    """Records of ``(group, item)`` pairs, resolving their images together"""
+    image_urls = resolve_images([
+        image for _, item in items
+        for image in find_images(format_body(item, owner, repository))
+    ], owner, repository)
+    return [
+        changelog_record(item, group, milestone, owner, repository, image_urls)
+        for group, item in items
+    ]
+
+
+class ChangelogWriter(object):
+    """Buffered sections of the changelog, top and detailed files.
+
+    Each record added goes to the section it is printed in; the sections are
+    sorted like the search results when the files are written, so records
+    can be added in any order.
+    """
+
+    def __init__(self, milestone, changelog_path, show_issues=False):
+        self.milestone = milestone
+        self.changelog_path = changelog_path
+        self.show_issues = show_issues
+        self.sections = {}
+        self.top = []
+        self.issues = []
+        self.others = []
+        self.total = 0
+
+    @staticmethod
+    def _order(record, rank=0):
+        return (
+            rank, PULLS_GROUPS.index(record['group']), record['created_at'],
+            record['number']
+        )
+
+    def add(self, record):
+        self.total += 1
+        if record['kind'] == 'issue':
+            self.issues.append((self._order(record), record))
+            return
+        if record['kind'] != 'pull':
+            self.others.append((self._order(record), record))
+            return
+        if record['top']:
+            self.top.append((self._order(record), record))
+        type_l, key, rank = record['type_key'], record['key'], 0
+        if type_l in (GAS_LABEL, ELEC_LABEL, 'others') \
+                and key in ('custom', 'internal', 'traduccions'):
+            return
+        if type_l == 'others':
+            # Common PRs of these keys are listed after the electric ones
+            if key in ('gis', 'telegestio', 'medidas', 'facturacio'):
+                type_l, rank = ELEC_LABEL, 1
+            else:
+                type_l = COMMON_KEY
+        self.sections.setdefault((type_l, key), []).append(
+            (self._order(record, rank), record)
+        )
+
+    @staticmethod
+    def _sorted(entries):
+        return [record for _, record in sorted(entries, key=lambda e: e[0])]
+
+    def write(self):
+        milestone = self.milestone
+        path = self.changelog_path
+        changelog_file = '{}/changelog_{}.md'.format(path, milestone)
+        top_file = '{}/top_{}.md'.format(path, milestone)
+        detailed_file = '{}/detailed_{}.md'.format(path, milestone)
+        logger.info('Total imported: {}'.format(self.total))
+        logger.info('Writting changelog on {}/:'.format(path))
+        with open(top_file, 'w') as top, \
+                open(changelog_file, 'w') as f, \
+                open(detailed_file, 'w') as detailed:
+            top.write(
+                "# TOP FEATURES version {milestone}\n".format(
+                    milestone=milestone))
+            for pull in self._sorted(self.top):
+                top.write(pull['item'])
+            f.write(
+                "# Changelog version {milestone}\n".format(
+                    milestone=milestone))
+            detailed.write(
+                "# Detalles version {milestone}\n".format(
+                    milestone=milestone))
+            for type_l in TYPE_LABELS + [COMMON_KEY]:
+                header = '\n## {key}\n'.format(key=type_l.upper())
+                f.write(header)
+                detailed.write(header)
+                for key in OUTPUT_LABEL_KEYS:
+                    pulls = self._sorted(self.sections.get((type_l, key), []))
+                    if not pulls:
+                        continue
+                    header = '\n### {key}\n'.format(key=key.upper())
+                    f.write(header)
+                    detailed.write(header)
+                    for pull in pulls:
+                        f.write(pull['item'])
+                        detailed.write(pull['detail'])
+            if self.show_issues:
+                f.write('\n# Issues:  \n')
+                for issue in self._sorted(self.issues):
+                    f.write(issue['item'])
+                    detailed.write(issue['detail'])
+            if self.others:
+                f.write('\n# Others :  \n')
+                for pull in self._sorted(self.others):
+                    f.write(pull['item'])
+                    detailed.write(pull['detail'])
+        for name in (top_file, changelog_file, detailed_file):
+            logger.info('    {}'.format(name))
 
 
 def make_changelog(
         milestone, show_issues=False, changelog_path='/tmp',
-        owner='gisce', repository='erp'):
-    import copy
+        owner='gisce', repository='erp', full=False):
+    """Generate the changelog files of a milestone.
+
+    The search results are classified page by page and rendered in the
+    background while the next pages are fetched; only the slim records
+    (classification and rendered fragments) are kept. They are saved in a
+    state file of the milestone, so later runs only search the PRs updated
+    since the previous one (``full`` renders everything again).
+    """
     if not os.path.exists(changelog_path):
         os.makedirs(changelog_path)
-    headers = {
-        'Accept': 'application/vnd.github+json',
-        'Authorization': 'Bearer %s' % github_config()['token']
-    }
-    pulls_items = []
-    logger.info('Getting PRs from GitHub')
-    # NO GIS NO FACT
-    url = ("https://api.github.com/search/issues"
-           "?q=is:pr+is:merged+milestone:{milestone}+repo:{owner}/{repository}+-label:internal+-label:custom+-label:GIS+-label:facturacio"
-           "&type=pr"
-           "&sort=create"
-           "d&order=asc"
-           "&per_page=250").format(
-        milestone=milestone, owner=owner, repository=repository
-    )
-    pulls_no_gis_no_fact = get_pulls(url)
-    print('Total PRs no GIS no Fact: {}'.format(len(pulls_no_gis_no_fact)))
-    pulls_items.extend(pulls_no_gis_no_fact)
-    url = ("https://api.github.com/search/issues"
-           "?q=is:pr+is:merged+milestone:{milestone}+repo:{owner}/{repository}+-label:internal+-label:custom+label:GIS+-label:facturacio"
-           "&type=pr"
-           "&sort=create"
-           "d&order=asc"
-           "&per_page=100").format(
-        milestone=milestone, owner=owner, repository=repository
+    state_path = changelog_state_path(milestone, owner, repository)
+    state = None if full else read_json(state_path)
+    if not state or state.get('version') != STATE_VERSION:
+        state = {'version': STATE_VERSION, 'pulls': {}}
+    started = time.time()
+    query = ("is:pr+is:merged+repo:{owner}/{repository}+base:{branch}").format(
+        owner=owner, repository=repository, branch=CHANGELOG_BRANCH
     )
-    pulls_gis_no_fact = get_pulls(url)
-    print('Total PRs GIS no Fact: {}'.format(len(pulls_gis_no_fact)))
-    pulls_items.extend(pulls_gis_no_fact)
+    if state.get('last_run'):
+        since = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+            state['last_run'] - UPDATED_MARGIN
+        ))
+        logger.info('Getting PRs updated since {} from GitHub'.format(since))
+        # Without the milestone and labels filters, to find the PRs that
+        # have been removed from the changelog too
+        query += '+updated:>{}'.format(since)
+        in_milestone = milestone
+    else:
+        logger.info('Getting PRs from GitHub')
+        query += '+milestone:{}+-label:internal+-label:custom'.format(
+            milestone
+        )
+        in_milestone = None
     url = ("https://api.github.com/search/issues"
-           "?q=is:pr+is:merged+milestone:{milestone}+repo:{owner}/{repository}+-label:internal+-label:custom+-label:GIS+label:facturacio"
+           "?q={query}"
            "&type=pr"
            "&sort=create"
            "d&order=asc"
-           "&per_page=100").format(
-        milestone=milestone, owner=owner, repository=repository
-    )
-    pulls_no_gis_fact = get_pulls(url)
-    print('Total PRs no GIS no Fact: {}'.format(len(pulls_no_gis_fact)))
-    pulls_items.extend(pulls_no_gis_fact)
-    isses_desc = []
-    top_pulls = []
-    pulls_desc = OrderedDict(
-        [
-            ('custom', []),
-            ('internal', []),
-            ('bug', []),
-            ('core', []),
-            ('atr', []),
-            ('telegestio', []),
-            ('gis', []),
-            ('facturacio', []),
-            ('medidas', []),
-            ('others', []),
-            ('traduccions', []),
-
-        ]
-    )
-    pulls_sep = {
-        GAS_LABEL: copy.deepcopy(pulls_desc),
-        ELEC_LABEL: copy.deepcopy(pulls_desc),
-        OFICINA_VIRTUAL: copy.deepcopy(pulls_desc),
-        'others': copy.deepcopy(pulls_desc)
-    }
-    label_keys = list(pulls_desc.keys())
-    other_desc = []
-    changelog_file = 'changelog_{}.md'.format(milestone)
-    top_file = 'top_{}.md'.format(milestone)
-    detailed_file = 'detailed_{}.md'.format(milestone)
-    print('Total PRs: {}'.format(len(pulls_items)))
-    number = 0
-    for item in tqdm(pulls_items):
-        url_item = item['html_url']
-        item_info = {
-            'title': item['title'],
-            'number': item['number'],
-            'url': url_item,
-            'body': item['body'],
-            'labels': item['labels'],
-        }
-        if 'issues' in url_item:
-            isses_desc.append(item_info)
-        elif 'pull' in url_item:
-            p_url = "https://api.github.com/repos/{owner}/{repository}/pulls/{number}".format(
-                owner=owner, repository=repository, number=item_info['number']
-            )
-            try:
-                r = requests.get(p_url, headers=headers)
-                pull_desc = json.loads(r.text)
-                item_info['pull_info'] = pull_desc
-                branch = pull_desc['base']['ref']
-            except ConnectionError as e:
-                tqdm.write(
-                    'Failed to get infor for  {}'.format(item_info['number']))
-                branch = 'developer'
-
-            if branch != 'developer':
-                continue
-            type_key = get_label(TYPE_LABELS, item['labels'], skip_custom=True)
-            top = get_label([TOP_FEATURE], item['labels'], skip_custom=True)
-            if TOP_FEATURE.lower() in top:
-                top_pulls.append(item_info)
-            key = get_label(label_keys, item['labels'])
-            pulls_sep[type_key][key].append(item_info)
-        else:
-            other_desc.append(item_info)
-        number += 1
-    logger.info('Total imported: {}'.format(number))
-    pulls_sep[GAS_LABEL].pop('custom')
-    pulls_sep[ELEC_LABEL].pop('custom')
-    pulls_sep[GAS_LABEL].pop('internal')
-    pulls_sep[ELEC_LABEL].pop('internal')
-    pulls_sep[ELEC_LABEL].pop('traduccions')
-    pulls_sep[GAS_LABEL].pop('traduccions')
-    for key in ['gis', 'telegestio', 'medidas', 'facturacio']:
-        pulls_sep[ELEC_LABEL][key] += pulls_sep['others'][key]
-        pulls_sep['others'][key] = []
-    pulls_sep['others'].pop('custom')
-    pulls_sep['others'].pop('traduccions')
-    pulls_sep['others'].pop('internal')
-    pulls_sep[COMMON_KEY] = pulls_sep.pop('others')
-    index_bug = label_keys.index('bug')
-    label_keys.pop(index_bug)
-    label_keys.append('bug')
-
-    # TOP FEATURES
-    logger.info('Writting top feature on {}/:'.format(changelog_path))
-    with open('{}/{}'.format(changelog_path, top_file), 'w') as f:
-        f.write(
-            "# TOP FEATURES version {milestone}\n".format(milestone=milestone))
-        for pull in top_pulls:
-            f.write(print_item(pull, milestone))
-
-    # CHANGELOGS
-    logger.info('Writting changelog on {}/:'.format(changelog_path))
-    with open('{}/{}'.format(changelog_path, changelog_file), 'w') as f:
-        f.write("# Changelog version {milestone}\n".format(milestone=milestone))
-        for type_l in TYPE_LABELS + [COMMON_KEY]:
-            f.write('\n## {key}\n'.format(key=type_l.upper()))
-            for key in label_keys:
-                pulls = pulls_sep[type_l].get(key, [])
-                if pulls:
-                    f.write('\n### {key}\n'.format(key=key.upper()))
-                    for pull in pulls:
-                        f.write(print_item(pull, milestone))
-        if show_issues:
-            f.write('\n# Issues:  \n')
-            for issue in isses_desc:
-                f.write(print_item(issue, milestone))
-        if other_desc:
-            f.write('\n# Others :  \n')
-            for pull in other_desc:
-                f.write(print_item(pull, milestone))
-    logger.info('    {}/{}'.format(changelog_path, changelog_file))
-    with open('{}/{}'.format(changelog_path, detailed_file), 'w') as f:
-        f.write("# Detalles version {milestone}\n".format(milestone=milestone))
-        for type_l in TYPE_LABELS + [COMMON_KEY]:
-            f.write('\n## {key}\n'.format(key=type_l.upper()))
-            for key in label_keys:
-                pulls = pulls_sep[type_l].get(key, [])
-                if pulls:
-                    f.write('\n### {key}\n'.format(key=key.upper()))
-                    for pull in tqdm(pulls,
-                                     desc=' Generating info {} - {}'.format(
-                                             type_l.upper(), key)):
-                        f.write(
-                            print_item_detail(pull, owner, repository, key=key))
-        if show_issues:
-            logger.info('\n# Issues:  \n')
-            for issue in isses_desc:
-                f.write(print_item_detail(issue, owner, repository, key=key))
-        if other_desc:
-            print('\n# Others :  \n')
-            for pull in tqdm(other_desc,
-                             desc=' Generating info for OTHER INFO'):
-                f.write(print_item_detail(pull, owner, repository, key=key))
-    logger.info('    {}/{}'.format(changelog_path, detailed_file))
+           "&per_page=100").format(query=query)
+    totals = dict((group, 0) for group in PULLS_GROUPS)
+    rendering = []
+    failure = None
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        try:
+            for items in iter_search_pages(url, base=CHANGELOG_BRANCH):
+                page = []
+                for item in items:
+                    state['pulls'].pop(str(item['number']), None)
+                    group = (
+                        in_changelog(item, in_milestone) and pull_group(item)
+                    )
+                    if group:
+                        totals[group] += 1
+                        page.append((group, item))
+                if page:
+                    rendering.append(executor.submit(
+                        render_records, page, milestone, owner, repository
+                    ))
+        except (RequestException, GitHubError) as e:
+            failure = e
+        for future in tqdm(rendering, desc='Rendering PRs'):
+            for record in future.result():
+                state['pulls'][str(record['number'])] = record
+    print('Total PRs no GIS no Fact: {}'.format(totals['no_gis_no_fact']))
+    print('Total PRs GIS no Fact: {}'.format(totals['gis_no_fact']))
+    print('Total PRs no GIS Fact: {}'.format(totals['no_gis_fact']))
+    if failure is None:
+        state['last_run'] = started
+    # The PRs already fetched are kept; without a complete search the
+    # previous last_run is kept, so the next run searches them all again
+    try:
+        write_json(state_path, state)
+    except (IOError, OSError) as e:
+        logger.warning('Unable to save the changelog state: {}'.format(e))
+    if failure is not None:
+        raise failure
+    print('Total PRs: {}'.format(len(state['pulls'])))
+    writer = ChangelogWriter(milestone, changelog_path, show_issues)
+    for record in state['pulls'].values():
+        writer.add(record)
+    writer.write()
     return True
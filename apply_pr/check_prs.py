@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Status of a list of PRs against a version, for ``sastre check_prs``"""
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+import re
+
+from fabric import colors
+from tqdm import tqdm
+
+from .deploys import config
+from .github_client import map_concurrently
+from .github_utils import github_config
+from .graphql import get_pull_requests
+
+
+def prs_status(
+        prs, separator=' ', owner='gisce', repository='erp', version=False):
+    from packaging import version as vsn
+    from giscemultitools.githubutils.objects import GHAPIRequester
+    from giscemultitools.githubutils.utils import GithubUtils
+
+    headers = {
+        'Accept': 'application/vnd.github.cannonball-preview+json',
+        'Authorization': 'token %s' % github_config()['token']
+    }
+    prs = re.sub('{}+'.format(separator), separator, prs)
+    pr_list = prs.split(separator)
+    PRS = {}
+    ERRORS = []
+    TO_APPLY = []
+    TO_APPLY_CAUSE_PROJECT_VERSION_ERROR = []
+    CLOSED_PRS = []
+    IN_PROJECTS = []
+    batch_size = config.get('graphql_batch_size', 50)
+    def get_prs_info_one_by_one(plist):
+        rep = GHAPIRequester(owner, repository)
+
+        def get_pr_info(_pr):
+            try:
+                return GithubUtils.plain_get_commits_sha_from_merge_commit(
+                    rep.get_pull_request_projects_and_commits(int(_pr))
+                )
+            except Exception:
+                return {'pullRequest': {'number': _pr}}
+
+        plist = list(set(plist))
+        return list(tqdm(
+            map_concurrently(get_pr_info, plist), total=len(plist),
+            desc='Getting pr data from Github'
+        ))
+
+    def get_prs_info_batched(plist):
+        res = []
+        numbers = {}
+        for _pr in set(plist):
+            try:
+                numbers[int(_pr)] = _pr
+            except ValueError:
+                res.append({'pullRequest': {'number': _pr}})
+        tqdm.write('Getting pr data from Github ({} PRs)'.format(len(numbers)))
+        pulls = get_pull_requests(
+            owner, repository, numbers, github_config()['token'],
+            batch_size=batch_size
+        )
+        missing = [_pr for number, _pr in numbers.items() if not pulls[number]]
+        if missing:
+            # Not retrieved with GraphQL, try them one by one with REST
+            res.extend(get_prs_info_one_by_one(missing))
+        for number, _pr in numbers.items():
+            if not pulls[number]:
+                continue
+            try:
+                pull = pulls[number]
+                pull.setdefault('commits', {'nodes': []})
+                res.append(
+                    GithubUtils.plain_get_commits_sha_from_merge_commit(
+                        {'data': {'repository': {'pullRequest': pull}}}
+                    )
+                )
+            except Exception:
+                res.append({'pullRequest': {'number': _pr}})
+        return res
+
+    def get_prs_info(plist):
+        if batch_size:
+            res = get_prs_info_batched(plist)
+        else:
+            res = get_prs_info_one_by_one(plist)
+        if res:
+            max_meged_at = '2999-12-27T06:22:04Z'
+            return sorted(
+                res, key=lambda _p: (
+                    _p['pullRequest'].get('mergedAt', max_meged_at) or max_meged_at,
+                    _p['pullRequest'].get('createdAt') if (_p['pullRequest'].get('mergedAt', max_meged_at) or max_meged_at) == max_meged_at else ''
+                )
+            )
+        return res
+
+    def check_version_project_done(project_items):
+        if version:
+            parsed_version = version.split('.')
+            parsed_version = '{}.{}'.format(parsed_version[0], parsed_version[1])
+            for _project in project_items:
+                if _project['project_name'].startswith(parsed_version) and _project['card_state'] != 'Done':
+                    return False
+        return True
+
+    for pull_info in tqdm(get_prs_info(pr_list), desc='Process PRs info'):
+        pr_number = pull_info['pullRequest']['number']
+        try:
+            pull = pull_info['pullRequest']
+            projects_info = pull_info.get('projectItems', None)
+            projects_show = ''
+            to_apply = '{}'.format(str(pr_number))
+            projects = ''
+            if projects_info:
+                projects = ','.join(
+                    [x['project_name'] for x in projects_info if x['card_state'] == 'Done']
+                )
+                if projects:
+                    projects_show = 'PROJECTS => {}'.format(projects)
+                    to_apply += ' ({})'.format(projects)
+            state_pr = pull['state']
+            merged_at = pull['mergedAt']
+            created_at = pull['createdAt']
+            milestone = pull['milestone'] or '(With out Milestone)'
+            message = (
+                'PR {number}=>'
+                ' state {state_pr}'
+                ' merged_at {merged_at}'
+                ' created_at {created_at}'
+                ' milestone {milestone}'
+                ' {projects} '.format(
+                    number=pr_number, state_pr=state_pr,
+                    merged_at=merged_at, created_at=created_at,
+                    milestone=milestone, projects=projects_show
+                )
+            )
+            if version:
+                if milestone != '(With out Milestone)' and vsn.parse(milestone) <= vsn.parse(version):
+                    if state_pr.upper() != 'MERGED':
+                        message = colors.yellow(message)
+                        if state_pr.upper() == 'CLOSED':
+                            CLOSED_PRS.append(to_apply)
+                        elif not projects:
+                            TO_APPLY.append(to_apply)
+                        else:
+                            IN_PROJECTS.append(to_apply)
+                    else:
+                        message = colors.green(message)
+                else:
+                    message = colors.red(message)
+                    if not projects:
+                        TO_APPLY.append(to_apply)
+                    elif not check_version_project_done(projects_info):
+                        TO_APPLY.append('{}'.format(str(pr_number)))
+                        TO_APPLY_CAUSE_PROJECT_VERSION_ERROR.append(to_apply)
+                    else:
+                        IN_PROJECTS.append(to_apply)
+            PRS.setdefault(milestone, [])
+            PRS[milestone] += [message]
+        except Exception as e:
+            # logger.error('Error PR {0}'.format(pr_number))
+            err_msg = colors.red(
+                'Error PR {2} : https://github.com/{0}/{1}/pull/{2}'.format(
+                    owner, repository, pr_number
+                )
+            )
+            tqdm.write(err_msg)
+            ERRORS.append(err_msg)
+    for milestone in sorted(PRS.keys()):
+        print('\nMilestone {}'.format(milestone))
+        for prmsg in PRS[milestone]:
+            print('\t{}'.format(prmsg))
+    for prmsg in ERRORS:
+        print('ERR\t{}'.format(prmsg))
+    if version:
+        print(colors.magenta('\nIncluded in projects\n'))
+        for x in IN_PROJECTS:
+            print(colors.magenta('* {}'.format(x)))
+        print(colors.red('\nIncluded in version project but in Error State\n'))
+        for _pr_project in TO_APPLY_CAUSE_PROJECT_VERSION_ERROR:
+            print(colors.red('* {}'.format(_pr_project)))
+        if CLOSED_PRS:
+            print(colors.red('\n############# Closed PRS: "{}"\n'.format(
+                ' '.join(CLOSED_PRS)
+            )))
+        if ERRORS:
+            print(colors.yellow('\n⚠ ️WARNING ⚠ ️! ERRORS IN PRS. MUST BE REVIEW\n'))
+            print(colors.yellow('##########################################\n'))
+            for prmsg in ERRORS:
+                print('ERR\t{}'.format(prmsg))
+            print(colors.yellow('############# END ERROR PRS ###############\n'))
+        print(colors.yellow(
+            '\nNot Included: "{}"\n'.format(' '.join(TO_APPLY))
+        ))
+        for x in TO_APPLY:
+            print(
+                 'curl -H \'Authorization: token {token}\' '
+                 '-H "Accept: application/vnd.github.v3.diff" '
+                 'https://api.github.com/repos/gisce/erp/pulls/{pr} --output {pr}.diff'.format(
+                       pr=x, token="$GITHUB_TOKEN")
+            )
+    return True
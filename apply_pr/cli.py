@@ -8,8 +8,8 @@ if six.PY2:
 else:
     from urllib.parse import urlparse
 
-from fabric.tasks import execute, WrappedCallableTask
-from fabric.api import env
+# fabric.api and fabric.tasks load paramiko, they are imported by the
+# commands connecting to a host
 from fabric import colors
 import click
 
@@ -80,6 +80,8 @@ create_changelog_options = github_options + [
         help='Also get the data on the issues'),
     click.option('--changelog_path', default='/tmp', show_default=True,
         help='Path to drop the changelog file in'),
+    click.option('--full', is_flag=True, default=False,
+        help='Render every PR again instead of only the updated ones'),
 ]
 
 mark_deployed_options = github_options + [
@@ -118,7 +120,14 @@ def configure_logging():
     logging.basicConfig(level=log_level)
 
 
+def execute(task, *args, **kwargs):
+    """Run a fabfile task with Fabric"""
+    from fabric.tasks import execute as fabric_execute, WrappedCallableTask
+    return fabric_execute(WrappedCallableTask(task), *args, **kwargs)
+
+
 def configure_ssh_auth(proxy=None):
+    from fabric.api import env
     env.use_ssh_config = True
     if proxy:
         env.gateway = proxy
@@ -198,8 +207,9 @@ def apply_pr(
         local_mode=local_mode, host=host, proxy=proxy
     )
 
-    from apply_pr import fabfile
     if not local_mode:
+        from apply_pr import fabfile
+        from fabric.api import env
         if 'ssh' not in host and host[:2] != '//':
             host = '//{}'.format(host)
         url = urlparse(host, scheme='ssh')
@@ -225,9 +235,10 @@ def apply_pr(
         ))
         configure_logging()
         if local_mode:
+            from apply_pr import deploys
             from apply_pr.local import apply_pr as apply_pr_local
             local_result = apply_pr_local(
-                fabfile, pr_dep, from_number=from_number,
+                deploys, pr_dep, from_number=from_number,
                 from_commit=from_commit, hostname=force_hostname,
                 src=src, owner=owner, repository=repository,
                 auto_exit=auto_exit, force_name=force_name,
@@ -239,9 +250,8 @@ def apply_pr(
             )
             result = {'local': local_result}
         else:
-            apply_pr_task = WrappedCallableTask(fabfile.apply_pr)
             result = execute(
-                apply_pr_task, pr_dep, from_number, from_commit, hostname=force_hostname,
+                fabfile.apply_pr, pr_dep, from_number, from_commit, hostname=force_hostname,
                 src=src, owner=owner, repository=repository, sudo_user=sudo_user,
                 host='{}:{}'.format(url.hostname, (url.port or 22)), auto_exit=auto_exit,
                 force_name=force_name, re_deploy=re_deploy, as_diff=as_diff,
@@ -267,7 +277,7 @@ def apply_pr(
 def deploy(**kwargs):
     """Deploy a PR into a remote server or a local checkout"""
     if not isinstance(kwargs['pr'], (list, tuple)):
-        from apply_pr.fabfile import get_info_from_url
+        from apply_pr.deploys import get_info_from_url
         kwargs.update(get_info_from_url(kwargs['pr']))
     return apply_pr(**kwargs)
 
@@ -288,6 +298,7 @@ def check_pr(
             "Use '--force' to force the usage for this command (as is)"))
         exit()
     from apply_pr import fabfile
+    from fabric.api import env
 
     url = urlparse(host, scheme='ssh')
     env.user = url.username
@@ -296,22 +307,20 @@ def check_pr(
 
     configure_logging()
 
-    check_pr_task = WrappedCallableTask(fabfile.check_pr)
     execute(
-        check_pr_task, pr, src=src, owner=owner, repository=repository,
+        fabfile.check_pr, pr, src=src, owner=owner, repository=repository,
         host='{}:{}'.format(url.hostname, (url.port or 22))
     )
 
 
 def status_pr(deploy_id, status, owner, repository):
     """Update the status of a deploy into GitHub"""
-    from apply_pr import fabfile
+    from apply_pr.deploys import mark_deploy_status
 
     configure_logging()
 
-    mark_deploy_status = WrappedCallableTask(fabfile.mark_deploy_status)
-    execute(mark_deploy_status, deploy_id, status,
-            owner=owner, repository=repository, environment=None)
+    mark_deploy_status(deploy_id, status,
+                       owner=owner, repository=repository, environment=None)
 
 
 @sastre.command(name='status')
@@ -326,8 +335,7 @@ def mark_deployed_backend(pr, force_hostname=False, owner='gisce', repository='e
 
     configure_logging()
 
-    mark_deployed_task = WrappedCallableTask(fabfile.mark_deployed)
-    execute(mark_deployed_task, pr, hostname=force_hostname, owner=owner, repository=repository, environment=environ)
+    execute(fabfile.mark_deployed, pr, hostname=force_hostname, owner=owner, repository=repository, environment=environ)
     click.echo(colors.green(u"Marking PR#{} as deployed success! \U0001F680".format(
         pr
     )))
@@ -342,17 +350,16 @@ def mark_deployed(pr, force_hostname=False, owner='gisce', repository='erp', env
 
 def check_prs_status(prs, separator, version, owner, repository):
     """Check the status of the PRs for a set of PRs"""
-    from apply_pr import fabfile
+    from apply_pr.check_prs import prs_status
 
     log_level = getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper())
     logging.basicConfig(level=log_level)
 
-    check_pr_task = WrappedCallableTask(fabfile.prs_status)
-    execute(check_pr_task, prs,
-            owner=owner,
-            repository=repository,
-            separator=separator,
-            version=version)
+    prs_status(prs,
+               owner=owner,
+               repository=repository,
+               separator=separator,
+               version=version)
 
 
 @sastre.command(name='check_prs')
@@ -364,38 +371,109 @@ def check_prs(**kwargs):
 
 @sastre.command(name='create_changelog')
 @add_options(create_changelog_options)
-def create_changelog(milestone, issues, changelog_path, owner, repository):
+def create_changelog(
+    milestone, issues, changelog_path, owner, repository, full=False
+):
     """Create a changelog for the given milestone"""
-    from apply_pr import fabfile
+    from apply_pr.changelog import make_changelog
 
     log_level = getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper())
     logging.basicConfig(level=log_level)
-    changelog_task = WrappedCallableTask(fabfile.create_changelog)
-    execute(changelog_task,
-            milestone,
-            issues,
-            changelog_path,
-            owner=owner,
-            repository=repository)
+    make_changelog(milestone,
+                   show_issues=issues,
+                   changelog_path=changelog_path,
+                   owner=owner,
+                   repository=repository,
+                   full=full)
 
 
-def deploy_ids(pr, owner, repository):
-    from apply_pr import fabfile
+def deploy_ids(pr, owner, repository, latest_status=False):
+    from apply_pr.deploys import print_deploys
 
     configure_logging()
 
-    get_deploys_task = WrappedCallableTask(fabfile.print_deploys)
-    execute(get_deploys_task, pr,
-            owner=owner, repository=repository)
+    print_deploys(pr,
+                  owner=owner, repository=repository, latest_status=latest_status)
 
 
 @sastre.command(name='get_deploys')
 @click.argument('PR')
+@click.option('--latest-status', help='Only get the latest status of each deploy',
+              is_flag=True, default=False)
 @add_options(github_options)
 def get_deploys(**kwargs):
     """Get deploy IDs and their status for a given PR number"""
     deploy_ids(**kwargs)
 
 
+def _human_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} GiB'.format(size)
+
+
+def _local_caches():
+    from apply_pr.cache import get_patch_store
+    from apply_pr.github_client import get_http_cache
+
+    return [
+        ('HTTP cache', get_http_cache()),
+        ('Patch cache', get_patch_store()),
+    ]
+
+
+@sastre.group(name='cache')
+def cache():
+    """Manage the local cache of GitHub responses and patches"""
+
+
+@cache.command(name='stats')
+def cache_stats():
+    """Show the size of the local caches"""
+    for name, local_cache in _local_caches():
+        if local_cache is None:
+            click.echo('{}: not available'.format(name))
+            continue
+        stats = local_cache.stats()
+        click.echo('{}: {}'.format(name, stats['path']))
+        click.echo('  Entries: {}'.format(stats['entries']))
+        click.echo('  Size: {} (max {})'.format(
+            _human_size(stats['size']), _human_size(stats['max_size'])
+        ))
+
+
+@cache.command(name='clear')
+def cache_clear():
+    """Remove every entry of the local caches"""
+    for name, local_cache in _local_caches():
+        if local_cache is None:
+            continue
+        click.echo('{}: removed {} entries'.format(
+            name, local_cache.clear()
+        ))
+
+
+@sastre.group(name='outbox')
+def outbox():
+    """Manage the GitHub updates waiting to be sent"""
+
+
+@outbox.command(name='flush')
+def outbox_flush():
+    """Send the deploy statuses and labels that could not be sent"""
+    from apply_pr.outbox import Outbox, outbox_path
+
+    configure_logging()
+    delivered, pending = Outbox(outbox_path()).flush()
+    if delivered is None:
+        click.echo('The outbox is being flushed by another process')
+        sys.exit(1)
+    click.echo('Sent {} updates, {} pending'.format(delivered, pending))
+    if pending:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     sastre()
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""GitHub side of a deploy: the patches of a PR and its deployments.
+
+Shared by the fabfile tasks and the local mode, it does not load Fabric's
+SSH stack.
+"""
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+import json
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+import six
+from fabric import colors
+from osconf import config_from_environment
+from requests.exceptions import ConnectionError
+from slugify import slugify
+from tqdm import tqdm
+
+from .cache import cache_dir, get_patch_store
+from .github_api import DEPLOYMENTS_MEDIA_TYPE, GitHubRepository
+from .github_client import get_client
+from .github_utils import github_config
+from .outbox import get_outbox
+from .patches import split_mbox, write_manifest
+
+logger = logging.getLogger(__name__)
+
+
+def apply_pr_config(**config):
+    return config_from_environment('APPLY_PR', **config)
+
+
+config = apply_pr_config()
+
+DEPLOYED = {'pro': 'deployed', 'pre': 'deployed PRE', 'test': 'deployed PRE'}
+
+# Committer dates come from the author's machine, the deployments are searched
+# this far before the oldest one
+DEPLOYMENTS_SINCE_MARGIN = timedelta(days=7)
+
+GITHUB_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def make_dirs(path):
+    """``mkdir -p`` of a path relative to the current directory"""
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError:
+        logger.error('Permission denied to write {} in the current directory'.format(path))
+        raise
+
+
+def github_repository(owner='gisce', repository='erp'):
+    return GitHubRepository(owner, repository, github_config()['token'])
+
+
+def get_info_from_url(pr):
+    if pr.startswith('https://'):
+        vals = pr.split('/')
+        info = {
+           'owner': vals[3],
+           'repository': vals[4],
+           'pr': vals[6]
+        }
+        if len(vals) == 9 and vals[7] in ('commits', 'changes'):
+            info['from_commit'] = vals[8]
+        return info
+    else:
+        return {'pr': pr}
+
+
+def find_from_to_commits(pr_number, owner='gisce', repository='erp'):
+    pull = github_repository(owner, repository).pull(pr_number)
+    from_commit = pull['base']['sha']
+    to_commit = pull['head']['sha']
+    head_origin, head_branch = pull['head']['label'].split(':')
+    base_origin, base_branch = pull['base']['label'].split(':')
+    if head_origin != base_origin or pull['merged']:
+        branch = None
+    else:
+        branch = head_branch
+    logger.info('Commits: %s..%s (%s)' % (from_commit, to_commit, branch))
+    return from_commit, to_commit, branch
+
+
+def export_patches_from_mirror(
+    pr_number, from_commit=None, owner='gisce', repository='erp'
+):
+    """Generate the patches of a PR from a local bare mirror.
+
+    The mirror lives in APPLY_PR_MIRROR_PATH (by default in the sastre
+    cache) and is cloned from APPLY_PR_MIRROR_URL.
+    """
+    patch_folder = "deploy/patches/%s" % pr_number
+    make_dirs(patch_folder)
+    from .mirror import DEFAULT_MIRROR_URL, GitMirror
+
+    base, head, _ = find_from_to_commits(
+        pr_number, owner=owner, repository=repository
+    )
+    url = config.get('mirror_url', DEFAULT_MIRROR_URL).format(
+        owner=owner, repository=repository
+    )
+    path = config.get('mirror_path') or cache_dir('mirrors', owner)
+    mirror = GitMirror(
+        url, os.path.join(os.path.expanduser(path), '{}.git'.format(repository)),
+        token=github_config()['token']
+    )
+    tqdm.write('Exporting patches from mirror {}'.format(mirror.path))
+    mirror.update()
+    if not mirror.has_commit(head):
+        mirror.fetch_pull(pr_number)
+    patches = mirror.format_patch(
+        base, head, patch_folder, from_commit=from_commit
+    )
+    logger.info('Exported {} patches'.format(len(patches)))
+    return patches
+
+
+def get_commits(pr_number, owner='gisce', repository='erp'):
+    def is_merge_commit(commit):
+        return bool(len(commit['parents']) > 1)
+
+    logger.info('Getting commits from GitHub')
+    repo = github_config(
+        repository='{}/{}'.format(owner, repository))['repository']
+    owner, repository = repo.split('/', 1)
+    commits = github_repository(owner, repository).pull_commits(pr_number)
+
+    for commit in commits:
+        commit['commit']['is_merge_commit'] = is_merge_commit(commit)
+
+    return commits
+
+
+def export_diff_from_github(pr_number, owner='gisce', repository='erp'):
+    make_dirs('deploy/patches')
+    diff_path = "deploy/patches/{}.diff".format(pr_number)
+    tqdm.write('Exporting diff from Github')
+    r = github_repository(owner, repository).pull_diff(pr_number)
+    with open(diff_path, 'wb') as f:
+        f.write(r.text.encode('utf-8'))
+
+
+def export_patches_from_github(
+    pr_number, from_commit=None, owner='gisce', repository='erp'
+):
+    patch_folder = "deploy/patches/%s" % pr_number
+    make_dirs(patch_folder)
+    if config.get('patch_source') == 'mirror':
+        patches = export_patches_from_mirror(
+            pr_number, from_commit, owner=owner, repository=repository
+        )
+        write_manifest(patch_folder)
+        return patches
+    tqdm.write('Exporting patches from GitHub')
+    commits = get_commits(pr_number, owner=owner, repository=repository)
+    patch_number = 0
+    patch_store = get_patch_store()
+    tqdm.write("Exporting patches from PR:{}{}".format(
+        pr_number, from_commit and '@{}'.format(from_commit) or ''
+    ))
+    to_export = []
+    export_from = from_commit
+    for commit in commits:
+        if commit['commit']['is_merge_commit']:
+            logger.info('Skipping merge commit {sha}: {message}'.format(
+                sha=commit['sha'], message=commit['commit']['message']
+            ))
+            continue
+        if from_commit:
+            if commit['sha'] != from_commit:
+                logger.info('Skipping commit {sha}: {message}'.format(
+                    sha=commit['sha'], message=commit['commit']['message']
+                ))
+                patch_number += 1
+                continue
+            else:
+                from_commit = None
+        patch_number += 1
+        to_export.append((patch_number, commit))
+
+    contents = {}
+    missing = []
+    for _, commit in to_export:
+        content = patch_store and patch_store.get(commit['sha'])
+        if content is None:
+            missing.append(commit)
+        else:
+            logger.info('Using cached patch for {}'.format(commit['sha']))
+            contents[commit['sha']] = content
+
+    if len(missing) > 1 and config.get('patch_source', 'series') == 'series':
+        series = get_patch_series(
+            pr_number, commits, from_commit=export_from,
+            owner=owner, repository=repository
+        )
+        for commit in missing:
+            content = series.get(commit['sha'])
+            if content is not None:
+                contents[commit['sha']] = content
+                if patch_store:
+                    patch_store.put(commit['sha'], content)
+        missing = [c for c in missing if c['sha'] not in contents]
+
+    downloads = github_repository(owner, repository).patches(missing)
+    for commit, r in tqdm(
+            six.moves.zip(missing, downloads), total=len(missing),
+            desc='Downloading'):
+        content = r.text.encode('utf-8')
+        if r.status_code == 200 and patch_store:
+            patch_store.put(commit['sha'], content)
+        contents[commit['sha']] = content
+    if patch_store:
+        patch_store.evict()
+
+    for patch_number, commit in to_export:
+        message = slugify(commit['commit']['message'][:64])
+        filename = '%04i-%s.patch' % (patch_number, message)
+        with open(os.path.join(patch_folder, filename), 'wb') as patch:
+            logger.info('Exporting patch %s.' % filename)
+            patch.write(contents[commit['sha']])
+    write_manifest(patch_folder)
+
+
+def get_patch_series(
+    pr_number, commits, from_commit=None, owner='gisce', repository='erp'
+):
+    """Download the patches of a PR with a single request.
+
+    The PR is requested with the ``application/vnd.github.patch`` media type
+    or, when deploying from a commit, the compare between its parent and the
+    PR head. The mbox is split by commit sha; an empty dict is returned when
+    GitHub can not build it (e.g. the PR is too big).
+    """
+    api = github_repository(owner, repository)
+    commit = None
+    if from_commit:
+        commit = next((c for c in commits if c['sha'] == from_commit), None)
+    if commit and commit['parents']:
+        url = api.url('compare', '{}...{}'.format(
+            commit['parents'][0]['sha'], commits[-1]['sha']
+        ))
+    else:
+        url = api.url('pulls', pr_number)
+    tqdm.write('Downloading patch series')
+    try:
+        r = api.patch_series(url)
+    except ConnectionError as e:
+        logger.warning('Unable to get the patch series: {}'.format(e))
+        return {}
+    if r.status_code != 200:
+        logger.info('Patch series not available ({}): {}'.format(
+            r.status_code, url
+        ))
+        return {}
+    return dict(split_mbox(r.content))
+
+
+def mark_to_deploy(
+    pr_number, hostname=False, owner='gisce', repository='erp'
+):
+    logger.info('Marking as deployed on GitHub')
+    api = github_repository(owner, repository)
+    commit = api.pull(pr_number)['head']['sha']
+    host = hostname or socket.gethostname()
+    payload = {
+        'ref': commit,
+        'task': 'deploy',
+        'auto_merge': False,
+        'environment': host,
+        'description': host,
+        'required_contexts': [],
+        'auto_inactive': False,
+        'payload': {
+            'host': host
+        }
+    }
+    res = api.create_deployment(payload)
+    if 'id' not in res:
+        logger.info('Not marking deployment in github: %s' % res['message'])
+        return 0
+    deploy_id = res['id']
+    logger.info('Deploy id: %s' % deploy_id)
+    return deploy_id
+
+
+def get_deploys(
+    pr_number, owner='gisce', repository='erp', commit=None,
+    latest_status=False
+):
+    """Deployments of a PR commit (the head by default) with their statuses.
+
+    Statuses are requested concurrently; with ``latest_status`` only the
+    most recent status of each deployment is requested.
+    """
+    api = github_repository(owner, repository)
+    if commit is None:
+        commit = api.pull(pr_number)['head']['sha']
+    res = sorted(
+        api.iter_deployments(sha=commit), key=lambda x: x['created_at']
+    )
+
+    deploys = []
+    for deployment, statusses in six.moves.zip(
+            res, api.statuses(res, latest=latest_status)):
+        deployment['status'] = statusses
+        deploys.append(deployment)
+    return deploys
+
+
+def get_host_deployments(
+    hostname, owner='gisce', repository='erp', since=None, extra=100
+):
+    """Deployments registered for ``hostname``, newest first.
+
+    Deployments are created with the host as environment, so they are
+    listed with a single (paginated) query. ``since`` is a hint: pages stop
+    being requested once ``extra`` deployments (one page) older than it
+    were listed.
+    """
+    api = github_repository(owner, repository)
+    deployments = []
+    older = 0
+    for deployment in api.iter_deployments(environment=hostname):
+        if since and deployment['created_at'] < since:
+            older += 1
+            if older > extra:
+                break
+        if (deployment.get('payload') or {}).get('host') == hostname:
+            deployments.append(deployment)
+    return deployments
+
+
+def get_last_deploy(pr_number, hostname=False, owner='gisce', repository='erp'):
+    hostname = hostname or socket.gethostname()
+    pr_commits = list(reversed(get_commits(pr_number, owner, repository)))
+    commits = [x['sha'] for x in pr_commits]
+    logger.info('Finding last success deploy...')
+    if not commits:
+        return None, None
+    # A commit can not be deployed before being committed
+    since = min(x['commit']['committer']['date'] for x in pr_commits)
+    try:
+        since = (
+            datetime.strptime(since, GITHUB_DATE_FORMAT)
+            - DEPLOYMENTS_SINCE_MARGIN
+        ).strftime(GITHUB_DATE_FORMAT)
+    except ValueError:
+        since = None
+    by_commit = {}
+    for deploy in sorted(
+            get_host_deployments(hostname, owner, repository, since=since),
+            key=lambda x: x['created_at']):
+        by_commit.setdefault(deploy['sha'], []).append(deploy)
+    candidates = [
+        (idx, deploy) for idx, commit in enumerate(commits)
+        for deploy in by_commit.get(commit, [])
+    ]
+    statuses = github_repository(owner, repository).statuses(
+        [deploy for _, deploy in candidates], latest=True
+    )
+    for (idx, deploy), status in six.moves.zip(candidates, statuses):
+        deploy['status'] = status
+        if deploy['status'] and deploy['status'][0]['state'] == 'success':
+            return deploy, commits[idx - 1]
+    return None, None
+
+
+def print_deploys(
+    pr_number, owner='gisce', repository='erp', latest_status=False
+):
+    for deployment in get_deploys(
+            pr_number, owner, repository, latest_status=latest_status):
+        print("Deployment id: {id} to {description}".format(**deployment))
+        for status in deployment['status']:
+            status_text = (
+                "  - {state} by {creator[login]} on {created_at}".format(
+                    **status
+                )
+            )
+            formatter = str
+            if status['state'] == 'pending':
+                formatter = colors.yellow
+            elif status['state'] in ['error', 'failure']:
+                formatter = colors.red
+            elif status['state'] == 'success':
+                formatter = colors.green
+            print(formatter(status_text))
+
+
+def send_update(url, payload, description):
+    """POST an update to GitHub through the outbox, so the deploy does not
+    wait for GitHub to record it"""
+    outbox = get_outbox()
+    if outbox is not None:
+        outbox.enqueue(
+            url, payload, accept=DEPLOYMENTS_MEDIA_TYPE,
+            description=description
+        )
+    else:
+        get_client().post(url, data=json.dumps(payload), headers={
+            'Accept': DEPLOYMENTS_MEDIA_TYPE,
+            'Authorization': 'token %s' % github_config()['token']
+        })
+
+
+def mark_deploy_status(
+    deploy_id, state='success', description=None,
+    owner='gisce', repository='erp', pr_number=None, environment='pro', no_set_label=False
+):
+    if not deploy_id:
+        return
+    logger.info('Marking as deployed %s on GitHub' % state)
+    api = github_repository(owner, repository)
+    payload = {'state': state}
+    if description is not None:
+        payload['description'] = description
+    send_update(
+        api.url('deployments', deploy_id, 'statuses'), payload,
+        'status {} of deploy {}'.format(state, deploy_id)
+    )
+    logger.info('Deploy %s marked as %s' % (deploy_id, state))
+    if state == 'success' and pr_number and environment is not None and not no_set_label:
+        send_update(
+            api.url('issues', pr_number, 'labels'),
+            {'labels': [DEPLOYED[environment]]},
+            'label {} of PR {}'.format(DEPLOYED[environment], pr_number)
+        )
+        logger.info('Add Label to deploy on PR {}'.format(pr_number))
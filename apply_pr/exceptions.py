@@ -4,3 +4,7 @@ class SastreBaseException(Exception):
 
 class ApplyError(SastreBaseException):
     pass
+
+
+class GitHubError(SastreBaseException):
+    pass
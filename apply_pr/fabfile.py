@@ -7,9 +7,9 @@ from __future__ import (
 import json
 import logging
 import os
-import io
 import re
 import pprint
+import tempfile
 
 import six
 from fabric.api import local, run, cd, put, settings, abort, sudo, hide, task, env, prefix
@@ -18,10 +18,7 @@ from fabric.contrib import files
 from fabric.state import output
 from fabric.exceptions import NetworkError
 from fabric import colors
-from osconf import config_from_environment
-from slugify import slugify
 from os.path import isdir
-import requests
 from io import BytesIO
 from six import string_types, PY2
 from tqdm import tqdm
@@ -32,15 +29,18 @@ else:
 
 from collections import OrderedDict
 
-
-
-from packaging import version as vsn
-from giscemultitools.githubutils.objects import GHAPIRequester
-from giscemultitools.githubutils.utils import GithubUtils
-
-from requests.exceptions import ConnectionError
 from .github_utils import github_config, is_github_token_valid
-from .changelog import make_changelog
+from .github_client import get_client
+from .exceptions import GitHubError
+from .patches import (
+    MANIFEST_NAME, pack_patches, read_manifest, select_patches,
+    write_manifest
+)
+from .preflight import (
+    parse_preflight, preflight_command, problem_message, repository_problems
+)
+from . import check_prs, deploys
+from .deploys import config
 
 logger = logging.getLogger(__name__)
 
@@ -49,12 +49,6 @@ for k in output.keys():
     output[k] = False
 
 
-def apply_pr_config(**config):
-    return config_from_environment('APPLY_PR', **config)
-
-
-config = apply_pr_config()
-
 if config.get('logging'):
     logging.basicConfig(level=logging.INFO)
 
@@ -63,72 +57,96 @@ if config.get('no_sudo_mode'):
     from fabric.api import run as sudo
     USE_SUDO = False
 
-DEPLOYED = {'pro': 'deployed', 'pre': 'deployed PRE', 'test': 'deployed PRE'}
 
-
-def get_info_from_url(pr):
-    if pr.startswith('https://'):
-        vals = pr.split('/')
-        info = {
-           'owner': vals[3],
-           'repository': vals[4],
-           'pr': vals[6]
-        }
-        if len(vals) == 9 and vals[7] in ('commits', 'changes'):
-            info['from_commit'] = vals[8]
-        return info
-    else:
-        return {'pr': pr}
+def upload_archive(directory, names, remote_dir, sudo_user='erp',
+                   manifest=None):
+    """Upload the files ``names`` of the local ``directory`` (and
+    ``manifest``) to ``remote_dir`` as one tarball, unpacked and chowned by a
+    single remote command, so the files cost one transfer whatever their
+    number"""
+    fd, archive = tempfile.mkstemp(prefix='sastre-', suffix='.tar.gz')
+    os.close(fd)
+    remote_archive = '/tmp/{}'.format(os.path.basename(archive))
+    try:
+        pack_patches(directory, names, archive, manifest=manifest)
+        logger.info('Uploading {} files ({} bytes) to {}'.format(
+            len(names), os.path.getsize(archive), remote_dir
+        ))
+        put(archive, remote_archive, use_sudo=USE_SUDO)
+    finally:
+        os.remove(archive)
+    sudo(
+        "mkdir -p {dir} && tar -xzf {archive} --no-same-owner -C {dir} && "
+        "rm -f {archive} && chown -R {user}: {dir}".format(
+            dir=remote_dir, archive=remote_archive, user=sudo_user
+        )
+    )
 
 
 @task
 def upload_diff(pr_number, src='/home/erp/src', repository='erp', sudo_user='erp'):
-    temp_dir = '/tmp/%s.diff' % pr_number
     remote_dir = '{}/{}/patches/{}'.format(src, repository, pr_number)
     remote_dir_bkp = '{}/{}/patches/{}/backup'.format(src, repository, pr_number)
-    sudo("mkdir -p %s" % remote_dir)
     sudo("mkdir -p %s" % remote_dir_bkp)
-    sudo("chown -R {0}: {1}".format(sudo_user, remote_dir))
+    upload_archive(
+        'deploy/patches', ['{}.diff'.format(pr_number)], remote_dir,
+        sudo_user=sudo_user
+    )
     with cd('{}/{}'.format(src, repository)):
         sudo("git diff > {}/pre_{}.diff".format(remote_dir_bkp, pr_number), user=sudo_user)
-    diff_path = '{}/{}.diff'.format(remote_dir, pr_number)
-    with io.open('deploy/patches/{}.diff'.format(pr_number), 'r', encoding='utf-8') as dfile:
-        logger.info('Uploading diff {}.diff'.format(pr_number))
-        put('deploy/patches/{}.diff'.format(pr_number), temp_dir, use_sudo=USE_SUDO)
-    sudo("mv %s %s" % (temp_dir, diff_path))
-    sudo("chown {0}: {1}".format(sudo_user, diff_path))
 
 
 @task
 def upload_patches(
     pr_number, from_commit=None, src='/home/erp/src', repository='erp', sudo_user='erp'
 ):
-    temp_dir = '/tmp/%s' % pr_number
     remote_dir = '{}/{}/patches/{}'.format(
         src, repository, pr_number
     )
-    sudo("mkdir -p %s" % remote_dir)
-    sudo("mkdir -p %s" % temp_dir)
-    patches = [p for p in local(
-        'ls -1 deploy/patches/%s/' % pr_number, capture=True
-    ).split('\n') if p]
-    for patch in tqdm(patches, desc='  Uploading'):
-        if not patch:
+    patches_dir = 'deploy/patches/{}'.format(pr_number)
+    manifest = read_manifest(patches_dir) or write_manifest(patches_dir)
+    patches = select_patches(manifest, from_commit=from_commit)
+    skipped = len(manifest) - len(patches)
+    if skipped:
+        logger.info('Skipping {} patches before {}'.format(
+            skipped, from_commit
+        ))
+    upload_archive(
+        patches_dir, [patch['name'] for patch in patches], remote_dir,
+        sudo_user=sudo_user, manifest=patches
+    )
+
+
+def remote_manifest(patches_dir):
+    """Manifest of the patches uploaded to ``patches_dir``.
+
+    Patches uploaded without a manifest are listed with their commit, still
+    with a single remote command.
+    """
+    with hide('output'):
+        result = sudo("cat {}/{}".format(patches_dir, MANIFEST_NAME))
+    if not result.failed:
+        try:
+            return json.loads(result)
+        except ValueError:
+            logger.warning('Invalid manifest in {}'.format(patches_dir))
+    with hide('output'):
+        result = sudo(
+            "cd {} && for patch in *.patch; do "
+            "echo \"$patch $(head -n1 \"$patch\" | cut -d ' ' -f 2)\"; "
+            "done".format(patches_dir)
+        )
+    manifest = []
+    for line in result.splitlines():
+        fields = line.split()
+        if len(fields) != 2 or not fields[0].endswith('.patch'):
             continue
-        if from_commit:
-            with io.open('deploy/patches/%s/%s' % (pr_number, patch), 'r', encoding='utf8') as pfile:
-                commit = pfile.readline().split(' ')[1]
-                if commit != from_commit:
-                    logger.info('Skipping patch {}'.format(patch))
-                    continue
-                else:
-                    from_commit = None
-        logger.info('Uploading patch {}'.format(patch))
-        put('deploy/patches/%s/%s' % (pr_number, patch),
-            temp_dir, use_sudo=USE_SUDO)
-        remote_patch_file = '{}/{}'.format(temp_dir, patch)
-        sudo("mv %s %s" % (remote_patch_file, remote_dir))
-    sudo("chown -R {0}: {1}".format(sudo_user, remote_dir))
+        number = fields[0].split('-', 1)[0]
+        manifest.append({
+            'name': fields[0], 'sha': fields[1], 'files': None,
+            'number': int(number) if number.isdigit() else None,
+        })
+    return manifest
 
 
 @task
@@ -156,25 +174,17 @@ def apply_remote_patches(
         from_patch = int(from_patch)
         logger.info('Applying from number {}'.format(from_patch))
     with settings(warn_only=True, sudo_user=sudo_user):
-        with hide('output'):
-            patches = sudo("ls -1 {}/{}/patches/{}/*.patch".format(
-                src, repository, name
-            ))
-        patches_to_apply = []
-        for patch in patches.split():
-            if from_patch:
-                number = int(os.path.basename(patch).split('-')[0])
-                if number < from_patch:
-                    logger.info('Skipping patch %s' % patch)
-                    continue
-            elif from_commit:
-                commit = sudo('head -n1 {} | cut -d " " -f 2'.format(patch))
-                if commit != from_commit:
-                    logger.info('Skipping patch %s' % patch)
-                    continue
-                else:
-                    from_commit = None
-            patches_to_apply.append(patch)
+        patches_dir = '{}/{}/patches/{}'.format(src, repository, name)
+        manifest = remote_manifest(patches_dir)
+        selected = select_patches(
+            manifest, from_commit=from_commit, from_number=from_patch
+        )
+        for patch in manifest:
+            if patch not in selected:
+                logger.info('Skipping patch {}'.format(patch['name']))
+        patches_to_apply = [
+            '{}/{}'.format(patches_dir, patch['name']) for patch in selected
+        ]
 
         if patches_to_apply:
             with cd("{}/{}".format(src, repository)):
@@ -329,12 +339,22 @@ class GitApplier(object):
 
 
 class PatchFile(object):
-    def __init__(self, patch_file):
+    def __init__(self, patch_file, manifest_entry=None):
         self.patch_file = patch_file
+        self.manifest_entry = manifest_entry
         self.applied = False
 
     @property
     def files(self):
+        if self.manifest_entry is None:
+            name = os.path.basename(self.patch_file)
+            manifest = remote_manifest(os.path.dirname(self.patch_file))
+            self.manifest_entry = next(
+                (entry for entry in manifest if entry['name'] == name), {}
+            )
+        if self.manifest_entry.get('files') is not None:
+            return self.manifest_entry['files']
+        # Uploaded without a manifest
         files_in_patch = []
         command = " grep '^diff' {}".format(self.patch_file)
         for line in sudo(command).split('\n'):
@@ -344,15 +364,20 @@ class PatchFile(object):
         return files_in_patch
 
     @classmethod
-    def from_patch_number(cls, result, patches_to_apply):
+    def from_patch_number(cls, result, patches_to_apply, manifest=None):
         failed_patch_number = re.findall(
             'Patch failed at ([0-9]{4}) ', result
         )
         if failed_patch_number:
             failed_patch_number = failed_patch_number[0]
             for patch in patches_to_apply:
-                if patch.split('/')[-1].startswith(failed_patch_number):
-                    return cls(patch)
+                name = patch.split('/')[-1]
+                if name.startswith(failed_patch_number):
+                    entry = next((
+                        entry for entry in manifest or []
+                        if entry['name'] == name
+                    ), None)
+                    return cls(patch, manifest_entry=entry)
         return None
 
     def apply(self, reject=False):
@@ -387,280 +412,59 @@ class PatchFile(object):
             sudo("git add {}".format(file_in_patch))
 
 
-@task
-def find_from_to_commits(pr_number, owner='gisce', repository='erp'):
-    headers = {'Authorization': 'token %s' % github_config()['token']}
-    url = "https://api.github.com/repos/{}/{}/pulls/{}".format(
-        owner, repository, pr_number
-    )
-    r = requests.get(url, headers=headers)
-    if r.status_code != 200:
-        abort("Unable to get info from the pull request")
-    pull = json.loads(r.text)
-    from_commit = pull['base']['sha']
-    to_commit = pull['head']['sha']
-    head_origin, head_branch = pull['head']['label'].split(':')
-    base_origin, base_branch = pull['base']['label'].split(':')
-    if head_origin != base_origin or pull['merged']:
-        branch = None
-    else:
-        branch = head_branch
-    logger.info('Commits: %s..%s (%s)' % (from_commit, to_commit, branch))
-    return from_commit, to_commit, branch
-
-
-@task
-def export_patches_from_git(from_commit, to_commit, pr_number):
-    logger.info('Exporting patches from %s to %s' % (from_commit, to_commit))
-    deploy_path = "deploy/patches/{}".format(pr_number)
-    try:
-        if isdir(deploy_path):
-            local("rm -r {}".format(deploy_path))
-        local("mkdir -p {}".format(deploy_path))
-    except BaseException as e:
-        logger.error('Permission denied to write {} in the current directory'.format(deploy_path))
-        raise
-    local("git format-patch -o deploy/patches/%s %s..%s" % (
-        pr_number, from_commit, to_commit)
-    )
-
-
-@task
-def get_commits(pr_number, owner='gisce', repository='erp'):
-    def is_merge_commit(commit):
-        return bool(len(commit['parents']) > 1)
-
-    # Pagination documentation: https://developer.github.com/v3/#pagination
-    def parse_github_links_header(links_header):
-        ret_links = {}
-        full_links = links_header.split(',')
-        for link in full_links:
-            link_url, link_ref = link.split(';')
-            link_url = link_url.strip()[1:-1]
-            link_ref = link_ref.split('=')[-1].strip()[1:-1]
-            ret_links[link_ref] = link_url
-        return ret_links
-
-    logger.info('Getting commits from GitHub')
-    headers = {'Authorization': 'token %s' % github_config()['token']}
-    repo = github_config(
-        repository='{}/{}'.format(owner, repository))['repository']
-    url = "https://api.github.com/repos/%s/pulls/%s/commits?per_page=100" \
-          % (repo, pr_number)
-    r = requests.get(url, headers=headers)
-    commits = json.loads(r.text)
-    if 'link' in r.headers:
-        url_page = 1
-        links = parse_github_links_header(r.headers['link'])
-        while links['last'][-1] != str(url_page):
-            url_page += 1
-            tqdm.write(colors.yellow(
-                '    - Getting extra commits page {}'.format(url_page)))
-            r = requests.get(links['next'], headers=headers)
-            commits += json.loads(r.text)
-
-    for commit in commits:
-        commit['commit']['is_merge_commit'] = is_merge_commit(commit)
-
-    return commits
-
-
-@task
-def export_diff_from_github(pr_number, owner='gisce', repository='erp'):
-    try:
-        local("mkdir -p %s" % 'deploy/patches')
-    except BaseException as e:
-        logger.error('Permission denied to write deploy/patches in the current directory')
-        raise
-    diff_path = "deploy/patches/{}.diff".format(pr_number)
-    tqdm.write('Exporting diff from Github')
-    headers = {
-        'Authorization': 'token %s' % github_config()['token'],
-        'Accept': 'application/vnd.github.v3.diff'
-    }
-    url = 'https://api.github.com/repos/{owner}/{repository}/pulls/{pr_number}'.format(
-        owner=owner, repository=repository, pr_number=pr_number
-    )
-    r = requests.get(url, headers=headers)
-    with open(diff_path, 'wb') as f:
-        f.write(r.text.encode('utf-8'))
+# The GitHub side of the deploy is shared with the local mode, which does not
+# load Fabric's SSH stack
+export_patches_from_mirror = task(deploys.export_patches_from_mirror)
+get_commits = task(deploys.get_commits)
+export_diff_from_github = task(deploys.export_diff_from_github)
+export_patches_from_github = task(deploys.export_patches_from_github)
+print_deploys = task(deploys.print_deploys)
+mark_deploy_status = task(deploys.mark_deploy_status)
 
 
 @task
-def export_patches_from_github(
-    pr_number, from_commit=None, owner='gisce', repository='erp'
-):
-    patch_folder = "deploy/patches/%s" % pr_number
+def find_from_to_commits(pr_number, owner='gisce', repository='erp'):
     try:
-        local("mkdir -p %s" % patch_folder)
-    except BaseException as e:
-        logger.error('Permission denied to write {} in the current directory'.format(patch_folder))
-        raise
-    tqdm.write('Exporting patches from GitHub')
-    headers = {'Authorization': 'token %s' % github_config()['token']}
-    commits = get_commits(pr_number, owner=owner, repository=repository)
-    patch_headers = headers.copy()
-    patch_headers['Accept'] = 'application/vnd.github.patch'
-    patch_number = 0
-    tqdm.write("Exporting patches from PR:{}{}".format(
-        pr_number, from_commit and '@{}'.format(from_commit) or ''
-    ))
-    for commit in tqdm(commits, desc='Downloading'):
-        if commit['commit']['is_merge_commit']:
-            logger.info('Skipping merge commit {sha}: {message}'.format(
-                sha=commit['sha'], message=commit['commit']['message']
-            ))
-            continue
-        if from_commit:
-            if commit['sha'] != from_commit:
-                logger.info('Skipping commit {sha}: {message}'.format(
-                    sha=commit['sha'], message=commit['commit']['message']
-                ))
-                patch_number += 1
-                continue
-            else:
-                from_commit = None
-        patch_number += 1
-        r = requests.get(commit['url'], headers=patch_headers)
-        message = slugify(commit['commit']['message'][:64])
-        filename = '%04i-%s.patch' % (patch_number, message)
-        with open(os.path.join(patch_folder, filename), 'wb') as patch:
-            logger.info('Exporting patch %s.' % filename)
-            patch.write(r.text.encode('utf-8'))
+        return deploys.find_from_to_commits(
+            pr_number, owner=owner, repository=repository
+        )
+    except GitHubError:
+        abort("Unable to get info from the pull request")
 
 
 @task
 def mark_to_deploy(
     pr_number, hostname=False, owner='gisce', repository='erp'
 ):
-    logger.info('Marking as deployed on GitHub')
-    headers = {
-        'Accept': 'application/vnd.github.cannonball-preview+json',
-        'Authorization': 'token %s' % github_config()['token']
-    }
-    url = "https://api.github.com/repos/{}/{}/pulls/{}".format(
-        owner, repository, pr_number
+    return deploys.mark_to_deploy(
+        pr_number, hostname=hostname or run("uname -n"), owner=owner,
+        repository=repository
     )
-    r = requests.get(url, headers=headers)
-    pull = json.loads(r.text)
-    commit = pull['head']['sha']
-    if not hostname:
-        host = run("uname -n")
-    else:
-        host = hostname
-    payload = {
-        'ref': commit,
-        'task': 'deploy',
-        'auto_merge': False,
-        'environment': host,
-        'description': host,
-        'required_contexts': [],
-        'auto_inactive': False,
-        'payload': {
-            'host': host
-        }
-    }
-    url = "https://api.github.com/repos/{}/{}/deployments".format(
-        owner, repository
-    )
-    r = requests.post(url, data=json.dumps(payload), headers=headers)
-    res = json.loads(r.text)
-    if 'id' not in res:
-        logger.info('Not marking deployment in github: %s' % res['message'])
-        return 0
-    deploy_id = res['id']
-    logger.info('Deploy id: %s' % deploy_id)
-    return deploy_id
-
-
-def get_deploys(pr_number, owner='gisce', repository='erp', commit=None):
-    headers = {
-        'Accept': 'application/vnd.github.cannonball-preview+json',
-        'Authorization': 'token %s' % github_config()['token']
-    }
-    url = "https://api.github.com/repos/{}/{}/pulls/{}".format(
-        owner, repository, pr_number
-    )
-    r = requests.get(url, headers=headers)
-    pull = json.loads(r.text)
-    if commit is None:
-        commit = pull['head']['sha']
-    url = "https://api.github.com/repos/{}/{}/deployments?sha={}".format(
-        owner, repository, commit
-    )
-    r = requests.get(url, headers=headers)
-    res = json.loads(r.text)
-    res = sorted(res, key=lambda x: x['created_at'])
-    deploys = []
-    for deployment in res:
-        statusses = json.loads(requests.get(deployment['statuses_url'], headers=headers).text)
-        deployment['status'] = statusses
-        deploys.append(deployment)
-    return deploys
 
 
 @task
 def get_last_deploy(pr_number, hostname=False, owner='gisce', repository='erp'):
-    if not hostname:
-        hostname = run("uname -n")
-    commits =  [x['sha'] for x in reversed(get_commits(pr_number, owner, repository))]
-    logger.info('Finding last success deploy...')
-    for idx, commit in tqdm(enumerate(commits), total=len(commits)):
-        for deploy in get_deploys(pr_number, owner, repository, commit):
-            if deploy['payload']['host'] == hostname:
-                if deploy['status'][0]['state'] == 'success':
-                    return deploy, commits[idx - 1]
-    return None, None
-
-
-@task
-def print_deploys(pr_number, owner='gisce', repository='erp'):
-    for deployment in get_deploys(pr_number, owner, repository):
-        print("Deployment id: {id} to {description}".format(**deployment))
-        for status in deployment['status']:
-            status_text = (
-                "  - {state} by {creator[login]} on {created_at}".format(
-                    **status
-                )
-            )
-            formatter = str
-            if status['state'] == 'pending':
-                formatter = colors.yellow
-            elif status['state'] in ['error', 'failure']:
-                formatter = colors.red
-            elif status['state'] == 'success':
-                formatter = colors.green
-            print(formatter(status_text))
+    return deploys.get_last_deploy(
+        pr_number, hostname=hostname or run("uname -n"), owner=owner,
+        repository=repository
+    )
 
 
 @task
-def mark_deploy_status(
-    deploy_id, state='success', description=None,
-    owner='gisce', repository='erp', pr_number=None, environment='pro', no_set_label=False
-):
-    if not deploy_id:
-        return
-    logger.info('Marking as deployed %s on GitHub' % state)
-    headers = {
-        'Accept': 'application/vnd.github.cannonball-preview+json',
-        'Authorization': 'token %s' % github_config()['token']
-    }
-
-    url = "https://api.github.com/repos/{}/{}/deployments/{}/statuses".format(
-        owner, repository, deploy_id
+def export_patches_from_git(from_commit, to_commit, pr_number):
+    logger.info('Exporting patches from %s to %s' % (from_commit, to_commit))
+    deploy_path = "deploy/patches/{}".format(pr_number)
+    try:
+        if isdir(deploy_path):
+            local("rm -r {}".format(deploy_path))
+        local("mkdir -p {}".format(deploy_path))
+    except BaseException as e:
+        logger.error('Permission denied to write {} in the current directory'.format(deploy_path))
+        raise
+    local("git format-patch -o deploy/patches/%s %s..%s" % (
+        pr_number, from_commit, to_commit)
     )
-    payload = {'state': state}
-    if description is not None:
-        payload['description'] = description
-    r = requests.post(url, data=json.dumps(payload), headers=headers)
-    logger.info('Deploy %s marked as %s' % (deploy_id, state))
-    if state == 'success' and pr_number and environment is not None and not no_set_label:
-        url = "https://api.github.com/repos/{}/{}/issues/{}/labels".format(
-            owner, repository, pr_number
-        )
-        payload = {'labels': [DEPLOYED[environment]]}
-        r = requests.post(url, data=json.dumps(payload), headers=headers)
-        logger.info('Add Label to deploy on PR {}'.format(pr_number))
+    write_manifest(deploy_path)
 
 
 @task
@@ -685,35 +489,34 @@ def export_patches_pr(pr_number, owner='gisce', repository='erp'):
 
 
 @task
-def check_it_exists(src='/home/erp/src', repository='erp', sudo_user='erp'):
-    with settings(hide('everything'), sudo_user=sudo_user, warn_only=True):
-        res = sudo("ls {}/{}".format(src, repository))
-        if res.return_code:
-            message = "The repository {} does not exist or cannot be found in {}".format(repository, src)
-            tqdm.write(colors.red(message))
-            abort(message)
-
-
-@task
-def check_is_rolling(src='/home/erp/src', repository='erp', sudo_user='erp'):
+def preflight(src='/home/erp/src', repository='erp', sudo_user='erp'):
+    """State of the remote checkout (see :mod:`apply_pr.preflight`),
+    inspected with a single command"""
+    checkout = '{}/{}'.format(src, repository)
     with settings(hide('everything'), sudo_user=sudo_user, warn_only=True):
-        with cd("{}/{}".format(src, repository)):
-            res = sudo("git branch | grep '* rolling'")
-            if res.return_code:
-                message = "The repository is not in rolling mode"
-                tqdm.write(colors.red(message))
-                abort(message)
+        state = parse_preflight(sudo(preflight_command(checkout)))
+    logger.info('Remote checkout {}: {}'.format(checkout, state))
+    return state
 
 
 @task
-def check_am_session(src='/home/erp/src', repository='erp', sudo_user='erp'):
-    with settings(hide('everything'), sudo_user=sudo_user, warn_only=True):
-        with cd("{}/{}".format(src, repository)):
-            res = sudo("ls .git/rebase-apply")
-            if not res.return_code:
-                message = "The repository is in the middle of an am session!"
-                tqdm.write(colors.red(message))
-                abort(message)
+def check_repository(
+    src='/home/erp/src', repository='erp', sudo_user='erp',
+    skip_rolling_check=False
+):
+    checkout = '{}/{}'.format(src, repository)
+    state = preflight(src=src, repository=repository, sudo_user=sudo_user)
+    for problem in repository_problems(
+            state, skip_rolling_check=skip_rolling_check):
+        message = problem_message(problem, 'remote', checkout)
+        if problem == 'dirty':
+            # The remote flow stashes the changes before applying a diff,
+            # and the uploaded patches are untracked files of the checkout
+            tqdm.write(colors.yellow(message))
+            continue
+        tqdm.write(colors.red(message))
+        abort(message)
+    return state
 
 
 @task
@@ -729,10 +532,10 @@ def apply_pr(
     else:
         repository_name = repository
     try:
-        check_it_exists(src=src, repository=repository_name, sudo_user=sudo_user)
-        if not skip_rolling_check:
-            check_is_rolling(src=src, repository=repository_name, sudo_user=sudo_user)
-        check_am_session(src=src, repository=repository_name, sudo_user=sudo_user)
+        check_repository(
+            src=src, repository=repository_name, sudo_user=sudo_user,
+            skip_rolling_check=skip_rolling_check
+        )
     except NetworkError as e:
         logger.error('Error connecting to specified host')
         logger.error(e)
@@ -790,7 +593,6 @@ def apply_pr(
                                sudo_user=sudo_user)
         if as_diff:
             tqdm.write(colors.yellow("Applying diff \U0001F648"))
-            check_am_session(src=src, repository=repository_name)
             result = apply_remote_diff(
                 pr_number, src=src, repository=repository, sudo_user=sudo_user,
                 reject=reject
@@ -801,7 +603,6 @@ def apply_pr(
             else:
                 from_ = from_number
             tqdm.write(colors.yellow("Applying patches \U0001F648"))
-            check_am_session(src=src, repository=repository_name)
             result = apply_remote_patches(
                 pr_number,
                 from_,
@@ -881,149 +682,9 @@ def check_pr(pr_number, src='/home/erp/src', owner='gisce', repository='erp', su
 
     return result
 
-@task
-def prs_status(
-        prs, separator=' ', owner='gisce', repository='erp', version=False):
-    headers = {
-        'Accept': 'application/vnd.github.cannonball-preview+json',
-        'Authorization': 'token %s' % github_config()['token']
-    }
-    prs = re.sub('{}+'.format(separator), separator, prs)
-    pr_list = prs.split(separator)
-    PRS = {}
-    ERRORS = []
-    TO_APPLY = []
-    TO_APPLY_CAUSE_PROJECT_VERSION_ERROR = []
-    CLOSED_PRS = []
-    IN_PROJECTS = []
-    rep = GHAPIRequester(owner, repository)
-    def get_prs_info(plist):
-        res = []
-        for _pr in tqdm(list(set(plist)), desc='Getting pr data from Github'):
-            try:
-                res.append(
-                    GithubUtils.plain_get_commits_sha_from_merge_commit(
-                        rep.get_pull_request_projects_and_commits(int(_pr))
-                    )
-                )
-            except Exception:
-                res.append({'pullRequest': {'number': _pr}})
-        if res:
-            max_meged_at = '2999-12-27T06:22:04Z'
-            return sorted(
-                res, key=lambda _p: (
-                    _p['pullRequest'].get('mergedAt', max_meged_at) or max_meged_at,
-                    _p['pullRequest'].get('createdAt') if (_p['pullRequest'].get('mergedAt', max_meged_at) or max_meged_at) == max_meged_at else ''
-                )
-            )
-        return res
-
-    def check_version_project_done(project_items):
-        if version:
-            parsed_version = version.split('.')
-            parsed_version = '{}.{}'.format(parsed_version[0], parsed_version[1])
-            for _project in project_items:
-                if _project['project_name'].startswith(parsed_version) and _project['card_state'] != 'Done':
-                    return False
-        return True
 
-    for pull_info in tqdm(get_prs_info(pr_list), desc='Process PRs info'):
-        pr_number = pull_info['pullRequest']['number']
-        try:
-            pull = pull_info['pullRequest']
-            projects_info = pull_info.get('projectItems', None)
-            projects_show = ''
-            to_apply = '{}'.format(str(pr_number))
-            projects = ''
-            if projects_info:
-                projects = ','.join(
-                    [x['project_name'] for x in projects_info if x['card_state'] == 'Done']
-                )
-                if projects:
-                    projects_show = 'PROJECTS => {}'.format(projects)
-                    to_apply += ' ({})'.format(projects)
-            state_pr = pull['state']
-            merged_at = pull['mergedAt']
-            created_at = pull['createdAt']
-            milestone = pull['milestone'] or '(With out Milestone)'
-            message = (
-                'PR {number}=>'
-                ' state {state_pr}'
-                ' merged_at {merged_at}'
-                ' created_at {created_at}'
-                ' milestone {milestone}'
-                ' {projects} '.format(
-                    number=pr_number, state_pr=state_pr,
-                    merged_at=merged_at, created_at=created_at,
-                    milestone=milestone, projects=projects_show
-                )
-            )
-            if version:
-                if milestone != '(With out Milestone)' and vsn.parse(milestone) <= vsn.parse(version):
-                    if state_pr.upper() != 'MERGED':
-                        message = colors.yellow(message)
-                        if state_pr.upper() == 'CLOSED':
-                            CLOSED_PRS.append(to_apply)
-                        elif not projects:
-                            TO_APPLY.append(to_apply)
-                        else:
-                            IN_PROJECTS.append(to_apply)
-                    else:
-                        message = colors.green(message)
-                else:
-                    message = colors.red(message)
-                    if not projects:
-                        TO_APPLY.append(to_apply)
-                    elif not check_version_project_done(projects_info):
-                        TO_APPLY.append('{}'.format(str(pr_number)))
-                        TO_APPLY_CAUSE_PROJECT_VERSION_ERROR.append(to_apply)
-                    else:
-                        IN_PROJECTS.append(to_apply)
-            PRS.setdefault(milestone, [])
-            PRS[milestone] += [message]
-        except Exception as e:
-            # logger.error('Error PR {0}'.format(pr_number))
-            err_msg = colors.red(
-                'Error PR {2} : https://github.com/{0}/{1}/pull/{2}'.format(
-                    owner, repository, pr_number
-                )
-            )
-            tqdm.write(err_msg)
-            ERRORS.append(err_msg)
-    for milestone in sorted(PRS.keys()):
-        print('\nMilestone {}'.format(milestone))
-        for prmsg in PRS[milestone]:
-            print('\t{}'.format(prmsg))
-    for prmsg in ERRORS:
-        print('ERR\t{}'.format(prmsg))
-    if version:
-        print(colors.magenta('\nIncluded in projects\n'))
-        for x in IN_PROJECTS:
-            print(colors.magenta('* {}'.format(x)))
-        print(colors.red('\nIncluded in version project but in Error State\n'))
-        for _pr_project in TO_APPLY_CAUSE_PROJECT_VERSION_ERROR:
-            print(colors.red('* {}'.format(_pr_project)))
-        if CLOSED_PRS:
-            print(colors.red('\n############# Closed PRS: "{}"\n'.format(
-                ' '.join(CLOSED_PRS)
-            )))
-        if ERRORS:
-            print(colors.yellow('\n⚠ ️WARNING ⚠ ️! ERRORS IN PRS. MUST BE REVIEW\n'))
-            print(colors.yellow('##########################################\n'))
-            for prmsg in ERRORS:
-                print('ERR\t{}'.format(prmsg))
-            print(colors.yellow('############# END ERROR PRS ###############\n'))
-        print(colors.yellow(
-            '\nNot Included: "{}"\n'.format(' '.join(TO_APPLY))
-        ))
-        for x in TO_APPLY:
-            print(
-                 'curl -H \'Authorization: token {token}\' '
-                 '-H "Accept: application/vnd.github.v3.diff" '
-                 'https://api.github.com/repos/gisce/erp/pulls/{pr} --output {pr}.diff'.format(
-                       pr=x, token="$GITHUB_TOKEN")
-            )
-    return True
+prs_status = task(check_prs.prs_status)
+
 
 @task
 def auto_changelog(milestone, show_issues=True):
@@ -1048,7 +709,7 @@ def auto_changelog(milestone, show_issues=True):
         'Authorization': 'token %s' % github_config()['token']
     }
     url = "https://api.github.com/search/issues?q=is:merged+milestone:"+milestone+"&type=pr&sort=created&order=asc&per_page=250"
-    r = requests.get(url, headers=headers)
+    r = get_client().get(url, headers=headers)
     pull = json.loads(r.text)
     isses_desc = []
     pulls_desc = {'others': [],
@@ -1090,7 +751,9 @@ def auto_changelog(milestone, show_issues=True):
 @task
 def create_changelog(
         milestone, show_issues=False, changelog_path='/tmp',
-        owner='gisce', repository='erp'):
+        owner='gisce', repository='erp', full=False):
+    from .changelog import make_changelog
+
     make_changelog(milestone, show_issues=show_issues,
                    changelog_path=changelog_path,
-                   owner=owner, repository=repository)
+                   owner=owner, repository=repository, full=full)
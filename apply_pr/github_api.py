@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import json
+import logging
+
+from six.moves.urllib.parse import urlencode
+
+from .exceptions import GitHubError
+from .github_client import get_client, iter_paginated, map_concurrently
+
+logger = logging.getLogger(__name__)
+
+API_URL = 'https://api.github.com'
+DEPLOYMENTS_MEDIA_TYPE = 'application/vnd.github.cannonball-preview+json'
+PATCH_MEDIA_TYPE = 'application/vnd.github.patch'
+
+
+class GitHubRepository(object):
+    """GitHub REST operations on one repository used by the deploy tasks.
+
+    Every method is synchronous so the Fabric tasks can call it directly.
+    The methods taking a list (:meth:`patches`, :meth:`statuses`) fan out the requests over the pool of the shared
+    client and return the results in the order of the list.
+    """
+
+    def __init__(self, owner, repository, token, client=None):
+        self.owner = owner
+        self.repository = repository
+        self.token = token
+        self.client = client or get_client()
+
+    def url(self, *parts, **params):
+        url = '{}/repos/{}/{}'.format(API_URL, self.owner, self.repository)
+        if parts:
+            url += '/' + '/'.join(str(part) for part in parts)
+        if params:
+            url += '?' + urlencode(sorted(params.items()))
+        return url
+
+    def headers(self, accept=None):
+        headers = {'Authorization': 'token {}'.format(self.token)}
+        if accept:
+            headers['Accept'] = accept
+        return headers
+
+    def get_json(self, url, accept=None):
+        r = self.client.get(url, headers=self.headers(accept))
+        if r.status_code != 200:
+            raise GitHubError('Unable to get {} ({}): {}'.format(
+                url, r.status_code, r.text
+            ))
+        return json.loads(r.text)
+
+    def post_json(self, url, payload, accept=None):
+        r = self.client.post(
+            url, data=json.dumps(payload), headers=self.headers(accept)
+        )
+        return json.loads(r.text)
+
+    # Pull requests
+
+    def pull(self, number):
+        return self.get_json(self.url('pulls', number))
+
+    def pull_diff(self, number):
+        return self.client.get(
+            self.url('pulls', number),
+            headers=self.headers('application/vnd.github.v3.diff')
+        )
+
+    def pull_commits(self, number):
+        return list(iter_paginated(
+            self.url('pulls', number, 'commits', per_page=100),
+            headers=self.headers(), client=self.client
+        ))
+
+    # Patches
+
+    def patch(self, commit):
+        """Response with the patch of a commit of :meth:`pull_commits`"""
+        return self.client.get(
+            commit['url'], headers=self.headers(PATCH_MEDIA_TYPE), cache=False
+        )
+
+    def patches(self, commits):
+        return map_concurrently(self.patch, commits)
+
+    def patch_series(self, url):
+        return self.client.get(
+            url, headers=self.headers(PATCH_MEDIA_TYPE), cache=False
+        )
+
+    # Deployments
+
+    def iter_deployments(self, sha=None, environment=None):
+        """Yield the deployments, newest first, fetching pages lazily"""
+        params = {'per_page': 100}
+        if sha:
+            params['sha'] = sha
+        if environment:
+            params['environment'] = environment
+        return iter_paginated(
+            self.url('deployments', **params),
+            headers=self.headers(DEPLOYMENTS_MEDIA_TYPE), client=self.client
+        )
+
+    def create_deployment(self, payload):
+        return self.post_json(
+            self.url('deployments'), payload, accept=DEPLOYMENTS_MEDIA_TYPE
+        )
+
+    def deployment_statuses(self, deployment, latest=False):
+        """Statuses of a deployment, only the most recent one with
+        ``latest``"""
+        url = '{}?per_page={}'.format(
+            deployment['statuses_url'], 1 if latest else 100
+        )
+        if latest:
+            return self.get_json(url, accept=DEPLOYMENTS_MEDIA_TYPE)
+        return list(iter_paginated(
+            url, headers=self.headers(DEPLOYMENTS_MEDIA_TYPE),
+            client=self.client
+        ))
+
+    def statuses(self, deployments, latest=False):
+        return map_concurrently(
+            lambda deployment: self.deployment_statuses(deployment, latest),
+            deployments
+        )
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from osconf import config_from_environment
+
+from .cache import HTTPCache, cache_dir
+from .exceptions import GitHubError
+from .scheduler import (
+    LatencyTracker, get_retry_budget, get_scheduler, rate_limit_resource
+)
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+
+def http_config(**config):
+    """Configuration of the shared HTTP client (APPLY_PR_HTTP_* variables)"""
+    defaults = {
+        'pool_connections': 10,
+        'pool_maxsize': 20,
+        'connect_timeout': 10,
+        'read_timeout': 60,
+        'retries': 2,
+        'retry_budget': 0.1,
+        'hedge': False,
+        'hedge_percentile': 95,
+        'workers': 8,
+        'rate': 10,
+        'burst': 20,
+        'rate_limit_reserve': 50,
+        'throttle_retries': 3,
+        'cache': True,
+        'cache_max_size': 200 * 1024 * 1024,
+        'cache_max_age': 30 * 24 * 3600,
+    }
+    defaults.update(config)
+    return config_from_environment('APPLY_PR_HTTP', **defaults)
+
+
+def user_agent():
+    import apply_pr
+    return 'apply_pr/{}'.format(apply_pr.__version__)
+
+
+class GitHubClient(object):
+    """HTTP client shared by every GitHub call of the process.
+
+    Keeps a single :class:`requests.Session` so TCP and TLS connections are
+    reused between requests instead of opening a new one on each call.
+    When ``cache`` is given, GET responses with an ``ETag`` or
+    ``Last-Modified`` header are stored and later revalidated with a
+    conditional request; a ``304 Not Modified`` is served from the cache.
+
+    Idempotent requests failing with a connection error, a timeout or a 5xx
+    are retried up to ``retries`` times while the process retry budget
+    allows it. With ``hedge``, a GET still running after the
+    ``hedge_percentile`` latency of the previous requests is sent again and
+    the first response wins.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, timeout=(10, 60),
+                 headers=None, cache=None, scheduler_config=None, retries=2,
+                 retry_backoff=0.5, retry_budget=None, hedge=False,
+                 hedge_percentile=95):
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler_config = scheduler_config or {}
+        self.retries = int(retries)
+        self.retry_backoff = float(retry_backoff)
+        self.retry_budget = retry_budget or get_retry_budget()
+        self.hedge = hedge
+        self.hedge_percentile = float(hedge_percentile)
+        self.latencies = LatencyTracker()
+        self._hedge_workers = int(pool_maxsize)
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=int(pool_connections),
+            pool_maxsize=int(pool_maxsize)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['User-Agent'] = user_agent()
+        if headers:
+            self.session.headers.update(headers)
+
+    def request(self, method, url, **kwargs):
+        """Send a request retrying the transient failures of idempotent
+        methods.
+
+        ``timeout`` defaults to the ``(connect, read)`` timeouts of the
+        client. Use ``idempotent=True`` to retry a request with side-effect
+        free semantics sent with another method, e.g. a GraphQL query.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        method = method.upper()
+        idempotent = kwargs.pop('idempotent', method in IDEMPOTENT_METHODS)
+        hedge = self.hedge and method == 'GET' and not kwargs.get('stream')
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                if hedge:
+                    response = self._hedged_send(method, url, **kwargs)
+                else:
+                    response = self._send(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if not self._can_retry(idempotent, attempt):
+                    raise
+                reason = e
+            else:
+                if response.status_code not in RETRY_STATUSES \
+                        or not self._can_retry(idempotent, attempt):
+                    return response
+                reason = response.status_code
+            delay = self.retry_backoff * (2 ** attempt) * random.uniform(
+                0.5, 1.5
+            )
+            logger.warning(
+                '%s %s failed (%s), retrying in %.1fs', method, url, reason,
+                delay
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _can_retry(self, idempotent, attempt):
+        return (
+            idempotent and attempt < self.retries
+            and self.retry_budget.withdraw()
+        )
+
+    def _send(self, method, url, **kwargs):
+        """Send a request through the scheduler of its host and token.
+
+        Requests throttled by GitHub are retried, up to the scheduler
+        ``max_retries``, once the scheduler pause is over.
+        """
+        scheduler = get_scheduler(
+            url, kwargs.get('headers'), **self.scheduler_config
+        )
+        resource = rate_limit_resource(url)
+        attempt = 0
+        while True:
+            scheduler.acquire(resource)
+            response = None
+            try:
+                logger.debug('%s %s', method, url)
+                start = time.time()
+                response = self.session.request(method, url, **kwargs)
+                self.latencies.record(time.time() - start)
+            finally:
+                delay = scheduler.release(response, attempt, resource)
+            if delay is None or attempt >= scheduler.max_retries:
+                return response
+            attempt += 1
+            logger.warning(
+                'GitHub throttled %s %s, retrying in %.0fs', method, url, delay
+            )
+
+    def _hedged_send(self, method, url, **kwargs):
+        threshold = self.latencies.percentile(self.hedge_percentile)
+        if threshold is None:
+            return self._send(method, url, **kwargs)
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self._hedge_workers
+                )
+            executor = self._hedge_executor
+        futures = [executor.submit(self._send, method, url, **kwargs)]
+        done, _ = wait(futures, timeout=threshold)
+        if not done and self.retry_budget.withdraw():
+            logger.debug(
+                'Hedging %s %s after %.2fs', method, url, threshold
+            )
+            futures.append(executor.submit(self._send, method, url, **kwargs))
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except requests.exceptions.RequestException as e:
+                error = e
+        raise error
+
+    def get(self, url, cache=True, **kwargs):
+        """GET ``url`` revalidating a cached copy when there is one.
+
+        Use ``cache=False`` for responses that must not be stored.
+        """
+        if not cache or self.cache is None or kwargs.get('params') \
+                or kwargs.get('stream'):
+            return self.request('GET', url, **kwargs)
+        headers = dict(kwargs.pop('headers', None) or {})
+        key = self.cache.key(url, headers)
+        cached = self.cache.get(key)
+        if cached is not None:
+            meta = cached[0]
+            stored_headers = CaseInsensitiveDict(meta['headers'])
+            if 'ETag' in stored_headers:
+                headers['If-None-Match'] = stored_headers['ETag']
+            if 'Last-Modified' in stored_headers:
+                headers['If-Modified-Since'] = stored_headers['Last-Modified']
+        response = self.request('GET', url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(key)
+            return self._cached_response(cached, response)
+        if response.status_code == 200 and (
+                'ETag' in response.headers
+                or 'Last-Modified' in response.headers):
+            self.cache.store(
+                key, url, response.status_code, response.headers,
+                response.content, encoding=response.encoding
+            )
+        return response
+
+    @staticmethod
+    def _cached_response(cached, not_modified):
+        meta, body = cached
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        # Keep the fresh rate limit information of the 304
+        for header, value in not_modified.headers.items():
+            if header.lower().startswith('x-ratelimit'):
+                response.headers[header] = value
+        response._content = body
+        response.encoding = meta.get('encoding')
+        response.url = meta['url']
+        response.request = not_modified.request
+        response.from_cache = True
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._hedge_lock:
+            if self._hedge_executor is not None:
+                self._hedge_executor.shutdown(wait=False)
+                self._hedge_executor = None
+        self.session.close()
+
+
+def parse_link_header(links_header):
+    """Return the ``rel => url`` dict of a GitHub ``Link`` header.
+
+    Pagination documentation: https://developer.github.com/v3/#pagination
+    """
+    links = {}
+    for link in (links_header or '').split(','):
+        if ';' not in link:
+            continue
+        link_url, link_ref = link.split(';', 1)
+        link_url = link_url.strip()[1:-1]
+        link_ref = link_ref.split('=')[-1].strip()[1:-1]
+        links[link_ref] = link_url
+    return links
+
+
+def iter_paginated(url, headers=None, client=None):
+    """Yield the items of every page of a GitHub list endpoint.
+
+    Follows the ``next`` links lazily, so the caller can stop fetching
+    pages by stopping the iteration.
+    """
+    client = client or get_client()
+    while url:
+        r = client.get(url, headers=headers)
+        page = r.json()
+        if not isinstance(page, list):
+            raise GitHubError('Unexpected response from {}: {}'.format(
+                url, page.get('message', page) if isinstance(page, dict)
+                else page
+            ))
+        for item in page:
+            yield item
+        url = parse_link_header(r.headers.get('Link')).get('next')
+
+
+def map_concurrently(func, items, workers=None):
+    """Yield ``func(item)`` for each item, in order, using a bounded pool.
+
+    The number of threads defaults to ``APPLY_PR_HTTP_WORKERS``; with one
+    worker (or one item) everything runs in the calling thread.
+    """
+    items = list(items)
+    if workers is None:
+        workers = http_config()['workers']
+    workers = max(1, min(int(workers), len(items)))
+    if workers == 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(func, items):
+            yield result
+
+
+def get_http_cache():
+    config = http_config()
+    try:
+        path = cache_dir('http')
+    except (IOError, OSError) as e:
+        logger.warning('HTTP cache disabled: %s', e)
+        return None
+    return HTTPCache(
+        path,
+        max_size=config['cache_max_size'],
+        max_age=config['cache_max_age'],
+    )
+
+
+def get_client():
+    """Return the process wide :class:`GitHubClient`, creating it if needed"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                config = http_config()
+                _client = GitHubClient(
+                    pool_connections=config['pool_connections'],
+                    pool_maxsize=config['pool_maxsize'],
+                    timeout=(
+                        config['connect_timeout'], config['read_timeout']
+                    ),
+                    cache=config['cache'] and get_http_cache() or None,
+                    scheduler_config={
+                        'rate': config['rate'],
+                        'burst': config['burst'],
+                        'max_concurrency': config['workers'],
+                        'reserve': config['rate_limit_reserve'],
+                        'max_retries': config['throttle_retries'],
+                    },
+                    retries=config['retries'],
+                    retry_budget=get_retry_budget(
+                        ratio=config['retry_budget']
+                    ),
+                    hedge=config['hedge'],
+                    hedge_percentile=config['hedge_percentile'],
+                )
+    return _client
+
+
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -3,33 +3,145 @@ from __future__ import (
     with_statement, absolute_import, unicode_literals, print_function
 )
 
+import hashlib
+import io
 import time
 import os
 import logging
 import qrcode
-import requests
 from osconf import config_from_environment
+from requests.exceptions import RequestException
 
+from .cache import cache_dir, config_dir, read_json, write_atomic, write_json
+from .github_client import get_client
 
-def is_github_token_valid(token):
+logger = logging.getLogger(__name__)
+
+TOKEN_VALIDATION_TTL = 3600
+
+_valid_tokens = set()
+
+
+def token_fingerprint(token):
+    """Identify a token in caches without storing the secret itself"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _validations_path():
+    return os.path.join(cache_dir(), 'token_validations.json')
+
+
+def _validation_ttl():
+    return config_from_environment(
+        'APPLY_PR', token_validation_ttl=TOKEN_VALIDATION_TTL
+    )['token_validation_ttl']
+
+
+def _request_token_validation(token):
+    """Status code of ``/user`` with the token, ``None`` when GitHub can not
+    be reached"""
     headers = {'Authorization': 'token {token}'.format(token=token)}
     url = "https://api.github.com/user"
 
-    r = requests.get(url, headers=headers)
-
-    return r.status_code == 200
+    try:
+        r = get_client().get(url, headers=headers)
+    except RequestException as e:
+        logger.warning('Unable to validate the GitHub token: %s', e)
+        return None
+
+    return r.status_code
+
+
+def token_status(token, use_cache=True):
+    """Status code of the token validation against GitHub (``200`` when it
+    is valid, ``401`` when it is not), ``None`` when GitHub can not be
+    reached.
+
+    A successful validation is remembered for the whole process and on disk
+    (by token fingerprint) during ``APPLY_PR_TOKEN_VALIDATION_TTL`` seconds;
+    failures are never cached.
+    """
+    if not use_cache:
+        return _request_token_validation(token)
+    fingerprint = token_fingerprint(token)
+    if fingerprint in _valid_tokens:
+        return 200
+    path = _validations_path()
+    validations = read_json(path, default={})
+    now = time.time()
+    checked_at = validations.get(fingerprint)
+    if checked_at and now - checked_at < _validation_ttl():
+        _valid_tokens.add(fingerprint)
+        return 200
+    status = _request_token_validation(token)
+    if status == 200:
+        _valid_tokens.add(fingerprint)
+        validations = read_json(path, default={})
+        validations[fingerprint] = now
+        try:
+            write_json(path, validations)
+        except (IOError, OSError) as e:
+            logger.debug('Unable to store token validation: %s', e)
+    return status
+
+
+def is_github_token_valid(token, use_cache=True):
+    """Check the token against GitHub, see :func:`token_status`"""
+    return token_status(token, use_cache=use_cache) == 200
+
+
+def _token_path():
+    return os.path.join(config_dir(), 'github_token')
+
+
+def load_token():
+    """Return the token stored by a previous device flow login, if any"""
+    try:
+        with io.open(_token_path(), 'r', encoding='utf-8') as stream:
+            return stream.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def save_token(token):
+    try:
+        write_atomic(_token_path(), token.encode('utf-8'), mode=0o600)
+    except (IOError, OSError) as e:
+        logger.warning('Unable to store the GitHub token: %s', e)
+
+
+def forget_token():
+    try:
+        os.remove(_token_path())
+    except (IOError, OSError):
+        pass
 
 
 def github_config(**config):
     def validate(_config):
         if 'token' not in _config or not _config['token']:
             raise EnvironmentError("GITHUB_TOKEN variable not provided")
-        if not is_github_token_valid(_config['token']):
+        status = token_status(_config['token'])
+        if status == 401:
             raise EnvironmentError("GITHUB_TOKEN not valid or expired")
+        if status != 200:
+            # Rate limited, GitHub down...: the token may still be valid
+            logger.warning(
+                'Unable to validate the GitHub token (%s), using it anyway',
+                status
+            )
 
     res = config_from_environment('GITHUB', **config)
     if 'token' not in res:
-        token = oauth_login()
+        token = load_token()
+        # Only a definite rejection forgets the token
+        if token and token_status(token) == 401:
+            forget_token()
+            token = None
+        if not token:
+            token = oauth_login()
+            if token:
+                save_token(token)
         if token:
             res['token'] = token
             os.environ['GITHUB_TOKEN'] = token
@@ -39,7 +151,7 @@ def github_config(**config):
 
 def oauth_login():
     CLIENT_ID = "Ov23li0hFOB6BrHDUCHJ"
-    device_code_response = requests.post(
+    device_code_response = get_client().post(
         "https://github.com/login/device/code",
         data={
             "client_id": CLIENT_ID,
@@ -66,7 +178,7 @@ def oauth_login():
     token = None
     while True:
         time.sleep(interval)
-        token_response = requests.post(
+        token_response = get_client().post(
             "https://github.com/login/oauth/access_token",
             data={
                 "client_id": CLIENT_ID,
@@ -94,9 +206,10 @@ def oauth_login():
 
     if token:
         headers = {"Authorization": "token {}".format(token)}
-        user_info = requests.get("https://api.github.com/user", headers=headers)
+        user_info = get_client().get("https://api.github.com/user", headers=headers)
         user_data = user_info.json()
         print(
             "\n\U0001f44b Welcome, {}!".format(
                 user_data['login']))
+        _valid_tokens.add(token_fingerprint(token))
     return token
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import json
+import logging
+
+from requests.exceptions import RequestException
+
+from .github_client import get_client, map_concurrently
+
+logger = logging.getLogger(__name__)
+
+GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Same fields giscemultitools requests for a single pull request, without
+# the commits that are not needed to check the PRs status.
+PULL_REQUEST_FRAGMENT = '''
+fragment PullRequestFields on PullRequest {
+    id
+    baseRefName
+    number
+    state
+    url
+    title
+    mergedAt
+    createdAt
+    milestone {
+        title
+    }
+    mergeCommit {
+        oid
+    }
+    labels(first: 20) {
+        nodes {
+            name
+        }
+    }
+    projectItems(first: 10) {
+        nodes {
+            project { id title number url }
+            id
+            type
+            fieldValues(last: 10) {
+                nodes {
+                    ... on ProjectV2ItemFieldSingleSelectValue {
+                        id
+                        name
+                        field {
+                            ... on ProjectV2SingleSelectField {
+                                id
+                                name
+                                options {
+                                    name
+                                    id
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+'''
+
+
+def pull_requests_query(owner, repository, numbers):
+    """Build one query asking for all the ``numbers`` PRs using aliases"""
+    aliases = '\n'.join(
+        '        pr{0}: pullRequest(number: {0}) {{ ...PullRequestFields }}'
+        ''.format(int(number)) for number in numbers
+    )
+    query = (
+        'query {{\n'
+        '    repository(owner: {owner}, name: {repository}) {{\n'
+        '{aliases}\n'
+        '    }}\n'
+        '}}\n'
+    ).format(
+        owner=json.dumps(owner), repository=json.dumps(repository),
+        aliases=aliases
+    )
+    return query + PULL_REQUEST_FRAGMENT
+
+
+def get_pull_requests(
+    owner, repository, numbers, token, batch_size=50, client=None
+):
+    """Get the information of many PRs with one GraphQL query per batch.
+
+    The queries are read-only, so they are retried like any idempotent
+    request; a batch still failing is split in halves and requested again.
+
+    :return:    dict ``number => pullRequest`` node, ``None`` for the PRs
+                that could not be retrieved
+    """
+    client = client or get_client()
+    headers = {'Authorization': 'bearer {}'.format(token)}
+    numbers = sorted(set(int(number) for number in numbers))
+    batch_size = max(1, int(batch_size))
+    batches = [
+        numbers[index:index + batch_size]
+        for index in range(0, len(numbers), batch_size)
+    ]
+
+    def request_batch(batch):
+        query = pull_requests_query(owner, repository, batch)
+        try:
+            r = client.post(
+                GRAPHQL_URL, data=json.dumps({'query': query}),
+                headers=headers, idempotent=True
+            )
+            response = r.json()
+        except (RequestException, ValueError) as e:
+            logger.info('GraphQL query failed: %s', e)
+            response = {}
+        for error in response.get('errors') or []:
+            logger.info('GraphQL error: %s', error.get('message', error))
+        repository_data = (response.get('data') or {}).get('repository')
+        if repository_data is None and len(batch) > 1:
+            # Failed as a whole (e.g. a 502 or a timeout): smaller queries
+            # may succeed
+            middle = len(batch) // 2
+            result = request_batch(batch[:middle])
+            result.update(request_batch(batch[middle:]))
+            return result
+        return dict(
+            (number, (repository_data or {}).get('pr{}'.format(number)))
+            for number in batch
+        )
+
+    pulls = {}
+    for result in map_concurrently(request_batch, batches):
+        pulls.update(result)
+    return pulls
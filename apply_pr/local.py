@@ -16,6 +16,9 @@ from fabric import colors
 from tqdm import tqdm
 
 from apply_pr.exceptions import ApplyError
+from apply_pr.preflight import (
+    parse_preflight, problem_message, repository_problems
+)
 
 
 logger = logging.getLogger(__name__)
@@ -121,46 +124,50 @@ def _git_path(checkout, name):
     return os.path.abspath(path)
 
 
-def validate_repository(checkout, skip_rolling_check=False):
-    """Validate the local target before any deployment is registered."""
-    if not os.path.isdir(checkout):
-        raise LocalApplyError(
-            'The local repository does not exist: {}'.format(checkout)
-        )
+def repository_state(checkout):
+    """State of the local checkout, as the remote preflight reports it"""
+    state = parse_preflight('')
+    state['exists'] = os.path.isdir(checkout)
+    if not state['exists']:
+        return state
+    try:
+        version = _run_git(checkout, ['--version']).output.split()
+    except OSError:
+        return state
+    state['git_version'] = version[-1] if version else ''
 
     top_level = _run_git(
         checkout, ['rev-parse', '--show-toplevel'], check=False
     )
     if top_level.failed:
-        raise LocalApplyError(
-            'The local target is not a Git repository: {}'.format(checkout)
-        )
-    if os.path.realpath(top_level.output.strip()) != os.path.realpath(checkout):
-        raise LocalApplyError(
-            'The local target must be the repository root: {}'.format(checkout)
-        )
-
-    if os.path.isdir(_git_path(checkout, 'rebase-apply')):
-        raise LocalApplyError(
-            'The local repository is in the middle of a git am session'
-        )
+        return state
+    state['toplevel'] = os.path.realpath(top_level.output.strip())
+    state['checkout'] = os.path.realpath(checkout)
+    if state['toplevel'] != state['checkout']:
+        return state
+
+    state['am_session'] = os.path.isdir(_git_path(checkout, 'rebase-apply'))
+    state['rebase_session'] = os.path.isdir(
+        _git_path(checkout, 'rebase-merge')
+    )
+    branch = _run_git(
+        checkout, ['symbolic-ref', '--quiet', '--short', 'HEAD'],
+        check=False,
+    )
+    if not branch.failed:
+        state['branch'] = branch.output.strip()
+    status = _run_git(checkout, ['status', '--porcelain'])
+    state['changes'] = len(status.output.strip().splitlines())
+    return state
 
-    if not skip_rolling_check:
-        branch = _run_git(
-            checkout, ['symbolic-ref', '--quiet', '--short', 'HEAD'],
-            check=False,
-        )
-        if branch.failed or branch.output.strip() != 'rolling':
-            raise LocalApplyError(
-                "The local repository is not on the 'rolling' branch"
-            )
 
-    status = _run_git(checkout, ['status', '--porcelain'])
-    if status.output.strip():
-        raise LocalApplyError(
-            'The local repository has uncommitted changes; clean or stash '
-            'them before deploying'
-        )
+def validate_repository(checkout, skip_rolling_check=False):
+    """Validate the local target before any deployment is registered."""
+    problems = repository_problems(
+        repository_state(checkout), skip_rolling_check=skip_rolling_check
+    )
+    if problems:
+        raise LocalApplyError(problem_message(problems[0], 'local', checkout))
 
 
 @contextmanager
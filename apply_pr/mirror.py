@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import base64
+import glob
+import io
+import logging
+import os
+import subprocess
+
+import six
+
+from apply_pr.exceptions import SastreBaseException
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRROR_URL = 'https://github.com/{owner}/{repository}.git'
+
+
+class MirrorError(SastreBaseException):
+    pass
+
+
+def _git_environment(config):
+    """Environment passing ``config`` to git without exposing the values
+    (e.g. a token) in the command line of the process"""
+    env = dict(os.environ)
+    count = int(env.get('GIT_CONFIG_COUNT') or 0)
+    for key, value in config.items():
+        env[str('GIT_CONFIG_KEY_{}'.format(count))] = str(key)
+        env[str('GIT_CONFIG_VALUE_{}'.format(count))] = str(value)
+        count += 1
+    env[str('GIT_CONFIG_COUNT')] = str(count)
+    return env
+
+
+def _run_git(arguments, cwd=None, config=None):
+    command = ['git'] + list(arguments)
+    process = subprocess.Popen(
+        command,
+        cwd=cwd,
+        env=_git_environment(config or {}),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    output = process.communicate()[0]
+    if not isinstance(output, six.text_type):
+        output = output.decode('utf-8', 'replace')
+    if process.returncode:
+        raise MirrorError("Command '{}' failed:\n{}".format(
+            ' '.join(arguments), output.strip()
+        ))
+    return output
+
+
+class GitMirror(object):
+    """Local bare mirror of a repository used to generate the patches.
+
+    The mirror is cloned once and then fetched incrementally, so building
+    the patches of a PR costs no GitHub API calls and is not limited by the
+    250 commits returned by the PR commits endpoint.
+    """
+
+    def __init__(self, url, path, token=None):
+        self.url = url
+        self.path = path
+        self.token = token
+
+    @property
+    def _config(self):
+        config = {}
+        if self.token and self.url.startswith('https://github.com/'):
+            credentials = base64.b64encode(
+                'x-access-token:{}'.format(self.token).encode('utf-8')
+            ).decode('ascii')
+            config['http.https://github.com/.extraheader'] = (
+                'AUTHORIZATION: basic {}'.format(credentials)
+            )
+        return config
+
+    def git(self, *arguments):
+        return _run_git(arguments, cwd=self.path, config=self._config)
+
+    def update(self):
+        """Clone the mirror the first time, fetch the new objects later"""
+        if not os.path.isdir(self.path):
+            parent = os.path.dirname(self.path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            logger.info('Cloning mirror of %s into %s', self.url, self.path)
+            _run_git(
+                ['clone', '--quiet', '--mirror', self.url, self.path],
+                config=self._config
+            )
+        else:
+            logger.info('Fetching mirror %s', self.path)
+            self.git('fetch', '--quiet', '--prune', 'origin')
+
+    def has_commit(self, sha):
+        try:
+            self.git('cat-file', '-e', '{}^{{commit}}'.format(sha))
+        except MirrorError:
+            return False
+        return True
+
+    def fetch_pull(self, pr_number):
+        ref = 'refs/pull/{}/head'.format(pr_number)
+        self.git('fetch', '--quiet', 'origin', '+{0}:{0}'.format(ref))
+
+    def format_patch(self, base, head, destination, from_commit=None):
+        """Write the patches of ``base..head`` into ``destination``.
+
+        Merge commits are skipped like ``git format-patch`` does. With
+        ``from_commit`` the patches before that commit are removed but the
+        numbering is kept, as the GitHub export does.
+        """
+        self.git(
+            'format-patch', '--quiet', '-o', os.path.abspath(destination),
+            '{}..{}'.format(base, head)
+        )
+        patches = sorted(glob.glob(os.path.join(destination, '*.patch')))
+        if from_commit:
+            index = len(patches)
+            for position, patch in enumerate(patches):
+                with io.open(patch, 'r', encoding='utf-8') as stream:
+                    commit = stream.readline().split(' ')[1]
+                if commit == from_commit:
+                    index = position
+                    break
+            for skipped in patches[:index]:
+                logger.info('Skipping patch %s', skipped)
+                os.remove(skipped)
+            patches = patches[index:]
+        return patches
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import atexit
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+import requests
+from osconf import config_from_environment
+
+from .cache import state_dir, write_atomic
+from .github_client import get_client
+from .scheduler import RequestScheduler
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def outbox_config(**config):
+    """Configuration of the GitHub updates outbox (APPLY_PR_OUTBOX_*)"""
+    defaults = {
+        'enabled': True,
+        'drain_timeout': 10,
+    }
+    defaults.update(config)
+    return config_from_environment('APPLY_PR_OUTBOX', **defaults)
+
+
+@contextlib.contextmanager
+def _file_lock(path, blocking=True, timeout=0):
+    """Exclusive lock between processes, yields ``False`` when
+    ``blocking=False`` and another process still holds it after
+    ``timeout`` seconds"""
+    with io.open(path, 'ab') as stream:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(stream.fileno(), flags)
+                break
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.1)
+        try:
+            yield True
+        finally:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+
+class Outbox(object):
+    """Durable queue of the GitHub updates that must not block a deploy.
+
+    Updates (deployment statuses, labels) are appended to ``journal.jsonl``
+    and delivered in order by a background thread; a delivered update is
+    recorded with a ``done`` line, so the updates that could not be sent
+    (GitHub down, process killed...) are replayed by the next flush.
+    Updates refused because of the token (401, or a 403 that is not
+    throttling) are kept as well, to be replayed once the token is valid.
+    """
+
+    def __init__(self, path, token=None, client=None):
+        self.path = path
+        self.journal = os.path.join(path, 'journal.jsonl')
+        self.token = token
+        self.client = client
+        self._thread = None
+        self._requested = 0
+        self._finished = 0
+        self._lock_timeout = 0
+        self._condition = threading.Condition()
+
+    def _token(self):
+        if self.token is None:
+            from .github_utils import github_config
+            self.token = github_config()['token']
+        return self.token
+
+    def _append(self, *records):
+        data = ''.join(
+            json.dumps(record, sort_keys=True) + '\n' for record in records
+        ).encode('utf-8')
+        with _file_lock(self.journal + '.lock'):
+            with io.open(self.journal, 'ab') as stream:
+                stream.write(data)
+                stream.flush()
+                os.fsync(stream.fileno())
+
+    def _read(self):
+        records = []
+        try:
+            with io.open(self.journal, 'r', encoding='utf-8') as stream:
+                for line in stream:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Partial line of an interrupted write
+                        logger.warning('Skipping corrupt outbox line')
+        except (IOError, OSError):
+            pass
+        return records
+
+    def pending(self):
+        """Updates not delivered yet, in the order they were queued"""
+        records = self._read()
+        done = set(r['done'] for r in records if 'done' in r)
+        return [r for r in records if 'id' in r and r['id'] not in done]
+
+    def enqueue(self, url, payload, accept=None, description=None):
+        """Queue a POST of ``payload`` to ``url`` and wake up the worker"""
+        entry = {
+            'id': uuid.uuid4().hex,
+            'url': url,
+            'payload': payload,
+            'accept': accept,
+            'description': description or url,
+            'created_at': time.time(),
+        }
+        self._append(entry)
+        self.start()
+        with self._condition:
+            self._requested += 1
+            self._condition.notify_all()
+        return entry['id']
+
+    def deliver(self, entry):
+        """POST an update, return ``False`` when it has to be retried"""
+        headers = {'Authorization': 'token {}'.format(self._token())}
+        if entry.get('accept'):
+            headers['Accept'] = entry['accept']
+        client = self.client or get_client()
+        try:
+            r = client.post(
+                entry['url'], data=json.dumps(entry['payload']),
+                headers=headers
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning('Unable to send %s: %s', entry['description'], e)
+            return False
+        if r.status_code >= 500 or RequestScheduler.is_throttled(r):
+            logger.warning('Unable to send %s: GitHub answered %s',
+                           entry['description'], r.status_code)
+            return False
+        if r.status_code in (401, 403):
+            # The token is expired, revoked or lacks permissions
+            logger.error('GitHub refused the token to send %s (%s): %s',
+                         entry['description'], r.status_code, r.text)
+            return False
+        if r.status_code >= 400:
+            # Retrying a rejected update will not make it valid
+            logger.error('GitHub rejected %s (%s): %s',
+                         entry['description'], r.status_code, r.text)
+        else:
+            logger.info('Sent %s', entry['description'])
+        return True
+
+    def flush(self, lock_timeout=0):
+        """Deliver the pending updates in order, stopping at the first one
+        that fails so they are never applied out of order.
+
+        :param lock_timeout:    seconds to wait for another process
+                                flushing the outbox
+        :return:    tuple ``(delivered, pending)``; ``None`` for both when
+                    another process is still flushing the outbox
+        """
+        with _file_lock(self.journal + '.flush', blocking=False,
+                        timeout=lock_timeout) as locked:
+            if not locked:
+                return None, None
+            delivered = 0
+            pending = self.pending()
+            for entry in pending:
+                if not self.deliver(entry):
+                    break
+                self._append({'done': entry['id']})
+                delivered += 1
+            if delivered:
+                self.compact()
+            return delivered, len(pending) - delivered
+
+    def compact(self):
+        """Rewrite the journal without the delivered updates"""
+        with _file_lock(self.journal + '.lock'):
+            pending = self.pending()
+            data = ''.join(
+                json.dumps(entry, sort_keys=True) + '\n' for entry in pending
+            ).encode('utf-8')
+            write_atomic(self.journal, data, mode=0o600)
+
+    def start(self):
+        """Start the background worker (once) and drain it at exit"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='sastre-outbox'
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.drain_at_exit)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._finished >= self._requested:
+                    self._condition.wait()
+                target = self._requested
+                lock_timeout = self._lock_timeout
+            try:
+                self.flush(lock_timeout=lock_timeout)
+            except Exception:
+                logger.exception('Unable to flush the outbox')
+            with self._condition:
+                self._finished = target
+                self._condition.notify_all()
+
+    def drain(self, timeout):
+        """Wait up to ``timeout`` seconds for the worker to send the
+        pending updates, return the number of updates left"""
+        if self._thread is None or not self.pending():
+            return len(self.pending())
+        deadline = time.time() + timeout
+        with self._condition:
+            # Wait for another process flushing the outbox instead of
+            # leaving the updates of this one behind
+            self._lock_timeout = timeout
+            self._requested += 1
+            target = self._requested
+            self._condition.notify_all()
+            while self._finished < target:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return len(self.pending())
+
+    def drain_at_exit(self):
+        left = self.drain(outbox_config()['drain_timeout'])
+        if left:
+            print(
+                '{} GitHub updates pending, send them with '
+                '`sastre outbox flush`'.format(left), file=sys.stderr
+            )
+
+
+def outbox_path():
+    return state_dir('outbox')
+
+
+def get_outbox():
+    """Return the outbox of the process, ``None`` when it is disabled"""
+    global _outbox
+    if not outbox_config()['enabled']:
+        return None
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(outbox_path())
+        return _outbox
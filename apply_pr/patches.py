@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import io
+import json
+import os
+import re
+import subprocess
+import tarfile
+import time
+from email.header import decode_header, make_header
+
+import six
+
+PATCH_START_RE = re.compile(
+    br'^From ([0-9a-f]{40}) Mon Sep 17 00:00:00 2001$', re.MULTILINE
+)
+SUBJECT_RE = re.compile(
+    r'^Subject: (?:\[PATCH[^\]]*\] )?(.*(?:\n[ \t].*)*)', re.MULTILINE
+)
+DIFF_RE = re.compile(r'^diff --git a/(.*) b/(.*)$', re.MULTILINE)
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def split_mbox(data):
+    """Split a ``git format-patch`` mbox into an ordered list of patches.
+
+    :param data:    mbox as returned by GitHub for the
+                    ``application/vnd.github.patch`` media type
+    :type data:     bytes
+    :return:        list of ``(sha, patch)`` tuples in the mbox order
+    """
+    starts = list(PATCH_START_RE.finditer(data))
+    patches = []
+    for index, match in enumerate(starts):
+        end = len(data)
+        if index + 1 < len(starts):
+            end = starts[index + 1].start()
+        patch = data[match.start():end].rstrip(b'\n') + b'\n'
+        patches.append((match.group(1).decode('ascii'), patch))
+    return patches
+
+
+def patch_id(content):
+    """Stable patch id of a patch (``git patch-id --stable``), ``None`` when
+    Git is not available"""
+    try:
+        process = subprocess.Popen(
+            ['git', 'patch-id', '--stable'], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except OSError:
+        return None
+    output = process.communicate(content)[0].split()
+    return output[0].decode('ascii') if output else None
+
+
+def manifest_entry(name, content):
+    """Description of the patch file ``name`` with ``content`` (bytes)"""
+    text = content.decode('utf-8', 'replace')
+    header = text.split('\n\n', 1)[0]
+    first_line = text.split('\n', 1)[0].split(' ')
+    subject = SUBJECT_RE.search(header)
+    if subject:
+        # Unfold the header and decode its RFC 2047 words
+        subject = re.sub(r'\n[ \t]+', ' ', subject.group(1))
+        subject = six.text_type(make_header(decode_header(subject)))
+    files = []
+    for match in DIFF_RE.finditer(text):
+        for path in match.groups():
+            if path not in files:
+                files.append(path)
+    number = name.split('-', 1)[0]
+    return {
+        'name': name,
+        'number': int(number) if number.isdigit() else None,
+        'sha': first_line[1] if len(first_line) > 1 else None,
+        'subject': subject or '',
+        'files': files,
+        'patch_id': patch_id(content),
+        'size': len(content),
+    }
+
+
+def write_manifest(directory):
+    """Describe the patch files of ``directory`` in its ``manifest.json``,
+    in the order they are applied, and return the manifest"""
+    manifest = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.patch'):
+            continue
+        with io.open(os.path.join(directory, name), 'rb') as stream:
+            manifest.append(manifest_entry(name, stream.read()))
+    with io.open(os.path.join(directory, MANIFEST_NAME), 'wb') as stream:
+        stream.write(dump_manifest(manifest))
+    return manifest
+
+
+def read_manifest(directory):
+    """Manifest of ``directory``, ``None`` when it has not been written"""
+    try:
+        with io.open(os.path.join(directory, MANIFEST_NAME), 'rb') as stream:
+            return json.loads(stream.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def dump_manifest(manifest):
+    return json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8')
+
+
+def select_patches(manifest, from_commit=None, from_number=0):
+    """Entries of ``manifest`` to apply: from the patch of ``from_commit``
+    (included, none when it is not found) or from the number
+    ``from_number``"""
+    if from_commit:
+        for index, entry in enumerate(manifest):
+            if entry['sha'] == from_commit:
+                return manifest[index:]
+        return []
+    from_number = int(from_number or 0)
+    return [
+        entry for entry in manifest
+        if not from_number or (entry['number'] or 0) >= from_number
+    ]
+
+
+def pack_patches(directory, names, archive, manifest=None):
+    """Write the files ``names`` of ``directory`` to the gzipped tarball
+    ``archive``, at its top level, with ``manifest`` as ``manifest.json``"""
+    with tarfile.open(archive, 'w:gz') as tar:
+        for name in names:
+            tar.add(os.path.join(directory, name), arcname=name)
+        if manifest is not None:
+            data = dump_manifest(manifest)
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from six.moves import shlex_quote
+
+# Prints the state of the checkout given as $1 as ``key=value`` lines, so a
+# remote host is validated with a single command
+PREFLIGHT_SCRIPT = '''
+cd "$1" 2>/dev/null || { echo exists=0; exit 0; }
+echo exists=1
+echo "git_version=$(git --version 2>/dev/null | cut -d ' ' -f 3)"
+echo "checkout=$(pwd -P)"
+echo "toplevel=$(git rev-parse --show-toplevel 2>/dev/null)"
+git_dir=$(git rev-parse --git-dir 2>/dev/null) || exit 0
+test -d "$git_dir/rebase-apply" && echo am_session=1
+test -d "$git_dir/rebase-merge" && echo rebase_session=1
+echo "branch=$(git symbolic-ref --quiet --short HEAD 2>/dev/null)"
+echo "changes=$(git status --porcelain 2>/dev/null | wc -l)"
+'''
+
+MESSAGES = {
+    'missing': 'The {location} repository does not exist: {checkout}',
+    'no_git': 'Git is not installed in the {location} host',
+    'not_git': 'The {location} target is not a Git repository: {checkout}',
+    'not_root': 'The {location} target must be the repository root: '
+                '{checkout}',
+    'am_session': 'The {location} repository is in the middle of a git am '
+                  'session',
+    'rebase_session': 'The {location} repository is in the middle of a git '
+                      'rebase',
+    'not_rolling': "The {location} repository is not on the 'rolling' branch",
+    'dirty': 'The {location} repository has uncommitted changes; clean or '
+             'stash them before deploying',
+}
+
+
+def preflight_command(checkout):
+    """Shell command printing the state of ``checkout``"""
+    return 'sh -c {} sastre-preflight {}'.format(
+        shlex_quote(PREFLIGHT_SCRIPT), shlex_quote(checkout)
+    )
+
+
+def parse_preflight(output):
+    """State of a checkout from the output of :func:`preflight_command`.
+
+    Lines that are not part of the state (e.g. printed by a login shell) are
+    ignored.
+    """
+    state = {
+        'git_version': '',
+        'exists': False,
+        'checkout': '',
+        'toplevel': '',
+        'am_session': False,
+        'rebase_session': False,
+        'branch': '',
+        'changes': 0,
+    }
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if not sep or key not in state:
+            continue
+        if isinstance(state[key], bool):
+            state[key] = value == '1'
+        elif isinstance(state[key], int):
+            state[key] = int(value.strip() or 0)
+        else:
+            state[key] = value
+    return state
+
+
+def repository_problems(state, skip_rolling_check=False):
+    """Keys of :data:`MESSAGES` that prevent deploying to a checkout, in
+    the order they are checked; only the first one is reported when the
+    checkout can not be inspected further"""
+    if not state['exists']:
+        return ['missing']
+    if not state['git_version']:
+        return ['no_git']
+    if not state['toplevel']:
+        return ['not_git']
+    # Both paths have their symbolic links resolved
+    if state['toplevel'] != state['checkout']:
+        return ['not_root']
+    problems = []
+    if state['am_session']:
+        problems.append('am_session')
+    if state['rebase_session']:
+        problems.append('rebase_session')
+    if not skip_rolling_check and state['branch'] != 'rolling':
+        problems.append('not_rolling')
+    if state['changes']:
+        problems.append('dirty')
+    return problems
+
+
+def problem_message(problem, location, checkout):
+    return MESSAGES[problem].format(location=location, checkout=checkout)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+from __future__ import (
+    with_statement, absolute_import, unicode_literals, print_function
+)
+
+import collections
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+
+from six.moves.urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def rate_limit_resource(url):
+    """GitHub rate limit (``X-RateLimit-Resource``) a request to ``url``
+    counts against"""
+    path = urlparse(url).path
+    if path.rstrip('/').endswith('/graphql'):
+        return 'graphql'
+    if path.startswith('/search/'):
+        return 'search'
+    return 'core'
+
+
+class RequestScheduler(object):
+    """Admission control for the requests sent with one token to one host.
+
+    * A token bucket limits the request rate (``rate`` per second with
+      bursts of ``burst``).
+    * GitHub rate limits are tracked by resource (``core``, ``search``,
+      ``graphql``). When less than ``reserve`` requests are left in one, its
+      requests are spread until the reset time, and they wait for the reset
+      when none is left; the requests of the other resources are not slowed
+      down.
+    * The number of requests in flight adapts: it is halved each time GitHub
+      throttles us and grows again one by one after successful requests.
+    * Throttled requests (429, secondary rate limit 403) pause every request
+      of the scheduler for ``Retry-After`` seconds or a jittered exponential
+      backoff, and can be retried by the caller.
+    """
+
+    def __init__(self, rate=10.0, burst=20, max_concurrency=8, reserve=50,
+                 max_retries=3, backoff=1.0, max_backoff=60.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.concurrency = self.max_concurrency
+        self.reserve = int(reserve)
+        self.max_retries = int(max_retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.paused_until = 0
+        self.limits = {}
+        self._successes = 0
+        self._updated = time.time()
+        self._condition = threading.Condition()
+
+    def _limit(self, resource):
+        return self.limits.setdefault(resource, {
+            'remaining': None, 'reset_at': None, 'next_at': 0,
+        })
+
+    def current_rate(self, now, resource='core'):
+        """Request rate allowed for ``resource``"""
+        rate = self.rate
+        limit = self._limit(resource)
+        remaining, reset_at = limit['remaining'], limit['reset_at']
+        if remaining is not None and reset_at \
+                and remaining < self.reserve and reset_at > now:
+            rate = min(rate, max(remaining, 1) / (reset_at - now))
+        return rate
+
+    def resource_wait(self, resource, now):
+        """Seconds the requests of ``resource`` have to wait for its rate
+        limit"""
+        limit = self._limit(resource)
+        if limit['remaining'] == 0 and limit['reset_at'] \
+                and limit['reset_at'] > now:
+            return limit['reset_at'] + 1 - now
+        return max(limit['next_at'] - now, 0)
+
+    def _refill(self, now):
+        elapsed = max(now - self._updated, 0)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self._updated = now
+
+    def acquire(self, resource='core'):
+        """Block until a request to ``resource`` can be sent"""
+        with self._condition:
+            while True:
+                now = time.time()
+                if now < self.paused_until:
+                    self._condition.wait(self.paused_until - now)
+                    continue
+                wait = self.resource_wait(resource, now)
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                if self.in_flight >= self.concurrency:
+                    self._condition.wait(1)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    rate = self.current_rate(now, resource)
+                    if rate < self.rate:
+                        # Spread the requests left until the reset
+                        self._limit(resource)['next_at'] = now + 1 / rate
+                    return
+                self._condition.wait((1 - self.tokens) / self.rate)
+
+    @staticmethod
+    def is_throttled(response):
+        if response is None:
+            return False
+        if response.status_code == 429:
+            return True
+        if response.status_code != 403:
+            return False
+        if 'Retry-After' in response.headers:
+            return True
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            return True
+        return b'rate limit' in (response.content or b'').lower()
+
+    def _delay(self, response, attempt, now, resource='core'):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        reset_at = self._limit(resource)['reset_at']
+        if response.headers.get('X-RateLimit-Remaining') == '0' and reset_at:
+            return max(reset_at - now, 0) + 1
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return delay * random.uniform(0.5, 1.5)
+
+    def release(self, response=None, attempt=0, resource='core'):
+        """Register the result of a request to ``resource``.
+
+        :return:    seconds the requests are paused when ``response`` was
+                    throttled, ``None`` otherwise
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.time()
+            delay = None
+            if response is not None:
+                headers = response.headers
+                resource = headers.get('X-RateLimit-Resource', resource)
+                limit = self._limit(resource)
+                if 'X-RateLimit-Remaining' in headers:
+                    limit['remaining'] = int(headers['X-RateLimit-Remaining'])
+                if 'X-RateLimit-Reset' in headers:
+                    limit['reset_at'] = float(headers['X-RateLimit-Reset'])
+                if self.is_throttled(response):
+                    delay = self._delay(response, attempt, now, resource)
+                    if limit['remaining'] == 0 and limit['reset_at']:
+                        # Primary rate limit: only this resource waits
+                        limit['reset_at'] = max(
+                            limit['reset_at'], now + delay - 1
+                        )
+                    else:
+                        self.paused_until = max(
+                            self.paused_until, now + delay
+                        )
+                        self.concurrency = max(1, self.concurrency // 2)
+                    self._successes = 0
+                elif response.status_code < 400:
+                    self._successes += 1
+                    if self._successes >= self.concurrency \
+                            and self.concurrency < self.max_concurrency:
+                        self.concurrency += 1
+                        self._successes = 0
+            self._condition.notify_all()
+            return delay
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(url, headers=None, **config):
+    """Return the scheduler shared by the requests to the same host with
+    the same credentials, whatever the authorization scheme (``token`` for
+    REST, ``bearer`` for GraphQL)"""
+    authorization = (headers or {}).get('Authorization') or ''
+    authorization = authorization.split(' ', 1)[-1].strip()
+    key = (
+        urlparse(url).netloc,
+        hashlib.sha256(authorization.encode('utf-8')).hexdigest()
+    )
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(**config)
+        return _schedulers[key]
+
+
+def reset_schedulers():
+    with _schedulers_lock:
+        _schedulers.clear()
+
+
+class RetryBudget(object):
+    """Limit of the retries (and hedged requests) of the whole process.
+
+    Each request deposits ``ratio`` tokens and each retry withdraws one, so
+    retries can't exceed ``ratio`` of the traffic once the initial
+    ``reserve`` is spent, and a failing GitHub is not flooded with them.
+    """
+
+    def __init__(self, ratio=0.1, reserve=10):
+        self.ratio = float(ratio)
+        self.reserve = float(reserve)
+        self.tokens = self.reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Take a token for a retry, ``False`` when the budget is spent"""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyTracker(object):
+    """Latencies of the last ``size`` requests"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = int(min_samples)
+        self._samples = collections.deque(maxlen=int(size))
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """Return the ``percent`` percentile or ``None`` without enough
+        samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        index = int(math.ceil(len(samples) * percent / 100.0)) - 1
+        return samples[min(max(index, 0), len(samples) - 1)]
+
+
+_retry_budget = None
+
+
+def get_retry_budget(**config):
+    """Return the retry budget shared by every request of the process"""
+    global _retry_budget
+    with _schedulers_lock:
+        if _retry_budget is None:
+            _retry_budget = RetryBudget(**config)
+        return _retry_budget
+
+
+def reset_retry_budget():
+    global _retry_budget
+    with _schedulers_lock:
+        _retry_budget = None
@@ -1,24 +1,112 @@
 # coding=utf-8
 from __future__ import unicode_literals
-from pkg_resources import parse_version
+import atexit
+import logging
+import os
+import threading
+import time
 
-import requests
+from osconf import config_from_environment
+from six import string_types
+from packaging.version import InvalidVersion, parse as parse_version
+
+from .cache import cache_dir, read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+PYPI_URL = 'https://pypi.org/pypi/apply_pr/json'
+PYPI_TIMEOUT = (5, 10)
+
+
+def version_check_config(**config):
+    """Configuration of the version check (APPLY_PR_VERSION_CHECK_*)"""
+    defaults = {
+        'ttl': 24 * 3600,
+        'timeout': 3,
+    }
+    defaults.update(config)
+    return config_from_environment('APPLY_PR_VERSION_CHECK', **defaults)
+
+
+def _cache_path():
+    return os.path.join(cache_dir(), 'latest_version.json')
+
+
+def refresh_latest_version(timeout=PYPI_TIMEOUT):
+    """Get the latest version from PyPI and cache it, ``None`` offline"""
+    import requests
+
+    try:
+        version = latest_version(timeout=timeout)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.info('Unable to check the latest version: %s', e)
+        return None
+    try:
+        write_json(_cache_path(), {'version': version, 'time': time.time()})
+    except (IOError, OSError) as e:
+        logger.info('Unable to cache the latest version: %s', e)
+    return version
+
+
+def cached_latest_version():
+    """Latest version known, refreshing it in the background when the cached
+    one is older than the TTL.
+
+    Only the first run, without a cached version, waits for PyPI (up to the
+    configured timeout).
+    """
+    config = version_check_config()
+    try:
+        cached = read_json(_cache_path())
+    except (IOError, OSError):
+        cached = None
+    if not isinstance(cached, dict) \
+            or not isinstance(cached.get('version'), string_types) \
+            or not isinstance(cached.get('time'), (int, float)):
+        # Missing, truncated or edited by hand
+        return refresh_latest_version(timeout=config['timeout'])
+    if time.time() - cached['time'] > config['ttl']:
+        refresh = threading.Thread(
+            target=refresh_latest_version, name='sastre-version-check'
+        )
+        refresh.daemon = True
+        refresh.start()
+        # Give a fast answer the chance to be saved before exiting
+        atexit.register(refresh.join, config['timeout'])
+    return cached['version']
+
+
+def _is_valid(version):
+    try:
+        parse_version(version)
+    except InvalidVersion:
+        return False
+    return True
 
 
 def check_version():
     import apply_pr
     running_version = apply_pr.__version__
-    last_version = latest_version()
-    if parse_version(running_version) < parse_version(latest_version()):
+    if not _is_valid(running_version):
+        # Not installed from a release (e.g. a source checkout)
+        return
+    last_version = cached_latest_version()
+    if last_version is None:
+        return
+    if parse_version(running_version) < parse_version(last_version):
         raise SystemExit('Your version {} is outdated. Upgrade to {}'.format(
             running_version, last_version
         ))
 
 
-def available_versions():
-    r = requests.get('https://pypi.python.org/pypi/apply_pr/json')
-    return sorted(r.json()['releases'].keys(), key=parse_version)
+def available_versions(timeout=PYPI_TIMEOUT):
+    import requests
+
+    r = requests.get(PYPI_URL, timeout=timeout)
+    return sorted(
+        filter(_is_valid, r.json()['releases'].keys()), key=parse_version
+    )
 
 
-def latest_version():
-    return available_versions()[-1]
\ No newline at end of file
+def latest_version(timeout=PYPI_TIMEOUT):
+    return available_versions(timeout=timeout)[-1]
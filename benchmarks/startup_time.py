@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Cold start time of the sastre commands.
+
+Every scenario runs in a fresh interpreter with ``python -X importtime``
+(Python 3.7+) and reports the median wall time, the time spent importing
+and the slowest top level imports::
+
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --repeat 20 --json > startup.json
+
+The commands talking to GitHub or to a host are measured up to that point:
+the scenario imports the modules the command loads before its first request.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ('sastre --help', ['-m', 'apply_pr.cli', '--help']),
+    ('deploy --local', ['-c', (
+        'import apply_pr.cli, apply_pr.version, apply_pr.deploys, '
+        'apply_pr.local'
+    )]),
+    ('check_prs', ['-c', (
+        'import apply_pr.cli, apply_pr.version, apply_pr.check_prs, '
+        'packaging.version, giscemultitools.githubutils.objects, '
+        'giscemultitools.githubutils.utils'
+    )]),
+]
+
+
+def parse_importtime(output):
+    """Return ``(total, modules)`` in microseconds from the ``-X importtime``
+    output, ``modules`` being the cumulative time of the top level imports"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # Header line
+            continue
+        name = fields[2].rstrip()
+        if name.startswith('  '):
+            # Imported by another module, already in its cumulative time
+            continue
+        modules.append((name.strip(), int(fields[1])))
+    return sum(cumulative for _, cumulative in modules), modules
+
+
+def run(arguments):
+    command = [sys.executable, '-X', 'importtime'] + arguments
+    start = time.time()
+    process = subprocess.Popen(
+        command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, stderr = process.communicate()
+    elapsed = time.time() - start
+    stderr = stderr.decode('utf-8', 'replace')
+    if process.returncode:
+        errors = [
+            line for line in stderr.splitlines()
+            if not line.startswith('import time:')
+        ]
+        raise RuntimeError('{} failed:\n{}'.format(
+            ' '.join(command), '\n'.join(errors)
+        ))
+    total, modules = parse_importtime(stderr)
+    return elapsed, total, modules
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(arguments, repeat):
+    runs = [run(arguments) for _ in range(repeat)]
+    slowest = {}
+    for _, _, modules in runs:
+        for name, cumulative in modules:
+            slowest.setdefault(name, []).append(cumulative)
+    return {
+        'wall_ms': median([r[0] for r in runs]) * 1000,
+        'imports_ms': median([r[1] for r in runs]) / 1000.0,
+        'modules_ms': sorted(
+            ((name, median(times) / 1000.0)
+             for name, times in slowest.items()),
+            key=lambda item: item[1], reverse=True
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of every scenario (median is reported)')
+    parser.add_argument('--top', type=int, default=8,
+                        help='Slowest top level imports to show')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for name, arguments in SCENARIOS:
+        try:
+            results[name] = measure(arguments, args.repeat)
+        except RuntimeError as e:
+            print('{}: {}'.format(name, e), file=sys.stderr)
+            continue
+        results[name]['modules_ms'] = results[name]['modules_ms'][:args.top]
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    for name, _ in SCENARIOS:
+        if name not in results:
+            continue
+        result = results[name]
+        print('{}: {:.0f} ms ({:.0f} ms importing)'.format(
+            name, result['wall_ms'], result['imports_ms']
+        ))
+        for module, elapsed in result['modules_ms']:
+            print('  {:>7.1f} ms  {}'.format(elapsed, module))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+from apply_pr.cache import PatchStore
+
+SHA = 'a' * 40
+OTHER_SHA = 'b' * 40
+
+
+def make_patch(sha, size=10):
+    return 'From {} Mon Sep 17 00:00:00 2001\n{}'.format(
+        sha, 'x' * size
+    ).encode('utf-8')
+
+
+class PatchStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.store = PatchStore(self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stores_patch_by_commit_sha(self):
+        self.assertIsNone(self.store.get(SHA))
+
+        self.assertTrue(self.store.put(SHA, make_patch(SHA)))
+
+        self.assertEqual(self.store.get(SHA), make_patch(SHA))
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.tempdir, SHA + '.patch'))
+        )
+
+    def test_rejects_patch_of_another_commit(self):
+        self.assertFalse(self.store.put(SHA, make_patch(OTHER_SHA)))
+        self.assertFalse(self.store.put(SHA, b'{"message": "Not Found"}'))
+
+        self.assertIsNone(self.store.get(SHA))
+
+    def test_drops_corrupted_patch(self):
+        self.store.put(SHA, make_patch(SHA))
+        with open(os.path.join(self.tempdir, SHA + '.patch'), 'ab') as f:
+            f.write(b'garbage')
+
+        self.assertIsNone(self.store.get(SHA))
+        self.assertEqual(self.store.stats()['entries'], 0)
+
+    def test_rejects_invalid_sha(self):
+        with self.assertRaises(ValueError):
+            self.store.get('../../etc/passwd')
+
+    def test_evicts_least_recently_used_patches(self):
+        self.store.put(SHA, make_patch(SHA, 100))
+        self.store.put(OTHER_SHA, make_patch(OTHER_SHA, 100))
+        os.utime(os.path.join(self.tempdir, SHA + '.patch'), (1, 1))
+        os.utime(os.path.join(self.tempdir, OTHER_SHA + '.patch'), (2, 2))
+        # Reading a patch makes it the most recently used one
+        self.store.get(SHA)
+
+        self.store.max_size = self.store.stats()['size'] - 1
+        self.assertEqual(self.store.evict(), 1)
+
+        self.assertIsNotNone(self.store.get(SHA))
+        self.assertIsNone(self.store.get(OTHER_SHA))
+
+    def test_evicts_every_few_stores(self):
+        self.store.max_size = 0
+        self.store.EVICT_EVERY = 2
+        self.store.put(SHA, make_patch(SHA))
+        self.assertEqual(self.store.stats()['entries'], 1)
+
+        self.store.put(OTHER_SHA, make_patch(OTHER_SHA))
+        self.assertEqual(self.store.stats()['entries'], 0)
+
+    def test_clear(self):
+        self.store.put(SHA, make_patch(SHA))
+
+        self.assertEqual(self.store.clear(), 1)
+        self.assertEqual(self.store.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
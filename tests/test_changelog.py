@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import calendar
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import requests
+from six.moves.urllib.parse import parse_qs, urlparse
+
+fake_qrcode = types.ModuleType(str('qrcode'))
+fake_qrcode.QRCode = object
+sys.modules.setdefault('qrcode', fake_qrcode)
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+from apply_pr import changelog
+from apply_pr.exceptions import GitHubError
+
+
+class PullGroupTest(unittest.TestCase):
+    def test_groups_by_gis_and_facturacio_labels(self):
+        def item(*labels):
+            return {'labels': [{'name': name} for name in labels]}
+
+        self.assertEqual(changelog.pull_group(item('bug')), 'no_gis_no_fact')
+        self.assertEqual(changelog.pull_group(item()), 'no_gis_no_fact')
+        self.assertEqual(changelog.pull_group(item('GIS')), 'gis_no_fact')
+        self.assertEqual(changelog.pull_group(item('gis')), 'gis_no_fact')
+        self.assertEqual(
+            changelog.pull_group(item('facturacio', 'core')), 'no_gis_fact'
+        )
+        self.assertIsNone(changelog.pull_group(item('GIS', 'facturacio')))
+
+
+class FakeMarkdownClient(object):
+    def __init__(self):
+        self.texts = []
+
+    def post(self, url, headers=None, json=None):
+        self.texts.append(json['text'])
+        html = re.sub(
+            r'!\[image\]\((.*?)\)',
+            r'<a href="https://camo.example.net/\1"><img src="x"></a>',
+            json['text']
+        )
+        response = requests.Response()
+        response.status_code = 200
+        response._content = html.encode('utf-8')
+        response.encoding = 'utf-8'
+        return response
+
+
+class ResolveImagesTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+        self.client = FakeMarkdownClient()
+        self.old_get_client = changelog.get_client
+        self.old_github_config = changelog.github_config
+        changelog.get_client = lambda: self.client
+        changelog.github_config = lambda: {'token': 'secret'}
+
+    def tearDown(self):
+        changelog.get_client = self.old_get_client
+        changelog.github_config = self.old_github_config
+        if self.old_cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.old_cache_home
+        shutil.rmtree(self.tempdir)
+
+    def test_renders_the_images_in_one_request_and_caches_them(self):
+        body = changelog.format_body({
+            'body': 'One ![image](a.png) two ![image](b.png) ![image](a.png)'
+        }, 'gisce', 'erp')
+        images = changelog.find_images(body)
+
+        urls = changelog.resolve_images(images, 'gisce', 'erp')
+
+        self.assertEqual(len(self.client.texts), 1)
+        self.assertEqual(urls, {
+            '![image](a.png)': 'https://camo.example.net/a.png',
+            '![image](b.png)': 'https://camo.example.net/b.png',
+        })
+        self.assertEqual(
+            changelog.resolve_images(images, 'gisce', 'erp'), urls
+        )
+        self.assertEqual(len(self.client.texts), 1)
+
+    def test_detail_uses_the_resolved_urls(self):
+        detail = changelog.print_item_detail({
+            'title': 'Title', 'number': 1, 'url': 'https://x', 'labels': [],
+            'body': 'See ![image](a.png)',
+        }, 'gisce', 'erp', image_urls={'![image](a.png)': 'https://y/a'})
+
+        self.assertIn('See ![image](https://y/a)', detail)
+        self.assertEqual(self.client.texts, [])
+
+
+class ChangelogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def record(self, number, group, type_key, key, top=False):
+        return {
+            'number': number, 'created_at': '2024-01-{:02d}'.format(number),
+            'group': group, 'kind': 'pull', 'type_key': type_key,
+            'key': key, 'top': top, 'item': '\n* item {}'.format(number),
+            'detail': '\ndetail {}'.format(number),
+        }
+
+    def test_sections_follow_the_search_order(self):
+        writer = changelog.ChangelogWriter('24.5', self.tempdir)
+        for record in [
+            self.record(1, 'gis_no_fact', changelog.ELEC_LABEL, 'gis'),
+            self.record(2, 'no_gis_no_fact', 'others', 'gis', top=True),
+            self.record(3, 'no_gis_no_fact', changelog.ELEC_LABEL, 'gis'),
+            self.record(4, 'no_gis_no_fact', 'others', 'bug'),
+            self.record(5, 'no_gis_no_fact', 'others', 'core'),
+            self.record(6, 'no_gis_no_fact', changelog.GAS_LABEL, 'custom'),
+        ]:
+            writer.add(record)
+
+        writer.write()
+
+        with open(os.path.join(self.tempdir, 'changelog_24.5.md')) as f:
+            content = f.read()
+        numbers = [int(n) for n in re.findall(r'item (\d+)', content)]
+        # Electric first (own PRs by group, then the common ones), and the
+        # bug fixes after every other key
+        self.assertEqual(numbers, [3, 1, 2, 5, 4])
+        with open(os.path.join(self.tempdir, 'top_24.5.md')) as f:
+            self.assertIn('item 2', f.read())
+        with open(os.path.join(self.tempdir, 'detailed_24.5.md')) as f:
+            self.assertEqual(
+                re.findall(r'detail (\d+)', f.read()),
+                ['3', '1', '2', '5', '4']
+            )
+
+
+class FakeSearchClient(object):
+    """Search API over ``count`` merged PRs, one per hour"""
+
+    def __init__(self, count):
+        start = 1704067200  # 2024-01-01
+        self.pulls = [
+            {'id': number, 'number': number,
+             'created_at': time.strftime(
+                 '%Y-%m-%dT%H:%M:%SZ', time.gmtime(start + number * 3600)),
+             'merged_at': start + number * 3600 + 60}
+            for number in range(count)
+        ]
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        with self.lock:
+            self.urls.append(url)
+        query = parse_qs(urlparse(url).query)
+        pulls = self.pulls
+        merged = re.search(r'merged:(\S+?)\.\.(\S+?)( |$)', query['q'][0])
+        if merged:
+            since, until = [
+                calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+                for value in merged.groups()[:2]
+            ]
+            pulls = [p for p in pulls if since <= p['merged_at'] <= until]
+        per_page = int(query['per_page'][0])
+        page = int(query.get('page', [1])[0])
+        if page * per_page > 1000:
+            data = {'message': 'Only the first 1000 search results'}
+        else:
+            data = {
+                'total_count': len(pulls),
+                'items': pulls[(page - 1) * per_page:page * per_page],
+            }
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(data).encode('utf-8')
+        response.encoding = 'utf-8'
+        return response
+
+
+class SearchPagesTest(unittest.TestCase):
+    def setUp(self):
+        self.old = changelog.get_client, changelog.github_config
+        changelog.github_config = lambda: {'token': 'secret'}
+
+    def tearDown(self):
+        changelog.get_client, changelog.github_config = self.old
+
+    def search(self, count):
+        client = FakeSearchClient(count)
+        changelog.get_client = lambda: client
+        url = ('https://api.github.com/search/issues?q=is:pr+is:merged'
+               '&sort=created&order=asc&per_page=100')
+        pages = list(changelog.iter_search_pages(url, base='developer'))
+        return client, [item for page in pages for item in page]
+
+    def test_fetches_every_page(self):
+        client, items = self.search(250)
+
+        self.assertEqual([i['number'] for i in items], list(range(250)))
+        self.assertEqual(len(client.urls), 3)
+        self.assertEqual(items[0]['base_ref'], 'developer')
+
+    def test_splits_searches_over_the_results_limit(self):
+        client, items = self.search(2500)
+
+        self.assertEqual(
+            sorted(i['number'] for i in items), list(range(2500))
+        )
+        self.assertTrue(all('merged:' in url for url in client.urls[1:]))
+
+    def test_failed_page_raises(self):
+        client = FakeSearchClient(250)
+        failure = requests.Response()
+        failure.status_code = 403
+        failure._content = b'{"message": "API rate limit exceeded"}'
+        get = client.get
+        client.get = lambda url, headers=None: (
+            failure if 'page=3' in url else get(url, headers)
+        )
+        changelog.get_client = lambda: client
+        url = ('https://api.github.com/search/issues?q=is:pr+is:merged'
+               '&sort=created&order=asc&per_page=100')
+
+        with self.assertRaises(GitHubError):
+            list(changelog.iter_search_pages(url))
+
+
+def search_item(number, title, milestone='24.5', labels=(), updated='1'):
+    return {
+        'number': number,
+        'title': title,
+        'html_url': 'https://github.com/gisce/erp/pull/{}'.format(number),
+        'body': 'Body of {}'.format(title),
+        'labels': [{'name': name, 'color': 'fff'} for name in labels],
+        'milestone': {'title': milestone},
+        'created_at': '2024-01-0{}T00:00:00Z'.format(number),
+        'updated_at': updated,
+    }
+
+
+class IncrementalChangelogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+        self.output = os.path.join(self.tempdir, 'out')
+        self.searches = []
+        self.results = []
+        self.old = changelog.iter_search_pages, changelog.github_config
+
+        def fake_search_pages(url, base=None):
+            self.searches.append(url)
+            items = self.results.pop(0)
+            if isinstance(items, Exception):
+                raise items
+            for item in items:
+                item['base_ref'] = base
+            # One page per item
+            for item in items:
+                yield [item]
+
+        changelog.iter_search_pages = fake_search_pages
+        changelog.github_config = lambda: {'token': 'secret'}
+
+    def tearDown(self):
+        changelog.iter_search_pages, changelog.github_config = self.old
+        if self.old_cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.old_cache_home
+        shutil.rmtree(self.tempdir)
+
+    def read(self, name):
+        with open(os.path.join(self.output, name)) as stream:
+            return stream.read()
+
+    def test_second_run_only_searches_updated_pulls(self):
+        self.results = [
+            [search_item(1, 'First', labels=['bug']),
+             search_item(2, 'Second', labels=['core'])],
+            [search_item(2, 'Second renamed', labels=['core'], updated='2'),
+             search_item(1, 'First', milestone='24.6', labels=['bug'])],
+        ]
+
+        changelog.make_changelog('24.5', changelog_path=self.output)
+        self.assertIn('milestone:24.5', self.searches[0])
+        self.assertIn('First', self.read('changelog_24.5.md'))
+
+        changelog.make_changelog('24.5', changelog_path=self.output)
+        self.assertIn('updated:>', self.searches[1])
+        self.assertNotIn('milestone:', self.searches[1])
+        content = self.read('changelog_24.5.md')
+        self.assertNotIn('First', content)
+        self.assertIn('Second renamed', content)
+        self.assertIn('Body of Second renamed', self.read('detailed_24.5.md'))
+
+    def test_full_run_ignores_the_state(self):
+        self.results = [[search_item(1, 'First')], [search_item(2, 'Two')]]
+
+        changelog.make_changelog('24.5', changelog_path=self.output)
+        changelog.make_changelog(
+            '24.5', changelog_path=self.output, full=True
+        )
+
+        self.assertIn('milestone:24.5', self.searches[1])
+        content = self.read('changelog_24.5.md')
+        self.assertNotIn('First', content)
+        self.assertIn('Two', content)
+
+
+    def test_failed_search_keeps_the_previous_run(self):
+        self.results = [
+            [search_item(1, 'First')],
+            GitHubError('Search failed'),
+            [search_item(2, 'Two')],
+        ]
+        state_path = changelog.changelog_state_path('24.5', 'gisce', 'erp')
+
+        changelog.make_changelog('24.5', changelog_path=self.output)
+        last_run = changelog.read_json(state_path)['last_run']
+        with self.assertRaises(GitHubError):
+            changelog.make_changelog('24.5', changelog_path=self.output)
+
+        self.assertEqual(
+            changelog.read_json(state_path)['last_run'], last_run
+        )
+        changelog.make_changelog('24.5', changelog_path=self.output)
+        self.assertEqual(self.searches[1], self.searches[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -143,11 +143,12 @@ class DeploymentTargetValidationTest(unittest.TestCase):
 
     def test_local_mode_bypasses_fabric_execute_and_ssh_configuration(self):
         calls = []
-        fake_fabfile = types.ModuleType(str('apply_pr.fabfile'))
-        old_fabfile = sys.modules.get('apply_pr.fabfile')
-        old_package_fabfile = getattr(
-            apply_pr_package, 'fabfile', None
+        fake_deploys = types.ModuleType(str('apply_pr.deploys'))
+        old_modules = dict(
+            (name, sys.modules.get(name))
+            for name in ('apply_pr.deploys', 'apply_pr.fabfile')
         )
+        old_package_deploys = getattr(apply_pr_package, 'deploys', None)
         old_local_apply = local_backend.apply_pr
         old_execute = cli.execute
         old_configure_ssh_auth = cli.configure_ssh_auth
@@ -160,8 +161,10 @@ class DeploymentTargetValidationTest(unittest.TestCase):
             raise AssertionError('SSH/Fabric remote execution was used')
 
         try:
-            sys.modules['apply_pr.fabfile'] = fake_fabfile
-            apply_pr_package.fabfile = fake_fabfile
+            sys.modules['apply_pr.deploys'] = fake_deploys
+            # Importing the fabfile raises ImportError
+            sys.modules['apply_pr.fabfile'] = None
+            apply_pr_package.deploys = fake_deploys
             local_backend.apply_pr = fake_local_apply
             cli.execute = forbidden
             cli.configure_ssh_auth = forbidden
@@ -177,17 +180,18 @@ class DeploymentTargetValidationTest(unittest.TestCase):
             local_backend.apply_pr = old_local_apply
             cli.execute = old_execute
             cli.configure_ssh_auth = old_configure_ssh_auth
-            if old_fabfile is None:
-                sys.modules.pop('apply_pr.fabfile', None)
+            for name, module in old_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+            if old_package_deploys is None:
+                delattr(apply_pr_package, 'deploys')
             else:
-                sys.modules['apply_pr.fabfile'] = old_fabfile
-            if old_package_fabfile is None:
-                delattr(apply_pr_package, 'fabfile')
-            else:
-                apply_pr_package.fabfile = old_package_fabfile
+                apply_pr_package.deploys = old_package_deploys
 
         self.assertEqual(result, [{'local': True}])
-        self.assertEqual(calls[0][0], fake_fabfile)
+        self.assertEqual(calls[0][0], fake_deploys)
         self.assertEqual(calls[0][1], '42')
 
 
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import types
+import unittest
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+fake_fabric = types.ModuleType(str('fabric'))
+fake_fabric_colors = types.ModuleType(str('fabric.colors'))
+fake_fabric.colors = fake_fabric_colors
+sys.modules.setdefault('fabric', fake_fabric)
+sys.modules.setdefault('fabric.colors', fake_fabric_colors)
+
+from apply_pr import deploys
+
+
+class FakeRepository(object):
+    def __init__(self, deployments, statuses):
+        self.deployments = deployments
+        self._statuses = statuses
+        self.listed = 0
+
+    def iter_deployments(self, environment=None):
+        for deployment in self.deployments:
+            self.listed += 1
+            yield deployment
+
+    def statuses(self, deployments, latest=False):
+        return [self._statuses.get(d['id'], []) for d in deployments]
+
+
+def make_commit(sha, date):
+    return {'sha': sha, 'commit': {'committer': {'date': date}}}
+
+
+def make_deployment(id, sha, created_at, host='erp01'):
+    return {
+        'id': id, 'sha': sha, 'created_at': created_at,
+        'payload': {'host': host},
+    }
+
+
+class GetLastDeployTest(unittest.TestCase):
+    def setUp(self):
+        self.old_get_commits = deploys.get_commits
+        self.old_github_repository = deploys.github_repository
+
+    def tearDown(self):
+        deploys.get_commits = self.old_get_commits
+        deploys.github_repository = self.old_github_repository
+
+    def use(self, commits, repository):
+        deploys.get_commits = lambda *args: commits
+        deploys.github_repository = lambda *args: repository
+
+    def test_finds_deployment_older_than_the_committer_dates(self):
+        # The deployment of 'a' is older than its committer date, even with
+        # the margin
+        commits = [
+            make_commit('a', '2024-05-10T10:00:00Z'),
+            make_commit('b', '2024-05-10T11:00:00Z'),
+        ]
+        deployments = [
+            make_deployment(3, 'x', '2024-05-09T12:00:00Z'),
+            make_deployment(2, 'a', '2024-04-01T12:00:00Z'),
+            make_deployment(1, 'y', '2024-01-01T00:00:00Z'),
+        ]
+        repository = FakeRepository(
+            deployments, {2: [{'state': 'success'}]}
+        )
+        self.use(commits, repository)
+
+        deploy, from_commit = deploys.get_last_deploy(1, hostname='erp01')
+
+        self.assertEqual(deploy['id'], 2)
+        self.assertEqual(from_commit, 'b')
+
+    def test_stops_one_page_after_the_cutoff(self):
+        commits = [make_commit('a', '2024-05-10T10:00:00Z')]
+        deployments = [
+            make_deployment(i, 'old', '2023-01-01T00:00:00Z')
+            for i in range(300)
+        ]
+        repository = FakeRepository(deployments, {})
+        self.use(commits, repository)
+
+        self.assertEqual(
+            deploys.get_last_deploy(1, hostname='erp01'), (None, None)
+        )
+        self.assertEqual(repository.listed, 101)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+import sys
+import threading
+import types
+import unittest
+
+import requests
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+from apply_pr.exceptions import GitHubError
+from apply_pr.github_api import DEPLOYMENTS_MEDIA_TYPE, GitHubRepository
+
+
+def make_response(status, data):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(data).encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+class FakeClient(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, cache=True):
+        with self.lock:
+            self.requests.append((url, headers))
+        return self.responses[url]
+
+
+class GitHubRepositoryTest(unittest.TestCase):
+    def make_repository(self, responses):
+        self.client = FakeClient(responses)
+        return GitHubRepository('gisce', 'erp', 'secret', client=self.client)
+
+    def test_builds_urls_with_sorted_parameters(self):
+        api = self.make_repository({})
+
+        self.assertEqual(
+            api.url('deployments', sha='abc', per_page=100),
+            'https://api.github.com/repos/gisce/erp/deployments'
+            '?per_page=100&sha=abc'
+        )
+        self.assertEqual(api.url(), 'https://api.github.com/repos/gisce/erp')
+
+    def test_gets_a_pull_with_the_token(self):
+        api = self.make_repository({
+            'https://api.github.com/repos/gisce/erp/pulls/5': make_response(
+                200, {'number': 5}
+            )
+        })
+
+        self.assertEqual(api.pull(5)['number'], 5)
+        self.assertEqual(
+            self.client.requests[0][1], {'Authorization': 'token secret'}
+        )
+
+    def test_missing_pull_raises(self):
+        api = self.make_repository({
+            'https://api.github.com/repos/gisce/erp/pulls/1': make_response(
+                404, {'message': 'Not Found'}
+            )
+        })
+
+        with self.assertRaises(GitHubError):
+            api.pull(1)
+
+    def test_latest_statuses_of_many_deployments(self):
+        deployments = [
+            {'statuses_url': 'https://api.github.com/d/{}/statuses'.format(i)}
+            for i in range(3)
+        ]
+        api = self.make_repository(dict(
+            ('{}?per_page=1'.format(d['statuses_url']),
+             make_response(200, [{'state': 'success', 'id': i}]))
+            for i, d in enumerate(deployments)
+        ))
+
+        statuses = list(api.statuses(deployments, latest=True))
+
+        self.assertEqual([s[0]['id'] for s in statuses], [0, 1, 2])
+        self.assertEqual(
+            self.client.requests[0][1]['Accept'], DEPLOYMENTS_MEDIA_TYPE
+        )
+
+
+    def test_failed_latest_status_raises(self):
+        deployment = {'statuses_url': 'https://api.github.com/d/1/statuses'}
+        api = self.make_repository({
+            'https://api.github.com/d/1/statuses?per_page=1': make_response(
+                403, {'message': 'API rate limit exceeded'}
+            )
+        })
+
+        with self.assertRaises(GitHubError):
+            api.deployment_statuses(deployment, latest=True)
+
+if __name__ == '__main__':
+    unittest.main()
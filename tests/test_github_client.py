@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+import requests
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+fake_importlib_metadata = types.ModuleType(str('importlib_metadata'))
+fake_importlib_metadata.version = lambda package: 'unknown'
+sys.modules.setdefault('importlib_metadata', fake_importlib_metadata)
+
+import apply_pr.github_client as github_client
+from apply_pr.cache import HTTPCache
+from apply_pr.scheduler import RetryBudget
+
+
+def make_response(status, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    response.encoding = 'utf-8'
+    return response
+
+
+class GitHubClientTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+
+    def tearDown(self):
+        github_client.reset_client()
+        if self.old_cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.old_cache_home
+        shutil.rmtree(self.tempdir)
+
+    def test_get_client_is_shared_by_the_process(self):
+        client = github_client.get_client()
+
+        self.assertIs(github_client.get_client(), client)
+
+        github_client.reset_client()
+        self.assertIsNot(github_client.get_client(), client)
+
+    def test_mounts_pooled_adapter(self):
+        client = github_client.GitHubClient(
+            pool_connections=3, pool_maxsize=7
+        )
+
+        adapter = client.session.get_adapter('https://api.github.com')
+        self.assertEqual(adapter._pool_connections, 3)
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertTrue(
+            client.session.headers['User-Agent'].startswith('apply_pr/')
+        )
+
+    def test_request_uses_default_timeout(self):
+        calls = []
+        client = github_client.GitHubClient(timeout=12)
+
+        def fake_request(method, url, **kwargs):
+            calls.append((method, url, kwargs))
+            return make_response(200)
+
+        client.session.request = fake_request
+
+        client.get('https://api.github.com/user', headers={'A': 'b'})
+        client.post('https://api.github.com/markdown', timeout=3)
+
+        self.assertEqual(calls[0][0], 'GET')
+        self.assertEqual(calls[0][2]['timeout'], 12)
+        self.assertEqual(calls[0][2]['headers'], {'A': 'b'})
+        self.assertEqual(calls[1][0], 'POST')
+        self.assertEqual(calls[1][2]['timeout'], 3)
+
+    def test_throttled_requests_are_retried(self):
+        responses = [
+            make_response(429, headers={'Retry-After': '0'}),
+            make_response(200, b'{}'),
+        ]
+        calls = []
+        client = github_client.GitHubClient()
+
+        def fake_request(method, url, **kwargs):
+            calls.append(url)
+            return responses.pop(0)
+
+        client.session.request = fake_request
+
+        response = client.post('https://throttled.example.net/markdown')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+
+class RetryTest(unittest.TestCase):
+    def make_client(self, outcomes, budget=None, **kwargs):
+        calls = []
+        client = github_client.GitHubClient(
+            retry_backoff=0, retry_budget=budget or RetryBudget(), **kwargs
+        )
+
+        def fake_request(method, url, **kwargs):
+            calls.append((method, url))
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        client.session.request = fake_request
+        return client, calls
+
+    def test_idempotent_requests_are_retried(self):
+        client, calls = self.make_client([
+            requests.exceptions.ConnectTimeout('connect'),
+            make_response(502),
+            make_response(200, b'{}'),
+        ])
+
+        response = client.get('https://retry.example.net/x', cache=False)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 3)
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        client, calls = self.make_client([
+            requests.exceptions.ReadTimeout('read'),
+        ])
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.post('https://retry.example.net/x')
+        self.assertEqual(len(calls), 1)
+
+        client, calls = self.make_client([make_response(503)])
+        self.assertEqual(
+            client.post('https://retry.example.net/x').status_code, 503
+        )
+
+    def test_posts_marked_idempotent_are_retried(self):
+        client, calls = self.make_client([
+            make_response(502), make_response(200, b'{}'),
+        ])
+
+        response = client.post(
+            'https://retry.example.net/graphql', idempotent=True
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+    def test_retries_stop_when_the_budget_is_spent(self):
+        client, calls = self.make_client(
+            [make_response(503), make_response(503), make_response(200)],
+            budget=RetryBudget(ratio=0, reserve=1), retries=5
+        )
+
+        response = client.get('https://retry.example.net/x', cache=False)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), 2)
+
+    def test_slow_get_is_hedged(self):
+        client = github_client.GitHubClient(
+            retry_budget=RetryBudget(), hedge=True
+        )
+        for _ in range(20):
+            client.latencies.record(0.01)
+        calls = []
+
+        def fake_request(method, url, **kwargs):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return make_response(200, b'"slow"')
+            return make_response(200, b'"fast"')
+
+        client.session.request = fake_request
+
+        response = client.get('https://hedge.example.net/x', cache=False)
+
+        self.assertEqual(response.json(), 'fast')
+        self.assertEqual(len(calls), 2)
+        client.close()
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def test_map_concurrently_keeps_the_order(self):
+        import threading
+        threads = set()
+
+        def work(item):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01 * (5 - item))
+            return item * 2
+
+        results = list(github_client.map_concurrently(work, range(5), 3))
+
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertGreater(len(threads), 1)
+
+    def test_single_worker_runs_in_calling_thread(self):
+        import threading
+        threads = set()
+
+        def work(item):
+            threads.add(threading.current_thread().name)
+            return item
+
+        self.assertEqual(
+            list(github_client.map_concurrently(work, [1, 2], 1)), [1, 2]
+        )
+        self.assertEqual(threads, {threading.current_thread().name})
+
+
+class PaginationTest(unittest.TestCase):
+    def test_parse_link_header(self):
+        links = github_client.parse_link_header(
+            '<https://api.github.com/x?page=2>; rel="next", '
+            '<https://api.github.com/x?page=12>; rel="last"'
+        )
+
+        self.assertEqual(links, {
+            'next': 'https://api.github.com/x?page=2',
+            'last': 'https://api.github.com/x?page=12',
+        })
+        self.assertEqual(github_client.parse_link_header(None), {})
+
+    def test_follows_next_links_lazily(self):
+        pages = {
+            'https://api.github.com/x': make_response(
+                200, b'[1, 2]',
+                {'Link': '<https://api.github.com/x?page=2>; rel="next"'}
+            ),
+            'https://api.github.com/x?page=2': make_response(
+                200, b'[3]',
+                {'Link': '<https://api.github.com/x?page=3>; rel="next"'}
+            ),
+            'https://api.github.com/x?page=3': make_response(200, b'[4]'),
+        }
+        requested = []
+
+        class FakeClient(object):
+            def get(self, url, headers=None):
+                requested.append(url)
+                return pages[url]
+
+        client = FakeClient()
+        self.assertEqual(
+            list(github_client.iter_paginated(
+                'https://api.github.com/x', client=client
+            )),
+            [1, 2, 3, 4]
+        )
+
+        del requested[:]
+        for item in github_client.iter_paginated(
+                'https://api.github.com/x', client=client):
+            if item == 2:
+                break
+        self.assertEqual(requested, ['https://api.github.com/x'])
+
+    def test_error_response_raises(self):
+        class FakeClient(object):
+            def get(self, url, headers=None):
+                return make_response(404, b'{"message": "Not Found"}')
+
+        with self.assertRaises(github_client.GitHubError):
+            list(github_client.iter_paginated(
+                'https://api.github.com/x', client=FakeClient()
+            ))
+
+
+class HTTPCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.cache = HTTPCache(self.tempdir)
+        self.client = github_client.GitHubClient(cache=self.cache)
+        self.calls = []
+        self.responses = []
+
+        def fake_request(method, url, **kwargs):
+            self.calls.append((method, url, kwargs))
+            return self.responses.pop(0)
+
+        self.client.session.request = fake_request
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_not_modified_is_served_from_cache(self):
+        url = 'https://api.github.com/repos/gisce/erp/pulls/1'
+        headers = {'Authorization': 'token secret'}
+        self.responses = [
+            make_response(200, b'{"number": 1}', {'ETag': '"abc"'}),
+            make_response(304, headers={'X-RateLimit-Remaining': '4999'}),
+        ]
+
+        first = self.client.get(url, headers=headers)
+        second = self.client.get(url, headers=headers)
+
+        self.assertEqual(first.json(), {'number': 1})
+        self.assertNotIn('If-None-Match', self.calls[0][2]['headers'])
+        self.assertEqual(self.calls[1][2]['headers']['If-None-Match'], '"abc"')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), {'number': 1})
+        self.assertEqual(second.headers['X-RateLimit-Remaining'], '4999')
+        self.assertTrue(second.from_cache)
+        self.assertEqual(headers, {'Authorization': 'token secret'})
+
+    def test_cache_is_keyed_by_token_and_media_type(self):
+        url = 'https://api.github.com/repos/gisce/erp/pulls/1'
+        self.responses = [
+            make_response(200, b'{}', {'ETag': '"a"'}),
+            make_response(200, b'{}', {'ETag': '"b"'}),
+            make_response(200, b'diff', {'ETag': '"c"'}),
+        ]
+
+        self.client.get(url, headers={'Authorization': 'token one'})
+        self.client.get(url, headers={'Authorization': 'token two'})
+        self.client.get(url, headers={
+            'Authorization': 'token one',
+            'Accept': 'application/vnd.github.v3.diff',
+        })
+
+        for call in self.calls:
+            self.assertNotIn('If-None-Match', call[2]['headers'])
+        self.assertEqual(self.cache.stats()['entries'], 3)
+
+    def test_responses_without_validators_are_not_stored(self):
+        self.responses = [make_response(200, b'{}')]
+
+        self.client.get('https://api.github.com/user', headers={})
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_evicts_expired_and_least_recently_used_entries(self):
+        for index in range(3):
+            self.cache.store(
+                'key{}'.format(index), 'url', 200, {}, b'x' * 100
+            )
+            meta_path = os.path.join(self.tempdir, 'key{}.json'.format(index))
+            os.utime(meta_path, (index, index))
+        size = self.cache.stats()['size']
+
+        self.cache.max_size = size - 1
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNone(self.cache.get('key0'))
+        self.assertIsNotNone(self.cache.get('key1'))
+
+        self.cache.max_age = 0
+        time.sleep(0.01)
+        self.assertEqual(self.cache.evict(), 2)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_clear_removes_everything(self):
+        self.cache.store('key', 'url', 200, {}, b'body')
+
+        self.assertEqual(self.cache.clear(), 1)
+        self.assertIsNone(self.cache.get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,10 @@
 from __future__ import absolute_import, unicode_literals
 
 import io
+import os
+import shutil
 import sys
+import tempfile
 import types
 import unittest
 
@@ -59,23 +62,24 @@ class OAuthLoginEncodingTest(unittest.TestCase):
         def fake_get(url, headers=None):
             return DummyResponse({'login': 'ecarreras'})
 
-        old_post = github_utils.requests.post
-        old_get = github_utils.requests.get
+        class FakeClient(object):
+            post = staticmethod(fake_post)
+            get = staticmethod(fake_get)
+
+        old_get_client = github_utils.get_client
         old_qrcode = github_utils.qrcode.QRCode
         old_sleep = github_utils.time.sleep
         old_stdout = sys.stdout
         output = io.StringIO()
         try:
-            github_utils.requests.post = fake_post
-            github_utils.requests.get = fake_get
+            github_utils.get_client = lambda: FakeClient
             github_utils.qrcode.QRCode = DummyQRCode
             github_utils.time.sleep = lambda interval: None
             sys.stdout = output
 
             token = github_utils.oauth_login()
         finally:
-            github_utils.requests.post = old_post
-            github_utils.requests.get = old_get
+            github_utils.get_client = old_get_client
             github_utils.qrcode.QRCode = old_qrcode
             github_utils.time.sleep = old_sleep
             sys.stdout = old_stdout
@@ -88,5 +92,111 @@ class OAuthLoginEncodingTest(unittest.TestCase):
         self.assertNotIn('\udc4b', text)
 
 
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.old_environ = dict(os.environ)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tempdir, 'cache')
+        os.environ['XDG_CONFIG_HOME'] = os.path.join(self.tempdir, 'config')
+        os.environ.pop('APPLY_PR_CACHE_DIR', None)
+        os.environ.pop('GITHUB_TOKEN', None)
+        self.validations = []
+        self.old_request = github_utils._request_token_validation
+        self.old_oauth_login = github_utils.oauth_login
+        github_utils._valid_tokens.clear()
+
+        def fake_request(token):
+            self.validations.append(token)
+            return self.statuses.get(token, 200)
+
+        self.statuses = {'expired': 401}
+
+        github_utils._request_token_validation = fake_request
+
+    def tearDown(self):
+        github_utils._request_token_validation = self.old_request
+        github_utils.oauth_login = self.old_oauth_login
+        github_utils._valid_tokens.clear()
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.tempdir)
+
+    def test_validation_is_memoized_and_cached_on_disk(self):
+        self.assertTrue(github_utils.is_github_token_valid('secret'))
+        self.assertTrue(github_utils.is_github_token_valid('secret'))
+        self.assertEqual(self.validations, ['secret'])
+
+        # A new process only has the disk cache
+        github_utils._valid_tokens.clear()
+        self.assertTrue(github_utils.is_github_token_valid('secret'))
+        self.assertEqual(self.validations, ['secret'])
+
+        with open(github_utils._validations_path()) as stream:
+            self.assertNotIn('secret', stream.read())
+
+    def test_expired_validation_is_checked_again(self):
+        github_utils.is_github_token_valid('secret')
+        github_utils._valid_tokens.clear()
+        fingerprint = github_utils.token_fingerprint('secret')
+        github_utils.write_json(
+            github_utils._validations_path(), {fingerprint: 1}
+        )
+
+        self.assertTrue(github_utils.is_github_token_valid('secret'))
+        self.assertEqual(self.validations, ['secret', 'secret'])
+
+    def test_invalid_token_is_not_cached(self):
+        self.assertFalse(github_utils.is_github_token_valid('expired'))
+        self.assertFalse(github_utils.is_github_token_valid('expired'))
+        self.assertEqual(self.validations, ['expired', 'expired'])
+
+    def test_transient_failure_is_not_cached(self):
+        self.statuses['secret'] = 502
+
+        self.assertEqual(github_utils.token_status('secret'), 502)
+        self.assertFalse(os.path.exists(github_utils._validations_path()))
+
+        del self.statuses['secret']
+        self.assertEqual(github_utils.token_status('secret'), 200)
+        self.assertEqual(self.validations, ['secret', 'secret'])
+
+    def test_device_flow_token_is_persisted(self):
+        logins = []
+
+        def fake_oauth_login():
+            logins.append(True)
+            return 'device-token'
+
+        github_utils.oauth_login = fake_oauth_login
+
+        self.assertEqual(github_utils.github_config()['token'], 'device-token')
+        self.assertEqual(github_utils.load_token(), 'device-token')
+        mode = os.stat(github_utils._token_path()).st_mode & 0o777
+        self.assertEqual(mode, 0o600)
+
+        os.environ.pop('GITHUB_TOKEN', None)
+        self.assertEqual(github_utils.github_config()['token'], 'device-token')
+        self.assertEqual(logins, [True])
+
+    def test_expired_stored_token_triggers_login(self):
+        github_utils.save_token('expired')
+        github_utils.oauth_login = lambda: 'device-token'
+
+        self.assertEqual(github_utils.github_config()['token'], 'device-token')
+        self.assertEqual(github_utils.load_token(), 'device-token')
+
+    def test_stored_token_is_kept_when_github_is_unreachable(self):
+        github_utils.save_token('saved')
+        self.statuses['saved'] = None
+
+        def forbidden():
+            raise AssertionError('The device login was started')
+
+        github_utils.oauth_login = forbidden
+
+        self.assertEqual(github_utils.github_config()['token'], 'saved')
+        self.assertEqual(github_utils.load_token(), 'saved')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+import re
+import sys
+import threading
+import types
+import unittest
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+from apply_pr import graphql
+
+
+class DummyResponse(object):
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        if isinstance(self._data, Exception):
+            raise self._data
+        return self._data
+
+
+class FakeGraphQLClient(object):
+    def __init__(self, missing=(), max_batch=None):
+        self.queries = []
+        self.missing = missing
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, idempotent=False):
+        query = json.loads(data)['query']
+        with self.lock:
+            self.queries.append(query)
+        numbers = [int(n) for n in re.findall(r'pr(\d+): pullRequest', query)]
+        if self.max_batch and len(numbers) > self.max_batch:
+            # Bad gateway page
+            return DummyResponse(ValueError('No JSON object'))
+        repository = dict(
+            ('pr{}'.format(number), None if number in self.missing else {
+                'number': number, 'state': 'MERGED'
+            }) for number in numbers
+        )
+        return DummyResponse({'data': {'repository': repository}})
+
+
+class PullRequestsQueryTest(unittest.TestCase):
+    def test_query_uses_one_alias_per_pull_request(self):
+        query = graphql.pull_requests_query('gisce', 'erp', [12, '34'])
+
+        self.assertIn('repository(owner: "gisce", name: "erp")', query)
+        self.assertIn(
+            'pr12: pullRequest(number: 12) { ...PullRequestFields }', query
+        )
+        self.assertIn(
+            'pr34: pullRequest(number: 34) { ...PullRequestFields }', query
+        )
+        self.assertIn('fragment PullRequestFields on PullRequest', query)
+
+    def test_rejects_non_numeric_pull_requests(self):
+        with self.assertRaises(ValueError):
+            graphql.pull_requests_query('gisce', 'erp', ['1) { id } x: pr('])
+
+    def test_requests_pull_requests_in_batches(self):
+        client = FakeGraphQLClient(missing=(3,))
+
+        pulls = graphql.get_pull_requests(
+            'gisce', 'erp', ['1', '2', '3', '4', '5', '5'], 'token',
+            batch_size=2, client=client
+        )
+
+        self.assertEqual(len(client.queries), 3)
+        self.assertEqual(sorted(pulls), [1, 2, 3, 4, 5])
+        self.assertIsNone(pulls[3])
+        self.assertEqual(pulls[5], {'number': 5, 'state': 'MERGED'})
+
+    def test_failed_batch_returns_no_pull_requests(self):
+        class FailingClient(object):
+            calls = 0
+
+            def post(self, url, data=None, headers=None, idempotent=False):
+                self.calls += 1
+                return DummyResponse({'errors': [{'message': 'Bad'}]})
+
+        client = FailingClient()
+        pulls = graphql.get_pull_requests(
+            'gisce', 'erp', [1, 2], 'token', client=client
+        )
+
+        self.assertEqual(pulls, {1: None, 2: None})
+        # The batch and each of its halves
+        self.assertEqual(client.calls, 3)
+
+    def test_failed_batch_is_split(self):
+        client = FakeGraphQLClient(max_batch=2)
+
+        pulls = graphql.get_pull_requests(
+            'gisce', 'erp', [1, 2, 3, 4, 5], 'token', client=client
+        )
+
+        self.assertEqual(sorted(pulls), [1, 2, 3, 4, 5])
+        self.assertTrue(all(pulls.values()))
+
+    def test_queries_are_retried_as_idempotent(self):
+        client = FakeGraphQLClient()
+        sent = []
+        post = client.post
+
+        def spy(url, **kwargs):
+            sent.append(kwargs['idempotent'])
+            return post(url, **kwargs)
+
+        client.post = spy
+        graphql.get_pull_requests('gisce', 'erp', [1], 'token', client=client)
+
+        self.assertEqual(sent, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from apply_pr.mirror import GitMirror, _git_environment
+
+
+class GitMirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.origin = os.path.join(self.tempdir, 'origin')
+        os.makedirs(self.origin)
+        self._git('init', '-q')
+        self._git('config', 'user.name', 'Sastre Test')
+        self._git('config', 'user.email', 'sastre@example.net')
+        self._git('checkout', '-q', '-b', 'developer')
+        self.base = self._commit('message.txt', 'before\n', 'Initial commit')
+        self._git('checkout', '-q', '-b', 'feature')
+        self.first = self._commit('message.txt', 'after\n', 'Change greeting')
+        self.second = self._commit('other.txt', 'other\n', 'Add other file')
+        self.destination = os.path.join(self.tempdir, 'patches')
+        os.makedirs(self.destination)
+        self.mirror = GitMirror(
+            'file://{}'.format(self.origin),
+            os.path.join(self.tempdir, 'mirrors', 'erp.git'),
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _git(self, *arguments):
+        output = subprocess.check_output(
+            ['git'] + list(arguments), cwd=self.origin
+        )
+        return output.decode('utf-8').strip()
+
+    def _commit(self, path, value, message):
+        with open(os.path.join(self.origin, path), 'w') as stream:
+            stream.write(value)
+        self._git('add', path)
+        self._git('commit', '-q', '-m', message)
+        return self._git('rev-parse', 'HEAD')
+
+    def _first_line_sha(self, patch):
+        with io.open(patch, 'r', encoding='utf-8') as stream:
+            return stream.readline().split(' ')[1]
+
+    def test_generates_numbered_patches_between_base_and_head(self):
+        self.mirror.update()
+
+        patches = self.mirror.format_patch(
+            self.base, self.second, self.destination
+        )
+
+        self.assertEqual(
+            [os.path.basename(p)[:5] for p in patches], ['0001-', '0002-']
+        )
+        self.assertEqual(
+            [self._first_line_sha(p) for p in patches],
+            [self.first, self.second]
+        )
+
+    def test_skips_patches_before_from_commit_keeping_numbers(self):
+        self.mirror.update()
+
+        patches = self.mirror.format_patch(
+            self.base, self.second, self.destination,
+            from_commit=self.second
+        )
+
+        self.assertEqual(len(patches), 1)
+        self.assertTrue(os.path.basename(patches[0]).startswith('0002-'))
+        self.assertEqual(os.listdir(self.destination), [
+            os.path.basename(patches[0])
+        ])
+
+    def test_fetches_new_commits_incrementally(self):
+        self.mirror.update()
+        third = self._commit('third.txt', 'third\n', 'Add third file')
+        self.assertFalse(self.mirror.has_commit(third))
+
+        self.mirror.update()
+
+        self.assertTrue(self.mirror.has_commit(third))
+        patches = self.mirror.format_patch(
+            self.base, third, self.destination
+        )
+        self.assertEqual(len(patches), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class GitEnvironmentTest(unittest.TestCase):
+    def test_token_is_passed_in_the_environment(self):
+        mirror = GitMirror(
+            'https://github.com/gisce/erp.git', '/tmp/erp.git', token='secret'
+        )
+
+        env = _git_environment(mirror._config)
+
+        self.assertEqual(env['GIT_CONFIG_KEY_0'],
+                         'http.https://github.com/.extraheader')
+        self.assertTrue(env['GIT_CONFIG_VALUE_0'].startswith(
+            'AUTHORIZATION: basic '
+        ))
+        self.assertEqual(env['GIT_CONFIG_COUNT'], '1')
+
+    def test_keeps_the_configuration_of_the_environment(self):
+        os.environ['GIT_CONFIG_COUNT'] = '1'
+        self.addCleanup(os.environ.pop, 'GIT_CONFIG_COUNT')
+
+        env = _git_environment({'core.pager': 'cat'})
+
+        self.assertEqual(env['GIT_CONFIG_KEY_1'], 'core.pager')
+        self.assertEqual(env['GIT_CONFIG_COUNT'], '2')
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import requests
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+from apply_pr.outbox import Outbox, _file_lock
+
+
+def make_response(status, body=b'{}'):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    return response
+
+
+class FakeClient(object):
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = []
+
+    def post(self, url, data=None, headers=None):
+        self.posts.append((url, json.loads(data), headers))
+        outcome = self.outcomes.pop(0) if self.outcomes else 201
+        if isinstance(outcome, Exception):
+            raise outcome
+        return make_response(outcome)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_outbox(self, client):
+        return Outbox(self.tempdir, token='secret', client=client)
+
+    def test_updates_are_journaled_until_delivered(self):
+        client = FakeClient()
+        outbox = self.make_outbox(client)
+        outbox._append({'id': 'a', 'url': 'https://x/1', 'payload': {},
+                        'description': 'first'})
+        outbox._append({'id': 'b', 'url': 'https://x/2', 'payload': {},
+                        'description': 'second'})
+
+        self.assertEqual([e['id'] for e in outbox.pending()], ['a', 'b'])
+        self.assertEqual(outbox.flush(), (2, 0))
+        self.assertEqual(outbox.pending(), [])
+        self.assertEqual([p[0] for p in client.posts], [
+            'https://x/1', 'https://x/2'
+        ])
+        self.assertEqual(client.posts[0][2]['Authorization'], 'token secret')
+
+    def test_failure_keeps_the_order_for_the_next_flush(self):
+        client = FakeClient(requests.exceptions.ConnectionError('down'))
+        outbox = self.make_outbox(client)
+        for key in ('a', 'b'):
+            outbox._append({'id': key, 'url': 'https://x/' + key,
+                            'payload': {'state': key}, 'description': key})
+
+        self.assertEqual(outbox.flush(), (0, 2))
+        self.assertEqual(len(client.posts), 1)
+
+        client.outcomes = [502]
+        self.assertEqual(outbox.flush(), (0, 2))
+
+        self.assertEqual(outbox.flush(), (2, 0))
+        self.assertEqual(
+            [p[1]['state'] for p in client.posts[-2:]], ['a', 'b']
+        )
+
+    def test_rejected_updates_are_dropped(self):
+        client = FakeClient(422)
+        outbox = self.make_outbox(client)
+        outbox._append({'id': 'a', 'url': 'https://x', 'payload': {},
+                        'description': 'invalid'})
+
+        self.assertEqual(outbox.flush(), (1, 0))
+
+    def test_token_errors_are_kept_for_the_next_flush(self):
+        for status in (401, 403):
+            client = FakeClient(status)
+            outbox = self.make_outbox(client)
+            outbox._append({'id': 'a', 'url': 'https://x', 'payload': {},
+                            'description': 'status'})
+
+            self.assertEqual(outbox.flush(), (0, 1))
+            self.assertEqual(outbox.flush(), (1, 0))
+
+    def test_flush_waits_for_another_process_lock(self):
+        outbox = self.make_outbox(FakeClient())
+        outbox._append({'id': 'a', 'url': 'https://x', 'payload': {},
+                        'description': 'status'})
+
+        with _file_lock(outbox.journal + '.flush'):
+            self.assertEqual(outbox.flush(), (None, None))
+            self.assertEqual(outbox.flush(lock_timeout=0.2), (None, None))
+        self.assertEqual(outbox.flush(lock_timeout=0.2), (1, 0))
+
+    def test_skips_partial_lines(self):
+        outbox = self.make_outbox(FakeClient())
+        outbox._append({'id': 'a', 'url': 'https://x', 'payload': {}})
+        with io.open(outbox.journal, 'ab') as stream:
+            stream.write(b'{"id": "b", "url"')
+
+        self.assertEqual([e['id'] for e in outbox.pending()], ['a'])
+
+    def test_worker_delivers_queued_updates(self):
+        client = FakeClient()
+        outbox = self.make_outbox(client)
+
+        outbox.enqueue('https://x/statuses', {'state': 'success'},
+                       accept='application/json')
+
+        self.assertEqual(outbox.drain(5), 0)
+        self.assertEqual(client.posts[0][1], {'state': 'success'})
+        self.assertEqual(client.posts[0][2]['Accept'], 'application/json')
+
+
+if __name__ == '__main__':
+    unittest.main()
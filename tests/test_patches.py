@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from apply_pr.patches import (
+    MANIFEST_NAME, pack_patches, read_manifest, select_patches, split_mbox,
+    write_manifest
+)
+
+
+class SplitMboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self._git('init', '-q')
+        self._git('config', 'user.name', 'Sastre Test')
+        self._git('config', 'user.email', 'sastre@example.net')
+        self._commit('message.txt', 'before\n', 'Initial commit')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _git(self, *arguments):
+        return subprocess.check_output(
+            ['git'] + list(arguments), cwd=self.tempdir
+        )
+
+    def _commit(self, path, value, message):
+        with open(os.path.join(self.tempdir, path), 'w') as stream:
+            stream.write(value)
+        self._git('add', path)
+        self._git('commit', '-q', '-m', message)
+        return self._git('rev-parse', 'HEAD').decode('ascii').strip()
+
+    def test_splits_series_by_commit(self):
+        first = self._commit(
+            'message.txt', 'after\n',
+            'Change greeting\n\nFrom now on the greeting is different'
+        )
+        second = self._commit('other.txt', 'other\n', 'Add other file')
+        mbox = self._git('format-patch', '--stdout', 'HEAD~2..HEAD')
+
+        patches = split_mbox(mbox)
+
+        self.assertEqual([sha for sha, _ in patches], [first, second])
+        self.assertTrue(patches[0][1].startswith(
+            'From {} '.format(first).encode('ascii')
+        ))
+        self.assertIn(b'From now on the greeting', patches[0][1])
+        self.assertNotIn(b'other.txt', patches[0][1])
+        self.assertIn(b'+other', patches[1][1])
+
+    def test_split_patches_apply_with_git_am(self):
+        self._commit('message.txt', 'after\n', 'Change greeting')
+        self._commit('other.txt', 'other\n', 'Add other file')
+        mbox = self._git('format-patch', '--stdout', 'HEAD~2..HEAD')
+        self._git('reset', '-q', '--hard', 'HEAD~2')
+
+        for sha, patch in split_mbox(mbox):
+            path = os.path.join(self.tempdir, '{}.patch'.format(sha))
+            with open(path, 'wb') as stream:
+                stream.write(patch)
+            self._git('am', '-q', path)
+            os.remove(path)
+
+        log = self._git('log', '--format=%s').decode('utf-8')
+        self.assertEqual(
+            log.split('\n')[:2], ['Add other file', 'Change greeting']
+        )
+
+    def test_empty_or_invalid_mbox(self):
+        self.assertEqual(split_mbox(b''), [])
+        self.assertEqual(split_mbox(b'{"message": "Not Found"}'), [])
+
+
+class PatchManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.checkout = os.path.join(self.tempdir, 'erp')
+        self.patches = os.path.join(self.tempdir, 'patches')
+        os.mkdir(self.checkout)
+        self._git('init', '-q')
+        self._git('config', 'user.name', 'Sastre Test')
+        self._git('config', 'user.email', 'sastre@example.net')
+        self._commit('message.txt', 'before\n', 'Initial commit')
+        self.commits = [
+            self._commit('message.txt', 'after\n', 'Change greeting'),
+            self._commit('other.txt', 'other\n', 'Afegeix un altre fitxer amb pedaç'),
+            self._commit('message.txt', 'last\n', 'Change greeting again'),
+        ]
+        self._git('format-patch', '-q', '-o', self.patches, 'HEAD~3..HEAD')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _git(self, *arguments):
+        return subprocess.check_output(
+            ['git'] + list(arguments), cwd=self.checkout
+        )
+
+    def _commit(self, path, value, message):
+        with open(os.path.join(self.checkout, path), 'w') as stream:
+            stream.write(value)
+        self._git('add', path)
+        self._git('commit', '-q', '-m', message)
+        return self._git('rev-parse', 'HEAD').decode('ascii').strip()
+
+    def test_describes_every_patch(self):
+        manifest = write_manifest(self.patches)
+
+        self.assertEqual(read_manifest(self.patches), manifest)
+        self.assertEqual([p['number'] for p in manifest], [1, 2, 3])
+        self.assertEqual([p['sha'] for p in manifest], self.commits)
+        self.assertEqual(manifest[1]['subject'], 'Afegeix un altre fitxer amb pedaç')
+        self.assertEqual(manifest[1]['files'], ['other.txt'])
+        self.assertEqual(
+            manifest[0]['size'],
+            os.path.getsize(os.path.join(self.patches, manifest[0]['name']))
+        )
+        self.assertEqual(len(manifest[0]['patch_id']), 40)
+
+    def test_patch_id_matches_git(self):
+        manifest = write_manifest(self.patches)
+        diff = self._git('show', self.commits[2])
+
+        output = subprocess.Popen(
+            ['git', 'patch-id', '--stable'], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, cwd=self.checkout
+        ).communicate(diff)[0]
+
+        self.assertEqual(
+            manifest[2]['patch_id'], output.split()[0].decode('ascii')
+        )
+
+    def test_selects_patches(self):
+        manifest = write_manifest(self.patches)
+        names = [p['name'] for p in manifest]
+
+        self.assertEqual(select_patches(manifest), manifest)
+        self.assertEqual(
+            select_patches(manifest, from_commit=self.commits[1]),
+            manifest[1:]
+        )
+        self.assertEqual(select_patches(manifest, from_commit='f' * 40), [])
+        self.assertEqual(
+            [p['name'] for p in select_patches(manifest, from_number=3)],
+            names[2:]
+        )
+
+    def test_packs_patches_with_their_manifest(self):
+        archive = os.path.join(self.tempdir, 'patches.tar.gz')
+        patches = select_patches(
+            write_manifest(self.patches), from_commit=self.commits[1]
+        )
+        names = [p['name'] for p in patches]
+
+        pack_patches(self.patches, names, archive, manifest=patches)
+
+        with tarfile.open(archive, 'r:gz') as tar:
+            self.assertEqual(tar.getnames(), names + [MANIFEST_NAME])
+            content = tar.extractfile(names[0]).read()
+            manifest = json.loads(
+                tar.extractfile(MANIFEST_NAME).read().decode('utf-8')
+            )
+        self.assertTrue(content.startswith(
+            'From {}'.format(self.commits[1]).encode('ascii')
+        ))
+        self.assertEqual(manifest, patches)
+
+if __name__ == '__main__':
+    unittest.main()
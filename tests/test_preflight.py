@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from apply_pr.preflight import (
+    parse_preflight, preflight_command, problem_message, repository_problems
+)
+
+
+class PreflightTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.checkout = os.path.join(self.tempdir, 'erp')
+        os.mkdir(self.checkout)
+        self._git('init', '-q')
+        self._git('config', 'user.name', 'Sastre Test')
+        self._git('config', 'user.email', 'sastre@example.net')
+        self._git('checkout', '-q', '-b', 'rolling')
+        with open(os.path.join(self.checkout, 'message.txt'), 'w') as stream:
+            stream.write('before\n')
+        self._git('add', 'message.txt')
+        self._git('commit', '-q', '-m', 'Initial commit')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _git(self, *arguments):
+        return subprocess.check_output(
+            ['git'] + list(arguments), cwd=self.checkout
+        )
+
+    def preflight(self, checkout=None):
+        output = subprocess.check_output(
+            preflight_command(checkout or self.checkout), shell=True
+        )
+        return parse_preflight(output.decode('utf-8'))
+
+    def test_clean_rolling_checkout(self):
+        state = self.preflight()
+
+        self.assertTrue(state['exists'])
+        self.assertTrue(state['git_version'])
+        self.assertEqual(state['branch'], 'rolling')
+        self.assertEqual(state['changes'], 0)
+        self.assertEqual(
+            state['checkout'], os.path.realpath(self.checkout)
+        )
+        self.assertEqual(repository_problems(state), [])
+
+    def test_missing_checkout(self):
+        state = self.preflight(os.path.join(self.tempdir, 'missing'))
+
+        self.assertEqual(repository_problems(state), ['missing'])
+
+    def test_subdirectory_is_not_the_repository_root(self):
+        subdirectory = os.path.join(self.checkout, 'addons')
+        os.mkdir(subdirectory)
+
+        state = self.preflight(subdirectory)
+
+        self.assertEqual(repository_problems(state), ['not_root'])
+
+    def test_reports_every_problem_of_the_checkout(self):
+        self._git('checkout', '-q', '-b', 'feature')
+        os.mkdir(os.path.join(self.checkout, '.git', 'rebase-apply'))
+        with open(os.path.join(self.checkout, 'message.txt'), 'w') as stream:
+            stream.write('dirty\n')
+
+        state = self.preflight()
+
+        self.assertEqual(
+            repository_problems(state),
+            ['am_session', 'not_rolling', 'dirty']
+        )
+        self.assertEqual(
+            repository_problems(state, skip_rolling_check=True),
+            ['am_session', 'dirty']
+        )
+
+    def test_ignores_unrelated_output(self):
+        state = parse_preflight('Welcome!\nexists=1\nbranch=rolling\n')
+
+        self.assertTrue(state['exists'])
+        self.assertEqual(state['branch'], 'rolling')
+
+    def test_messages_name_the_location(self):
+        self.assertEqual(
+            problem_message('missing', 'remote', '/home/erp/src/erp'),
+            'The remote repository does not exist: /home/erp/src/erp'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+import unittest
+
+import requests
+
+from apply_pr.scheduler import (
+    LatencyTracker, RequestScheduler, RetryBudget, get_scheduler,
+    rate_limit_resource
+)
+
+
+def make_response(status, headers=None, body=b''):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    return response
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def test_token_bucket_limits_the_rate(self):
+        scheduler = RequestScheduler(rate=50, burst=1)
+        start = time.time()
+
+        for _ in range(4):
+            scheduler.acquire()
+            scheduler.release(make_response(200))
+
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_limits_requests_in_flight(self):
+        scheduler = RequestScheduler(rate=1000, burst=100, max_concurrency=2)
+        scheduler.acquire()
+        scheduler.acquire()
+        acquired = []
+
+        thread = threading.Thread(
+            target=lambda: acquired.append(scheduler.acquire())
+        )
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(acquired, [])
+
+        scheduler.release(make_response(200))
+        thread.join(1)
+        self.assertEqual(len(acquired), 1)
+
+    def test_secondary_rate_limit_pauses_and_halves_concurrency(self):
+        scheduler = RequestScheduler(max_concurrency=8)
+        scheduler.acquire()
+
+        delay = scheduler.release(make_response(
+            403, {'Retry-After': '30'},
+            b'{"message": "You have exceeded a secondary rate limit"}'
+        ))
+
+        self.assertEqual(delay, 30)
+        self.assertEqual(scheduler.concurrency, 4)
+        self.assertGreater(scheduler.paused_until, time.time() + 29)
+
+    def test_concurrency_grows_back_after_successes(self):
+        scheduler = RequestScheduler(rate=1000, burst=100, max_concurrency=4)
+        scheduler.acquire()
+        scheduler.release(make_response(429))
+        scheduler.paused_until = 0
+        self.assertEqual(scheduler.concurrency, 2)
+
+        for _ in range(2):
+            scheduler.acquire()
+            self.assertIsNone(scheduler.release(make_response(200)))
+
+        self.assertEqual(scheduler.concurrency, 3)
+
+    def test_backoff_is_jittered_and_bounded(self):
+        scheduler = RequestScheduler(backoff=1, max_backoff=10)
+        response = make_response(403, body=b'secondary rate limit')
+
+        delays = [scheduler._delay(response, 2, time.time())
+                  for _ in range(20)]
+
+        self.assertTrue(all(2 <= delay <= 6 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+        self.assertLessEqual(scheduler._delay(response, 10, time.time()), 15)
+
+    def test_spreads_the_remaining_requests_until_reset(self):
+        scheduler = RequestScheduler(rate=10, reserve=50)
+        scheduler.acquire()
+        now = time.time()
+        scheduler.release(make_response(200, {
+            'X-RateLimit-Remaining': '10',
+            'X-RateLimit-Reset': str(now + 100),
+        }))
+
+        self.assertAlmostEqual(scheduler.current_rate(now), 0.1, places=2)
+
+    def test_exhausted_rate_limit_waits_for_reset(self):
+        scheduler = RequestScheduler()
+        scheduler.acquire()
+        reset = time.time() + 60
+        scheduler.release(make_response(200, {
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(reset),
+        }))
+
+        self.assertGreaterEqual(
+            scheduler.resource_wait('core', time.time()), 59
+        )
+
+    def test_search_rate_limit_does_not_slow_down_core_requests(self):
+        scheduler = RequestScheduler(rate=10, reserve=50)
+        scheduler.acquire('search')
+        now = time.time()
+        scheduler.release(make_response(200, {
+            'X-RateLimit-Resource': 'search',
+            'X-RateLimit-Remaining': '29',
+            'X-RateLimit-Reset': str(now + 60),
+        }), resource='search')
+
+        self.assertEqual(scheduler.current_rate(now, 'core'), 10)
+        self.assertAlmostEqual(
+            scheduler.current_rate(now, 'search'), 29 / 60.0, places=2
+        )
+
+        scheduler.acquire('search')
+        scheduler.release(make_response(200, {
+            'X-RateLimit-Resource': 'search',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(now + 60),
+        }), resource='search')
+
+        self.assertGreater(scheduler.resource_wait('search', time.time()), 58)
+        self.assertEqual(scheduler.resource_wait('core', time.time()), 0)
+        start = time.time()
+        scheduler.acquire('core')
+        self.assertLess(time.time() - start, 1)
+
+    def test_exhausted_primary_rate_limit_only_pauses_its_resource(self):
+        scheduler = RequestScheduler(max_concurrency=8)
+        scheduler.acquire('search')
+        reset = time.time() + 30
+
+        delay = scheduler.release(make_response(403, {
+            'X-RateLimit-Resource': 'search',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(reset),
+        }), resource='search')
+
+        self.assertGreater(delay, 29)
+        self.assertEqual(scheduler.paused_until, 0)
+        self.assertEqual(scheduler.concurrency, 8)
+        self.assertGreater(scheduler.resource_wait('search', time.time()), 29)
+
+    def test_shared_by_host_and_token(self):
+        first = get_scheduler(
+            'https://api.github.com/a', {'Authorization': 'token one'}
+        )
+
+        self.assertIs(first, get_scheduler(
+            'https://api.github.com/b', {'Authorization': 'token one'}
+        ))
+        self.assertIsNot(first, get_scheduler(
+            'https://api.github.com/a', {'Authorization': 'token two'}
+        ))
+        self.assertIsNot(first, get_scheduler(
+            'https://github.com/a', {'Authorization': 'token one'}
+        ))
+        self.assertIs(first, get_scheduler(
+            'https://api.github.com/graphql', {'Authorization': 'bearer one'}
+        ))
+
+    def test_rate_limit_resource_of_the_url(self):
+        self.assertEqual(rate_limit_resource(
+            'https://api.github.com/search/issues?q=is:pr'
+        ), 'search')
+        self.assertEqual(
+            rate_limit_resource('https://api.github.com/graphql'), 'graphql'
+        )
+        self.assertEqual(rate_limit_resource(
+            'https://api.github.com/repos/gisce/erp/pulls/1'
+        ), 'core')
+
+
+class RetryBudgetTest(unittest.TestCase):
+    def test_retries_are_a_fraction_of_the_requests(self):
+        budget = RetryBudget(ratio=0.5, reserve=1)
+
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class LatencyTrackerTest(unittest.TestCase):
+    def test_percentile_needs_enough_samples(self):
+        tracker = LatencyTracker(size=100, min_samples=10)
+        for value in range(1, 10):
+            tracker.record(value)
+        self.assertIsNone(tracker.percentile(95))
+
+        for value in range(10, 101):
+            tracker.record(value)
+        self.assertEqual(tracker.percentile(95), 95)
+        self.assertEqual(tracker.percentile(50), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
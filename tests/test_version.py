@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+fake_osconf = types.ModuleType(str('osconf'))
+fake_osconf.config_from_environment = lambda prefix, **config: config
+sys.modules.setdefault('osconf', fake_osconf)
+
+import requests
+
+import apply_pr
+from apply_pr import version
+from apply_pr.cache import write_json
+
+
+class VersionCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='apply-pr-test-')
+        self.old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+        self.old_latest_version = version.latest_version
+        self.old_version = apply_pr.__version__
+        self.requests = []
+        self.fetched = threading.Event()
+
+        def fake_latest_version(timeout=None):
+            self.requests.append(timeout)
+            self.fetched.set()
+            if self.latest is None:
+                raise requests.exceptions.ConnectionError('offline')
+            return self.latest
+
+        version.latest_version = fake_latest_version
+        apply_pr.__version__ = '3.6.0'
+        self.latest = '3.6.0'
+
+    def tearDown(self):
+        version.latest_version = self.old_latest_version
+        apply_pr.__version__ = self.old_version
+        if self.old_cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME', None)
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.old_cache_home
+        shutil.rmtree(self.tempdir)
+
+    def test_first_check_is_cached(self):
+        version.check_version()
+        version.check_version()
+
+        self.assertEqual(self.requests, [3])
+
+    def test_outdated_version_exits(self):
+        self.latest = '3.10.0'
+
+        with self.assertRaises(SystemExit):
+            version.check_version()
+
+    def test_offline_check_does_not_fail(self):
+        self.latest = None
+
+        version.check_version()
+
+    def test_stale_cache_is_refreshed_in_background(self):
+        write_json(version._cache_path(), {
+            'version': '3.5.0', 'time': time.time() - 2 * 24 * 3600
+        })
+        self.latest = '3.7.0'
+
+        # The cached version is used while refreshing
+        version.check_version()
+
+        self.assertTrue(self.fetched.wait(5))
+        for _ in range(50):
+            if version.cached_latest_version() == '3.7.0':
+                break
+            time.sleep(0.01)
+        with self.assertRaises(SystemExit):
+            version.check_version()
+
+    def test_invalid_cache_is_refreshed(self):
+        for cached in ({'version': '3.5.0'}, {'time': time.time()}, []):
+            write_json(version._cache_path(), cached)
+
+            version.check_version()
+
+        self.assertEqual(self.requests, [3, 3, 3])
+
+    def test_unknown_running_version_is_not_checked(self):
+        apply_pr.__version__ = 'unknown'
+
+        version.check_version()
+
+        self.assertEqual(self.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()